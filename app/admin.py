@@ -66,13 +66,18 @@ def create_admin(app: FastAPI):
     # admin = Admin(app, engine)
 
     # 定义模型视图
+    # 详情和编辑页排除一对多关系，避免加载用户的全部问题和提示
     class UserAdmin(ModelView, model=User):
         column_list = [User.id, User.username, User.model_quota, User.membership_type]
         searchable_columns = [User.username]
+        column_details_exclude_list = [User.questions, User.prompts]
+        form_excluded_columns = [User.questions, User.prompts]
 
     class PromptAdmin(ModelView, model=Prompt):
         column_list = [Prompt.id, Prompt.content, Prompt.user_id]
         searchable_columns = [Prompt.user_id]
+        column_details_exclude_list = [Prompt.user, Prompt.questions]
+        form_excluded_columns = [Prompt.questions]
         
     admin.add_view(UserAdmin)
     admin.add_view(PromptAdmin)
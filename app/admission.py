@@ -0,0 +1,190 @@
+"""
+过载保护：按路由类别做准入控制，过载时优先拒绝低优先级 / 开销大的请求（快速返回 503）
+
+路由按路径前缀分为四类（数字越大优先级越低）：
+- critical    健康检查、指标、登录认证：从不拒绝，保证过载时仍可探活和登录
+- interactive 普通读写接口（默认）
+- expensive   /gpt、全量问题列表、历史记录与搜索等耗时接口
+- bulk        批量导入、多提示并行生成等批处理接口
+
+两种过载信号：
+1. 每个类别有自适应的并发上限（梯度算法）：用短期平均耗时与长期基线耗时之比调整上限，
+   耗时升高（数据库或上游变慢）时上限收缩，恢复后逐步放开；进行中的请求数达到上限时拒绝。
+   上限完全由观测到的耗时决定，无需按接口配置固定阈值。
+2. 事件循环延迟（排队延迟）：后台任务定期测量 sleep 的超时量。延迟越高，拒绝的类别越多：
+   超过 admission_loop_lag_ms 拒绝 bulk，超过 2 倍拒绝 expensive，超过 4 倍拒绝 interactive。
+状态在每个 worker 内独立维护。各类别的并发数、上限、拒绝次数与事件循环延迟见 /metrics（admission_*）。
+"""
+import asyncio
+import math
+from time import perf_counter
+from typing import Dict, Optional
+
+from config import settings
+from metrics import ADMISSION_IN_FLIGHT, ADMISSION_LIMIT, ADMISSION_SHED, EVENT_LOOP_LAG
+from mylogger import logger
+from responses import ORJSONResponse
+
+CRITICAL = "critical"
+INTERACTIVE = "interactive"
+EXPENSIVE = "expensive"
+BULK = "bulk"
+
+# 事件循环延迟超过 admission_loop_lag_ms 的多少倍时拒绝该类别
+LAG_SHED_FACTORS = {BULK: 1, EXPENSIVE: 2, INTERACTIVE: 4}
+
+# 按顺序匹配路径前缀，未匹配的为 interactive
+ROUTE_CLASSES = (
+    ("/healthz", CRITICAL),
+    ("/readyz", CRITICAL),
+    ("/metrics", CRITICAL),
+    ("/auth/login", CRITICAL),
+    ("/auth/logout", CRITICAL),
+    ("/auth/register", CRITICAL),
+    ("/auth/me", CRITICAL),
+    ("/auth/protected", CRITICAL),
+    ("/import", BULK),
+    ("/gpt/fan-out", BULK),
+    ("/gpt", EXPENSIVE),
+    ("/questions/all", EXPENSIVE),
+    ("/questions/history", EXPENSIVE),
+    ("/questions/search", EXPENSIVE),
+)
+
+LAG_SAMPLE_INTERVAL = 0.1
+
+
+def route_class(path: str) -> str:
+    for prefix, cls in ROUTE_CLASSES:
+        if path.startswith(prefix):
+            return cls
+    return INTERACTIVE
+
+
+class AdaptiveLimit:
+    """
+    梯度并发上限（参考 Netflix concurrency-limits 的 Gradient2）：
+    gradient = clamp(容忍倍数 × 长期耗时 / 短期耗时, 0.5, 1)
+    新上限 = 上限 × gradient + sqrt(上限)，再做平滑；请求较少（进行中不足上限一半）时不再放大上限
+    """
+
+    def __init__(self, cls: str, initial: int, min_limit: int, max_limit: int, tolerance: float):
+        self.cls = cls
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self.short_latency: Optional[float] = None
+        self.long_latency: Optional[float] = None
+        ADMISSION_LIMIT.labels(cls).set(self.limit)
+
+    def record(self, latency: float):
+        if self.short_latency is None:
+            self.short_latency = self.long_latency = latency
+            return
+        self.short_latency = 0.8 * self.short_latency + 0.2 * latency
+        self.long_latency = 0.99 * self.long_latency + 0.01 * latency
+        if self.long_latency > 2 * self.short_latency:
+            # 耗时明显下降（如上游恢复），让基线更快地跟随
+            self.long_latency *= 0.95
+
+        gradient = max(0.5, min(1.0, self.tolerance * self.long_latency / self.short_latency))
+        if gradient == 1.0 and self.in_flight < self.limit / 2:
+            return
+        new_limit = self.limit * gradient + math.sqrt(self.limit)
+        self.limit = max(self.min_limit, min(self.max_limit, 0.8 * self.limit + 0.2 * new_limit))
+        ADMISSION_LIMIT.labels(self.cls).set(self.limit)
+
+
+class AdmissionController:
+    def __init__(self):
+        self.limits: Dict[str, AdaptiveLimit] = {
+            cls: AdaptiveLimit(
+                cls,
+                settings.admission_initial_concurrency,
+                settings.admission_min_concurrency,
+                settings.admission_max_concurrency,
+                settings.admission_latency_tolerance,
+            )
+            for cls in (INTERACTIVE, EXPENSIVE, BULK)
+        }
+        self.loop_lag = 0.0
+        self._monitor: Optional[asyncio.Task] = None
+
+    def shed_reason(self, cls: str) -> Optional[str]:
+        """需要拒绝时返回原因，否则返回 None"""
+        if cls == CRITICAL:
+            return None
+        if self.loop_lag * 1000 > settings.admission_loop_lag_ms * LAG_SHED_FACTORS[cls]:
+            return "loop_lag"
+        limit = self.limits[cls]
+        if limit.in_flight >= limit.limit:
+            return "concurrency"
+        return None
+
+    async def _measure_loop_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+            lag = max(0.0, loop.time() - start - LAG_SAMPLE_INTERVAL)
+            # 上升时立即跟随，下降时平滑，避免在过载边缘反复放行
+            self.loop_lag = lag if lag > self.loop_lag else 0.7 * self.loop_lag + 0.3 * lag
+            EVENT_LOOP_LAG.set(self.loop_lag)
+
+    def start(self):
+        if self._monitor is None:
+            self._monitor = asyncio.get_running_loop().create_task(self._measure_loop_lag())
+
+    async def stop(self):
+        if self._monitor is not None:
+            self._monitor.cancel()
+            try:
+                await self._monitor
+            except asyncio.CancelledError:
+                pass
+            self._monitor = None
+
+
+admission = AdmissionController()
+
+
+class AdmissionMiddleware:
+    """纯 ASGI 中间件：按路由类别统计进行中的请求与耗时，过载时直接返回 503"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.admission_control:
+            await self.app(scope, receive, send)
+            return
+
+        cls = route_class(scope["path"])
+        reason = admission.shed_reason(cls)
+        if reason is not None:
+            ADMISSION_SHED.labels(cls, reason).inc()
+            logger.warning(f"过载保护拒绝请求 {scope['method']} {scope['path']} ({cls}, {reason})")
+            response = ORJSONResponse(
+                status_code=503,
+                content={"detail": "Server is overloaded, please retry later"},
+                headers={"Retry-After": "1"},
+            )
+            await response(scope, receive, send)
+            return
+
+        if cls == CRITICAL:
+            await self.app(scope, receive, send)
+            return
+
+        limit = admission.limits[cls]
+        limit.in_flight += 1
+        ADMISSION_IN_FLIGHT.labels(cls).inc()
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limit.in_flight -= 1
+            ADMISSION_IN_FLIGHT.labels(cls).dec()
+            limit.record(perf_counter() - start)
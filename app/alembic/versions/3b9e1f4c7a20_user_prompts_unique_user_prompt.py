@@ -0,0 +1,26 @@
+"""user_prompts unique (user_id, prompt_id)
+
+Revision ID: 3b9e1f4c7a20
+Revises: 1261979ea82d
+Create Date: 2026-10-19 09:12:05.114530
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b9e1f4c7a20'
+down_revision: Union[str, None] = '1261979ea82d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_unique_constraint('uq_user_prompts_user_prompt', 'user_prompts', ['user_id', 'prompt_id'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_user_prompts_user_prompt', 'user_prompts', type_='unique')
@@ -0,0 +1,34 @@
+"""add question routing columns
+
+Revision ID: c4f7a2d91b36
+Revises: 8d2c5a9e0f13
+Create Date: 2026-10-19 18:30:12.417305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4f7a2d91b36'
+down_revision: Union[str, None] = '8d2c5a9e0f13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('questions_and_answers', sa.Column('route', sa.String(), nullable=True))
+    op.add_column('questions_and_answers', sa.Column('model', sa.String(), nullable=True))
+    op.add_column('questions_and_answers', sa.Column('prompt_tokens', sa.Integer(), nullable=True))
+    op.add_column('questions_and_answers', sa.Column('completion_tokens', sa.Integer(), nullable=True))
+    op.add_column('questions_and_answers', sa.Column('latency_ms', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('questions_and_answers', 'latency_ms')
+    op.drop_column('questions_and_answers', 'completion_tokens')
+    op.drop_column('questions_and_answers', 'prompt_tokens')
+    op.drop_column('questions_and_answers', 'model')
+    op.drop_column('questions_and_answers', 'route')
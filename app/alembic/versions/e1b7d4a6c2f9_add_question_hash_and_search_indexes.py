@@ -0,0 +1,45 @@
+"""add question hash columns and search indexes
+
+Revision ID: e1b7d4a6c2f9
+Revises: c4f7a2d91b36
+Create Date: 2026-10-19 19:05:41.208913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1b7d4a6c2f9'
+down_revision: Union[str, None] = 'c4f7a2d91b36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('questions_and_answers', sa.Column('question_hash', sa.String(length=32), nullable=True))
+    op.add_column('questions_and_answers', sa.Column('answer_hash', sa.String(length=32), nullable=True))
+    # 与 models.text_md5 一致（UTF-8 编码的 MD5）
+    op.execute("UPDATE questions_and_answers SET question_hash = md5(question_content), answer_hash = md5(answer_content)")
+    op.create_index('ix_questions_and_answers_user_question_hash', 'questions_and_answers', ['user_id', 'question_hash'], unique=False)
+    op.create_index('ix_questions_and_answers_user_answer_hash', 'questions_and_answers', ['user_id', 'answer_hash'], unique=False)
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index(
+        'ix_questions_and_answers_question_trgm', 'questions_and_answers', ['question_content'], unique=False,
+        postgresql_using='gin', postgresql_ops={'question_content': 'gin_trgm_ops'},
+    )
+    op.create_index(
+        'ix_questions_and_answers_answer_trgm', 'questions_and_answers', ['answer_content'], unique=False,
+        postgresql_using='gin', postgresql_ops={'answer_content': 'gin_trgm_ops'},
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_questions_and_answers_answer_trgm', table_name='questions_and_answers')
+    op.drop_index('ix_questions_and_answers_question_trgm', table_name='questions_and_answers')
+    op.drop_index('ix_questions_and_answers_user_answer_hash', table_name='questions_and_answers')
+    op.drop_index('ix_questions_and_answers_user_question_hash', table_name='questions_and_answers')
+    op.drop_column('questions_and_answers', 'answer_hash')
+    op.drop_column('questions_and_answers', 'question_hash')
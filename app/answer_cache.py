@@ -0,0 +1,101 @@
+"""
+跨用户共享的回答缓存（Redis）
+
+- answer:{prompt_id}:{问题哈希}  回答文本，保留 answer_cache_ttl_seconds；同一提示下相同问题的回答对所有用户通用
+- answer_cache:stats             hash: lookups / hits，/gpt 在用户自己的记录未命中时查询共享缓存的次数与命中次数，
+                                 由预热任务在每次运行时取出并清零，用于计算两次预热之间的命中率（见 cache_warmup.py）
+
+用户的历史记录仍以数据库为准：命中共享缓存时把回答写入该用户的记录，不调用大模型、不扣减额度。
+Prompt 内容变化或被删除时删除该 Prompt 下的全部缓存。Redis 不可用时视为未命中，不影响主流程。
+"""
+from typing import Dict, Iterable, List, Optional
+
+from config import settings
+from database import redis_client
+from mylogger import logger
+from utils import content_hash
+
+KEY_PREFIX = "answer:{}:"
+STATS_KEY = "answer_cache:stats"
+SCAN_BATCH = 500
+
+
+def key(prompt_id: int, question_content: str) -> str:
+    return KEY_PREFIX.format(prompt_id) + content_hash(question_content)
+
+
+async def get_many(prompt_ids: List[int], question_content: str) -> Dict[int, str]:
+    """查询同一问题在多个提示下的共享回答，返回 {prompt_id: 回答}，并计入命中统计"""
+    if not prompt_ids:
+        return {}
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.mget([key(prompt_id, question_content) for prompt_id in prompt_ids])
+        pipe.hincrby(STATS_KEY, "lookups", len(prompt_ids))
+        answers, _ = await pipe.execute()
+        found = {prompt_id: answer for prompt_id, answer in zip(prompt_ids, answers) if answer is not None}
+        if found:
+            await redis_client.hincrby(STATS_KEY, "hits", len(found))
+        return found
+    except Exception as e:
+        logger.error(f"查询共享回答缓存失败: {e}")
+        return {}
+
+
+async def get(prompt_id: int, question_content: str) -> Optional[str]:
+    return (await get_many([prompt_id], question_content)).get(prompt_id)
+
+
+async def put(prompt_id: int, question_content: str, answer_content: str):
+    try:
+        await redis_client.set(key(prompt_id, question_content), answer_content, ex=settings.answer_cache_ttl_seconds)
+    except Exception as e:
+        logger.error(f"写入共享回答缓存失败: {e}")
+
+
+async def put_many(prompt_id_answers: Iterable[tuple], question_content: str):
+    """批量写入同一问题在多个提示下的回答：[(prompt_id, 回答), ...]"""
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for prompt_id, answer_content in prompt_id_answers:
+            pipe.set(key(prompt_id, question_content), answer_content, ex=settings.answer_cache_ttl_seconds)
+        await pipe.execute()
+    except Exception as e:
+        logger.error(f"写入共享回答缓存失败: {e}")
+
+
+async def cached_keys(keys: List[str]) -> List[bool]:
+    """检查一组缓存键（由 key() 生成）是否存在，一次管道往返"""
+    pipe = redis_client.pipeline(transaction=False)
+    for cache_key in keys:
+        pipe.exists(cache_key)
+    return [bool(exists) for exists in await pipe.execute()]
+
+
+async def drop_prompt(prompt_id: int):
+    """Prompt 内容变化或被删除后，删除其下的全部共享回答"""
+    try:
+        batch = []
+        async for cache_key in redis_client.scan_iter(match=KEY_PREFIX.format(prompt_id) + "*", count=SCAN_BATCH):
+            batch.append(cache_key)
+            if len(batch) >= SCAN_BATCH:
+                await redis_client.delete(*batch)
+                batch = []
+        if batch:
+            await redis_client.delete(*batch)
+    except Exception as e:
+        logger.error(f"清理共享回答缓存失败: {e}")
+
+
+async def take_stats() -> Dict[str, int]:
+    """取出并清零命中统计（MULTI 保证两次读取之间的计数不会丢失）"""
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.hgetall(STATS_KEY)
+    pipe.delete(STATS_KEY)
+    stats, _ = await pipe.execute()
+    return {"lookups": int(stats.get("lookups", 0)), "hits": int(stats.get("hits", 0))}
+
+
+async def peek_stats() -> Dict[str, int]:
+    stats = await redis_client.hgetall(STATS_KEY)
+    return {"lookups": int(stats.get("lookups", 0)), "hits": int(stats.get("hits", 0))}
@@ -0,0 +1,222 @@
+"""
+已有回答的 Bloom 过滤器：/gpt 查询用户已有的回答前先检查，确定不存在时跳过数据库查询
+
+- 键为 (user_id, prompt_id, 问题内容) 的哈希，与 get_existing_answer 的查询条件一致
+- 每个 worker 在内存中维护一份。启动后在后台流式扫描问答表（启用分片时扫描全部分片）构建，构建完成前照常查询数据库
+- 写入问答记录时（创建 / 更新问题、保存调用记录、批量导入）先加入本地过滤器，再通过 Redis 发布，
+  其他 worker 订阅后加入各自的过滤器。订阅在扫描开始前建立，扫描期间的写入不会遗漏；
+  订阅连接断开后重新订阅并重新构建，避免漏掉断开期间的写入
+- 发布失败时保留这些键，在后台按间隔重新发布直到 Redis 恢复，其他 worker 收到后即补上，不需要重新构建。
+  待发布的键最多保留 UNPUBLISHED_LIMIT 个：Redis 长时间不可用时其他 worker 的订阅也会中断，恢复后会重新构建
+- 构建时每哈希 HASH_CHUNK 行（约 1.5 ms）让出一次事件循环，避免长时间占用 CPU 触发过载保护的事件循环延迟检测
+- 不支持删除：删除或修改后的旧键仍返回"可能存在"，只会多一次数据库查询，不会漏掉已有的回答。
+  另一 worker 的写入在广播送达前（通常为毫秒级）可能被判为不存在，此时会重新生成一次回答
+- 大小按 answer_filter_capacity 与目标误判率 answer_filter_error_rate 计算：
+  m = -n·ln(p) / ln(2)² 位，k = m/n·ln(2) 个哈希函数。1000 万条、1% 误判率约 11.4 MiB、k=7；
+  0.1% 约 17.1 MiB、k=10。条目超过容量后误判率上升，重启时按当前数据重建（基准见 test/bench_answer_filter.py）
+"""
+import asyncio
+import hashlib
+import math
+import uuid
+from typing import List, Optional, Tuple
+
+from sqlalchemy.future import select
+from config import settings
+from database import async_session_maker, redis_client
+from metrics import ANSWER_FILTER_CHECKS
+from models import Question
+from mylogger import logger
+from sharding import shard_session_makers
+
+CHANNEL = "answer_filter:add"  # 消息格式: "来源|摘要,摘要,..."，忽略自己发布的消息
+SCAN_BATCH = 5000  # 每次从数据库读取的行数
+HASH_CHUNK = 500  # 每哈希多少行让出一次事件循环
+PUBLISH_CHUNK = 1000  # 重新发布时每条消息的键数
+UNPUBLISHED_LIMIT = 100000
+RESUBSCRIBE_DELAY = 5.0
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, digest: bytes):
+        # 双重哈希：由 128 位摘要的两半生成 k 个位置
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, digest: bytes):
+        for position in self._positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, digest: bytes) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(digest))
+
+    def expected_error_rate(self) -> float:
+        """按已加入的条目数估算的误判率 (1 - e^(-kn/m))^k"""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+
+def digest(user_id: int, prompt_id: Optional[int], question_content: str) -> bytes:
+    return hashlib.blake2b(f"{user_id}:{prompt_id}:{question_content}".encode("utf-8"), digest_size=16).digest()
+
+
+class AnswerFilter:
+    def __init__(self):
+        self.bloom: Optional[BloomFilter] = None  # 构建完成后才用于判断
+        self._building: Optional[BloomFilter] = None
+        self._task: Optional[asyncio.Task] = None
+        self._republish: Optional[asyncio.Task] = None
+        self._unpublished: List[bytes] = []  # 发布失败、等待重新发布的键
+        self._stopping = False
+        self.origin = uuid.uuid4().hex[:8]
+
+    def might_exist(self, user_id: int, prompt_id: Optional[int], question_content: str) -> bool:
+        """返回 False 表示该用户一定没有这条回答；未启用或尚未构建完成时总是返回 True"""
+        if self.bloom is None:
+            ANSWER_FILTER_CHECKS.labels("not_ready").inc()
+            return True
+        if digest(user_id, prompt_id, question_content) in self.bloom:
+            ANSWER_FILTER_CHECKS.labels("maybe").inc()
+            return True
+        ANSWER_FILTER_CHECKS.labels("absent").inc()
+        return False
+
+    def _add_local(self, digests: List[bytes]):
+        for bloom in (self.bloom, self._building):
+            if bloom is not None:
+                for item in digests:
+                    bloom.add(item)
+
+    async def add(self, entries: List[Tuple[int, Optional[int], str]]):
+        """写入问答记录后调用：entries 为 [(user_id, prompt_id, question_content), ...]"""
+        if not settings.answer_filter_enabled or not entries:
+            return
+        digests = [digest(*entry) for entry in entries]
+        self._add_local(digests)
+        if self._unpublished:
+            # 之前的键还在等待重新发布，按顺序排在后面
+            self._queue_unpublished(digests)
+            return
+        try:
+            await self._publish(digests)
+        except Exception as e:
+            logger.error(f"广播 Bloom 过滤器更新失败，稍后重新发布: {e}")
+            self._queue_unpublished(digests)
+
+    async def _publish(self, digests: List[bytes]):
+        await redis_client.publish(CHANNEL, self.origin + "|" + ",".join(item.hex() for item in digests))
+
+    def _queue_unpublished(self, digests: List[bytes]):
+        room = UNPUBLISHED_LIMIT - len(self._unpublished)
+        if room < len(digests):
+            logger.warning(f"待重新发布的 Bloom 过滤器键超过 {UNPUBLISHED_LIMIT} 个，丢弃 {len(digests) - max(room, 0)} 个")
+        self._unpublished.extend(digests[:max(room, 0)])
+        if self._republish is None or self._republish.done():
+            self._republish = asyncio.get_running_loop().create_task(self._republish_loop())
+
+    async def _republish_loop(self):
+        """按间隔重新发布失败的键，直到全部送达"""
+        while self._unpublished:
+            await asyncio.sleep(RESUBSCRIBE_DELAY)
+            try:
+                while self._unpublished:
+                    await self._publish(self._unpublished[:PUBLISH_CHUNK])
+                    del self._unpublished[:PUBLISH_CHUNK]
+                logger.info("Bloom 过滤器更新已重新发布")
+            except Exception as e:
+                logger.error(f"重新发布 Bloom 过滤器更新失败，{RESUBSCRIBE_DELAY:g}s 后重试: {e}")
+
+    async def add_questions(self, questions):
+        await self.add([(question.user_id, question.prompt_id, question.question_content) for question in questions])
+
+    async def _scan(self, bloom: BloomFilter):
+        for session_maker in shard_session_makers or [async_session_maker]:
+            async with session_maker() as session:
+                result = await session.stream(
+                    select(Question.user_id, Question.prompt_id, Question.question_content)
+                    .execution_options(yield_per=SCAN_BATCH)
+                )
+                async for rows in result.partitions():
+                    for start in range(0, len(rows), HASH_CHUNK):
+                        for user_id, prompt_id, question_content in rows[start:start + HASH_CHUNK]:
+                            bloom.add(digest(user_id, prompt_id, question_content))
+                        await asyncio.sleep(0)  # 让出事件循环，构建期间不阻塞请求
+
+    async def _listen(self, pubsub):
+        # get_message 的超时处理可能吞掉取消，因此每次轮询都检查是否正在停止
+        while not self._stopping:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            if message is None:
+                continue
+            origin, _, items = message["data"].partition("|")
+            if origin != self.origin and items:
+                self._add_local([bytes.fromhex(item) for item in items.split(",")])
+
+    async def _run(self):
+        while not self._stopping:
+            pubsub = redis_client.pubsub()
+            listener = None
+            try:
+                await pubsub.subscribe(CHANNEL)
+                listener = asyncio.ensure_future(self._listen(pubsub))
+                self._building = BloomFilter(settings.answer_filter_capacity, settings.answer_filter_error_rate)
+                await self._scan(self._building)
+                self.bloom, self._building = self._building, None
+                if self.bloom.count > self.bloom.capacity:
+                    logger.warning(f"Bloom 过滤器条目数 {self.bloom.count} 超过容量 {self.bloom.capacity}，误判率上升，请调大 answer_filter_capacity")
+                logger.info(f"Bloom 过滤器构建完成: {self.bloom.count} 条，{len(self.bloom.bits) / 2 ** 20:.1f} MiB，"
+                            f"估算误判率 {self.bloom.expected_error_rate():.4%}")
+                await listener
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 订阅中断期间可能漏掉其他 worker 的写入：放弃当前过滤器，重新订阅后重新构建
+                logger.error(f"Bloom 过滤器同步中断，将重新构建: {e!r}")
+                self.bloom = self._building = None
+                await asyncio.sleep(RESUBSCRIBE_DELAY)
+            finally:
+                if listener is not None:
+                    # 等监听任务退出后再关闭连接，否则 close 会等待仍在读取的连接
+                    listener.cancel()
+                    await asyncio.gather(listener, return_exceptions=True)
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+
+    def start(self):
+        if settings.answer_filter_enabled and self._task is None:
+            self._stopping = False
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        self._stopping = True
+        if self._republish is not None:
+            self._republish.cancel()
+            self._republish = None
+        if self._unpublished:
+            # 关闭前最后尝试一次，仍失败时其他 worker 在下次重新构建前可能重复生成这些回答
+            try:
+                for start in range(0, len(self._unpublished), PUBLISH_CHUNK):
+                    await self._publish(self._unpublished[start:start + PUBLISH_CHUNK])
+            except Exception as e:
+                logger.error(f"关闭前重新发布 {len(self._unpublished)} 个 Bloom 过滤器键失败: {e}")
+            self._unpublished = []
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+answer_filter = AnswerFilter()
@@ -0,0 +1,160 @@
+"""
+闲时预热共享回答缓存（见 answer_cache.py）
+
+由集群定时任务在 warmup_start_hour 启动（只在 leader 上执行，每天一次），到 warmup_end_hour 停止：
+1. 问题：题库文件 warmup_question_bank（JSON 数组，或每行一个 JSON 的 JSON Lines；元素为问题字符串或含
+   question_content 的对象）加上使用次数最多的 warmup_top_questions 个问题（见 usage.py）
+2. 提示：使用次数最多的 warmup_prompt_count 个 Prompt
+3. 对尚未缓存的 (提示, 问题) 组合按 warmup_rate_per_minute 的速率调用大模型，最多 warmup_concurrency 个同时进行；
+   调用以最低权重的会员等级参与公平排队（见 fair_queue.py），不挤占白天的用户请求，也不扣减任何用户的额度
+4. 结束后生成报告：组合总数、预热前后的覆盖率、生成 / 失败 / 因窗口结束未完成的数量，
+   以及自上次预热以来 /gpt 查询共享缓存的命中率和相对上一次的变化。
+   报告保存在 Redis（最近 warmup_report_history 份），可通过 GET /debug/answer-cache 查看。
+"""
+import asyncio
+import itertools
+from datetime import datetime
+from typing import List
+
+import orjson
+
+import answer_cache
+from config import settings
+from crud.prompt import get_prompts_by_ids
+from database import async_session_maker, redis_client
+from fair_queue import DEFAULT_TIER, upstream_queue
+from llm import generate_answer
+from model_router import route_request
+from mylogger import logger
+from usage import QUESTION_TEXT_LIMIT, top_prompts, top_questions
+
+REPORTS_KEY = "answer_cache:warmup:reports"
+WARMUP_USER_ID = 0  # 预热调用在公平排队中使用的流标识
+
+
+def window_seconds() -> int:
+    """预热窗口时长（秒），结束时刻早于开始时刻表示跨越午夜"""
+    return (settings.warmup_end_hour - settings.warmup_start_hour) % 24 * 3600 or 24 * 3600
+
+
+def load_question_bank(path: str) -> List[str]:
+    if not path:
+        return []
+    with open(path, "rb") as f:
+        raw = f.read().strip()
+    if not raw:
+        return []
+    items = orjson.loads(raw) if raw.startswith(b"[") else [orjson.loads(line) for line in raw.splitlines() if line.strip()]
+    questions = []
+    for item in items:
+        question = item.get("question_content") if isinstance(item, dict) else item
+        if isinstance(question, str) and question.strip():
+            questions.append(question)
+    return questions
+
+
+async def _questions() -> List[str]:
+    questions = load_question_bank(settings.warmup_question_bank)
+    if settings.warmup_top_questions > 0:
+        # 使用统计中只保存了截断后的问题文本，被截断的问题无法还原，跳过
+        questions += [
+            row["question_content"] for row in await top_questions(settings.warmup_top_questions)
+            if row["question_content"] and len(row["question_content"]) < QUESTION_TEXT_LIMIT
+        ]
+    return list(dict.fromkeys(questions))
+
+
+async def _prompts():
+    prompt_ids = [row["prompt_id"] for row in await top_prompts(settings.warmup_prompt_count)]
+    if not prompt_ids:
+        return []
+    async with async_session_maker() as db:
+        prompts = await get_prompts_by_ids(db, prompt_ids)
+    return [prompts[prompt_id] for prompt_id in prompt_ids if prompt_id in prompts]
+
+
+def _hit_rate(stats: dict):
+    return round(stats["hits"] / stats["lookups"], 4) if stats["lookups"] else None
+
+
+async def _last_report():
+    raw = await redis_client.lindex(REPORTS_KEY, 0)
+    return orjson.loads(raw) if raw else None
+
+
+async def recent_reports(limit: int = 10):
+    return [orjson.loads(raw) for raw in await redis_client.lrange(REPORTS_KEY, 0, limit - 1)]
+
+
+async def warm_answer_cache():
+    started_at = datetime.now()
+    loop = asyncio.get_running_loop()
+    stop_at = loop.time() + window_seconds()
+
+    previous = await _last_report()
+    traffic = await answer_cache.take_stats()
+    questions = await _questions()
+    prompts = await _prompts()
+    pairs = list(itertools.product(prompts, questions))
+    cached = await answer_cache.cached_keys([answer_cache.key(prompt.id, question) for prompt, question in pairs]) if pairs else []
+    missing = [pair for pair, hit in zip(pairs, cached) if not hit]
+    logger.info(f"开始预热共享回答缓存: {len(prompts)} 个 Prompt × {len(questions)} 个问题，未缓存 {len(missing)} 个组合")
+
+    generated = failed = 0
+    semaphore = asyncio.Semaphore(settings.warmup_concurrency)
+
+    async def generate(prompt, question):
+        nonlocal generated, failed
+        try:
+            decision = route_request(prompt.content, question, DEFAULT_TIER)
+            async with upstream_queue.slot(WARMUP_USER_ID, DEFAULT_TIER):
+                generation = await generate_answer(prompt.content, decision.question, decision.model, decision.max_tokens)
+            await answer_cache.put(prompt.id, question, generation.text)
+            generated += 1
+        except Exception as e:
+            failed += 1
+            logger.error(f"预热回答失败 prompt_id={prompt.id}: {e!r}")
+        finally:
+            semaphore.release()
+
+    interval = 60 / settings.warmup_rate_per_minute
+    tasks = []
+    try:
+        for prompt, question in missing:
+            await semaphore.acquire()
+            if loop.time() >= stop_at:
+                semaphore.release()
+                break
+            tasks.append(loop.create_task(generate(prompt, question)))
+            await asyncio.sleep(interval)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    total = len(pairs)
+    covered_before = total - len(missing)
+    report = {
+        "started_at": started_at.isoformat(timespec="seconds"),
+        "finished_at": datetime.now().isoformat(timespec="seconds"),
+        "prompts": len(prompts),
+        "questions": len(questions),
+        "pairs": total,
+        "generated": generated,
+        "failed": failed,
+        "skipped": len(missing) - generated - failed,
+        "coverage_before": round(covered_before / total, 4) if total else None,
+        "coverage_after": round((covered_before + generated) / total, 4) if total else None,
+        # 自上次预热以来 /gpt 查询共享缓存的命中率，与上一份报告对比即为上一次预热带来的变化
+        "traffic": {**traffic, "hit_rate": _hit_rate(traffic)},
+        "hit_rate_change": None,
+    }
+    previous_rate = previous["traffic"]["hit_rate"] if previous else None
+    if previous_rate is not None and report["traffic"]["hit_rate"] is not None:
+        report["hit_rate_change"] = round(report["traffic"]["hit_rate"] - previous_rate, 4)
+
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.lpush(REPORTS_KEY, orjson.dumps(report).decode())
+    pipe.ltrim(REPORTS_KEY, 0, settings.warmup_report_history - 1)
+    await pipe.execute()
+    logger.info(f"共享回答缓存预热完成: {report}")
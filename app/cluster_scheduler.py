@@ -0,0 +1,177 @@
+"""
+集群级定时任务调度
+
+每个 worker 都运行 APScheduler，但只有持有 Redis 租约的 leader 会真正执行任务：
+- leader 选举：SET NX PX 获取租约，leader 定期续约；leader 退出或宕机后租约过期，其他 worker 接管
+- 任务锁：同一任务同一时间只会在一个 worker 上运行（防止新旧 leader 交接时重叠）
+- 执行记录：带 run_key 的任务在 job_runs 表中按 (job_name, run_key) 唯一登记，每个周期在集群中只执行一次；
+  失败或长时间未完成的记录可被重新认领
+"""
+import os
+import socket
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+from database import async_session_maker, redis_client
+from models import JobRun
+from mylogger import logger
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+LEADER_KEY = "scheduler:leader"
+JOB_LOCK_KEY = "scheduler:lock:{}"
+
+# 仅当值仍为自己时才续约 / 释放，避免误操作他人持有的租约
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def daily_run_key() -> str:
+    """按天执行的任务使用日期作为 run_key"""
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+@dataclass
+class JobSpec:
+    name: str
+    func: Callable[[], Awaitable[None]]
+    run_key: Optional[Callable[[], str]] = None
+    catch_up: bool = False  # 成为 leader 时立即补跑（run_key 去重，已执行过的周期会跳过）
+    timeout: int = 300  # 任务锁时长（秒），超过该时间仍为 running 的记录视为失败
+
+
+class LeaderElection:
+    def __init__(self, lease_seconds: int):
+        self.lease_ms = lease_seconds * 1000
+        self.is_leader = False
+
+    async def campaign(self) -> bool:
+        """续约或竞选 leader，返回本次是否新当选"""
+        was_leader = self.is_leader
+        try:
+            if self.is_leader:
+                self.is_leader = bool(await redis_client.eval(RENEW_SCRIPT, 1, LEADER_KEY, WORKER_ID, self.lease_ms))
+            if not self.is_leader:
+                self.is_leader = bool(await redis_client.set(LEADER_KEY, WORKER_ID, nx=True, px=self.lease_ms))
+        except Exception as e:
+            # 无法确认租约时主动让出，宁可漏跑也不重复执行
+            logger.error(f"Leader election failed: {e}")
+            self.is_leader = False
+
+        if self.is_leader != was_leader:
+            logger.info(f"Scheduler leadership {'acquired' if self.is_leader else 'lost'} by {WORKER_ID}")
+        return self.is_leader and not was_leader
+
+    async def resign(self):
+        if self.is_leader:
+            self.is_leader = False
+            try:
+                await redis_client.eval(RELEASE_SCRIPT, 1, LEADER_KEY, WORKER_ID)
+            except Exception as e:
+                logger.error(f"Failed to release scheduler leadership: {e}")
+
+
+class ClusterScheduler:
+    def __init__(self, scheduler: AsyncIOScheduler, lease_seconds: int):
+        self.scheduler = scheduler
+        self.election = LeaderElection(lease_seconds)
+        self.jobs: Dict[str, JobSpec] = {}
+        # 续约间隔为租约时长的 1/3，留出两次重试的余量
+        scheduler.add_job(
+            self._campaign, "interval", seconds=max(lease_seconds / 3, 1),
+            id="scheduler:campaign", next_run_time=datetime.now(),
+        )
+
+    def add_job(self, func, trigger: str, *, name: str = None, run_key=None, catch_up: bool = False, timeout: int = 300, **trigger_args):
+        spec = JobSpec(name or func.__name__, func, run_key, catch_up, timeout)
+        self.jobs[spec.name] = spec
+        self.scheduler.add_job(self._run, trigger, args=[spec], id=spec.name, **trigger_args)
+
+    async def shutdown(self):
+        self.scheduler.shutdown(wait=False)
+        await self.election.resign()
+
+    async def _campaign(self):
+        if await self.election.campaign():
+            for spec in self.jobs.values():
+                if spec.catch_up:
+                    self.scheduler.add_job(self._run, args=[spec], id=f"{spec.name}:catch-up", replace_existing=True)
+
+    async def run_now(self, name: str):
+        """立即执行一次任务（不要求 leader，如关闭前持久化缓冲数据），仍通过任务锁与其他 worker 互斥"""
+        await self._run_locked(self.jobs[name])
+
+    async def _run(self, spec: JobSpec):
+        if not self.election.is_leader:
+            return
+        await self._run_locked(spec)
+
+    async def _run_locked(self, spec: JobSpec):
+        lock_key = JOB_LOCK_KEY.format(spec.name)
+        if not await redis_client.set(lock_key, WORKER_ID, nx=True, ex=spec.timeout):
+            logger.info(f"Job {spec.name} is already running elsewhere, skipped")
+            return
+        try:
+            run_key = spec.run_key() if spec.run_key else None
+            if run_key is not None and not await self._claim_run(spec, run_key):
+                logger.info(f"Job {spec.name} [{run_key}] already ran, skipped")
+                return
+
+            error = None
+            try:
+                await spec.func()
+            except Exception as e:
+                error = str(e)
+                logger.error(f"Job {spec.name} failed: {e}")
+
+            if run_key is not None:
+                await self._finish_run(spec, run_key, error)
+        finally:
+            await redis_client.eval(RELEASE_SCRIPT, 1, lock_key, WORKER_ID)
+
+    async def _claim_run(self, spec: JobSpec, run_key: str) -> bool:
+        """登记一次执行；(job_name, run_key) 已存在时，仅允许认领失败或超时的记录"""
+        async with async_session_maker() as db:
+            try:
+                db.add(JobRun(job_name=spec.name, run_key=run_key, worker_id=WORKER_ID, status="running"))
+                await db.commit()
+                return True
+            except IntegrityError:
+                await db.rollback()
+
+            stale_before = datetime.now() - timedelta(seconds=spec.timeout)
+            result = await db.execute(
+                update(JobRun)
+                .where(
+                    JobRun.job_name == spec.name,
+                    JobRun.run_key == run_key,
+                    or_(JobRun.status == "failed", (JobRun.status == "running") & (JobRun.started_at < stale_before)),
+                )
+                .values(status="running", worker_id=WORKER_ID, started_at=datetime.now(), finished_at=None, error=None)
+            )
+            await db.commit()
+            return result.rowcount == 1
+
+    async def _finish_run(self, spec: JobSpec, run_key: str, error: Optional[str]):
+        async with async_session_maker() as db:
+            await db.execute(
+                update(JobRun)
+                .where(JobRun.job_name == spec.name, JobRun.run_key == run_key, JobRun.worker_id == WORKER_ID)
+                .values(status="failed" if error else "success", error=error, finished_at=datetime.now())
+            )
+            await db.commit()
@@ -1,3 +1,5 @@
+from typing import List
+
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -10,6 +12,94 @@ class Settings(BaseSettings):
     max_devices: int = 3
     redis_url: str
     ADMIN_KEY: str
+    usage_flush_interval_seconds: int = 60  # 使用次数计数从 Redis 刷入数据库的间隔
+    usage_question_keep: int = 10000  # 热门问题排行中保留的问题数，刷入计数时裁剪其余问题及其文本，应大于 warmup_top_questions
+    history_cache_ttl_seconds: int = 7 * 24 * 3600  # 历史记录索引在 Redis 中的保留时间，不活跃用户的索引到期后释放
+    warmup_db_connections: int = 5  # 启动时预热的数据库连接数
+    warmup_redis_connections: int = 5  # 启动时预热的 Redis 连接数
+    startup_timeout_seconds: float = 10.0  # 启动预热的最长等待时间
+    readiness_timeout_seconds: float = 2.0  # /readyz 依赖检查的超时时间
+    # 数据库连接池
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout: float = 30.0  # 等待空闲连接的最长时间
+    db_pool_pre_ping: bool = True  # 取出连接时检测是否可用，避免使用被数据库/代理断开的连接
+    db_pool_recycle: int = 1800  # 连接最长存活时间（秒），-1 表示不回收
+    db_statement_cache_size: int = 100  # asyncpg 预编译语句缓存，经 pgbouncer 事务模式连接时需设为 0
+    read_replica_urls: str = ""  # 只读副本连接串，逗号分隔；为空时读写都走主库
+    read_your_writes_seconds: int = 5  # 用户写入后该时间内的读请求仍走主库，应大于副本复制延迟
+    question_shard_urls: str = ""  # 问答记录分片库连接串，逗号分隔；为空时不分片（见 sharding.py）
+    shard_move_grace_seconds: float = 2.0  # 迁移用户前等待其进行中请求结束的时间
+    scheduler_lease_seconds: int = 15  # 定时任务 leader 租约时长，leader 宕机后最多经过该时间完成切换
+    # 大模型调用的限流与调度（见 fair_queue.py），按会员等级配置，格式 "no=1,basic=2,premium=4"
+    upstream_concurrency: int = 32  # 每个 worker 同时进行的大模型调用数上限，超出的请求排队
+    upstream_queue_limit: int = 100  # 每个 worker 中每个会员等级的最大排队数，超出时返回 429
+    tier_weights: str = "no=1,basic=2,premium=4"  # 加权公平排队的权重
+    user_rate_limits: str = "no=10,basic=20,premium=60"  # 每个用户每分钟的调用数上限（令牌桶容量同值），0 表示不限
+    tier_rate_limits: str = "no=300,basic=600,premium=1200"  # 每个会员等级所有用户合计每分钟的调用数上限
+    # 过载保护（见 admission.py）：各路由类别的并发上限根据观测到的耗时自动调整，以下为调整范围
+    admission_control: bool = True
+    admission_initial_concurrency: int = 50  # 每个 worker 中每个类别的初始并发上限
+    admission_min_concurrency: int = 4
+    admission_max_concurrency: int = 500
+    admission_latency_tolerance: float = 2.0  # 短期耗时超过基线的该倍数时开始收缩并发上限
+    admission_loop_lag_ms: float = 100.0  # 事件循环延迟超过该值时开始按优先级拒绝请求
+    # Idempotency-Key（见 idempotency.py）
+    idempotency_ttl_seconds: int = 24 * 3600  # 保存响应的时间，期间相同键的重试直接重放
+    idempotency_lock_seconds: int = 120  # 首个请求的占位超时，应大于请求的最长耗时
+    idempotency_wait_seconds: float = 30.0  # 重复请求等待首个请求完成的最长时间
+    # 请求截止时间（见 deadlines.py），客户端可通过 X-Request-Timeout 请求头指定，不超过上限
+    request_deadline_seconds: float = 30.0
+    gpt_deadline_seconds: float = 90.0
+    import_deadline_seconds: float = 600.0
+    max_request_deadline_seconds: float = 600.0
+    cancel_upstream_on_disconnect: bool = True  # 客户端断开时取消进行中的大模型调用；关闭时仍完成生成并保存，供之后命中缓存
+    keep_idempotent_on_disconnect: bool = True  # 携带 Idempotency-Key 的请求断开后仍完成生成，供重试或等待中的重复请求重放
+    # 大模型路由（见 model_router.py），规则按顺序匹配；环境变量 MODEL_ROUTES 以 JSON 数组配置
+    model_routes: List[dict] = [
+        {"name": "degraded", "model": "deepseek-chat", "max_tokens": 300, "degraded": True},
+        {"name": "premium", "model": "deepseek-chat", "max_tokens": 1000, "tiers": ["premium"]},
+        {"name": "short", "model": "deepseek-chat", "max_tokens": 500, "max_input_tokens": 2000},
+        {"name": "long", "model": "deepseek-chat", "max_tokens": 800},
+    ]
+    max_input_tokens: int = 8000  # Prompt + 问题的估算 token 数上限
+    tokenizer_path: str = ""  # DeepSeek tokenizer.json 路径（需安装 tokenizers），用于精确计算输入 token 数
+    tiktoken_encoding: str = "cl100k_base"  # 未配置 tokenizer_path 且安装了 tiktoken 时使用的编码，为空表示不使用
+    trim_oversized_input: bool = True  # 超过上限时截断问题；关闭时返回 413
+    router_degraded_latency_seconds: float = 20.0  # 上游平均耗时超过该值视为降级
+    router_degraded_error_rate: float = 0.3  # 上游错误率超过该值视为降级
+    router_health_half_life_seconds: float = 60.0  # 上游统计的衰减半衰期，模型不再被调用时降级状态随之恢复
+    fanout_max_prompts: int = 8  # /gpt/fan-out 每个请求最多的提示数
+    fanout_concurrency: int = 4  # /gpt/fan-out 每个请求同时进行的大模型调用数
+    # 共享回答缓存与闲时预热（见 answer_cache.py、cache_warmup.py）
+    answer_cache_ttl_seconds: int = 30 * 24 * 3600
+    warmup_question_bank: str = ""  # 题库文件路径（JSON 数组或 JSON Lines），为空时只预热热门问题
+    warmup_top_questions: int = 200  # 同时预热使用次数最多的问题数
+    warmup_prompt_count: int = 5  # 预热使用次数最多的 Prompt 数
+    warmup_start_hour: int = 2  # 预热窗口（本地时间，整点），到结束时刻停止发起新的调用
+    warmup_end_hour: int = 6
+    warmup_rate_per_minute: float = 20  # 每分钟发起的预热调用数，0 表示不预热
+    warmup_concurrency: int = 2  # 同时进行的预热调用数
+    warmup_report_history: int = 30  # 保留的预热报告份数
+    # 已有回答的 Bloom 过滤器（见 answer_filter.py），每个 worker 占用内存约 capacity × 1.2 字节（1% 误判率）
+    answer_filter_enabled: bool = True
+    answer_filter_capacity: int = 10_000_000
+    answer_filter_error_rate: float = 0.01
+    shutdown_drain_seconds: float = 25.0  # 关闭时等待进行中的大模型调用完成的最长时间（应小于 gunicorn graceful_timeout）
+
+    # 日志
+    log_level: str = "INFO"
+    log_file: str = "app.log"
+    log_sampling: str = ""  # 按 logger 采样 INFO 日志，如 "my_logger=0.1,apscheduler=0.01"
+    log_max_message_chars: int = 2000  # 单条日志最大长度，超出部分截断
+    slow_query_ms: int = 200  # 超过该耗时的 SQL 语句记录到日志
+
+    # 请求剖析
+    profile_sample_rate: float = 0.0  # 随机开启采样剖析的请求比例
+    slow_request_ms: int = 1000  # 超过该耗时的请求保存到慢请求缓冲区
+    slow_request_buffer_size: int = 100
+    explain_slow_query_ms: int = 500  # 超过该耗时的 SELECT 记录 EXPLAIN 执行计划，0 表示关闭
+    query_budget_strict: bool = False  # 路由 SQL 语句数超出预算时抛错（测试/CI 中开启）
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,306 @@
+import asyncio
+import csv
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Tuple, Type, Union
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from models import Prompt, Question, User
+from schemas import PromptImport, QuestionImport, UserImport
+from crud.user import hash_password
+import history_cache
+from answer_filter import answer_filter
+from sharding import SHARDING_ENABLED, allocate_question_ids, group_by_shard, shard_session_makers
+from mylogger import logger
+
+# 每批校验、写入的行数
+BATCH_SIZE = 500
+# 报告中最多返回的错误行数，避免错误过多时响应体过大
+MAX_REPORTED_ERRORS = 1000
+
+# bcrypt 在计算时会释放 GIL，用线程池即可并行哈希
+_hash_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 4)
+
+
+class ImportReport:
+    """
+    批量导入结果：总行数、成功写入数以及逐行错误
+    """
+    def __init__(self):
+        self.total = 0
+        self.inserted = 0
+        self.failed = 0
+        self.errors: List[dict] = []
+
+    def add_error(self, row: int, error: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "error": error})
+
+    def to_dict(self) -> dict:
+        return {
+            "total": self.total,
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": self.errors,
+        }
+
+
+# ---------- 流解析 ----------
+
+def _decode(line: bytes) -> Union[str, UnicodeDecodeError]:
+    try:
+        return line.decode("utf-8").rstrip("\r")
+    except UnicodeDecodeError as e:
+        return e
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Union[str, UnicodeDecodeError]]:
+    """
+    将字节流切分为文本行（兼容请求体流和文件流）
+    不是合法 UTF-8 的行返回 UnicodeDecodeError，由 iter_rows 记为该行的错误，不中断导入
+    """
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield _decode(line)
+    if buffer:
+        yield _decode(buffer)
+
+
+async def _iter_csv_records(lines: AsyncIterator[Union[str, UnicodeDecodeError]]) -> AsyncIterator[Union[str, UnicodeDecodeError]]:
+    """
+    合并被引号包裹的跨行字段：引号个数为偶数时才构成一条完整记录
+    记录中任一行解码失败时整条记录返回该错误（按替换字符解码后计数引号，以确定记录边界）
+    """
+    pending = []
+    quotes = 0
+    error = None
+    async for line in lines:
+        if isinstance(line, UnicodeDecodeError):
+            error = error or line
+            line = line.object.decode("utf-8", errors="replace").rstrip("\r")
+        pending.append(line)
+        quotes += line.count('"')
+        if quotes % 2 == 0:
+            yield error or "\n".join(pending)
+            pending, quotes, error = [], 0, None
+    if pending:
+        yield error or "\n".join(pending)
+
+
+async def iter_rows(lines: AsyncIterator[Union[str, UnicodeDecodeError]], fmt: str) -> AsyncIterator[Tuple[int, object]]:
+    """
+    逐行解析 NDJSON / CSV，返回 (行号, 字典或解析错误)
+    行号从 1 开始，CSV 不计表头
+    """
+    row_no = 0
+    if fmt == "csv":
+        header = None
+        async for record in _iter_csv_records(lines):
+            if isinstance(record, UnicodeDecodeError):
+                if header is None:
+                    # 表头解码失败记为第 0 行，按替换字符解码后的列名继续，后续行号不受影响
+                    yield 0, record
+                    record = record.object.decode("utf-8", errors="replace")
+                else:
+                    row_no += 1
+                    yield row_no, record
+                    continue
+            if not record.strip():
+                continue
+            values = next(csv.reader([record]))
+            if header is None:
+                header = [name.strip() for name in values]
+                continue
+            row_no += 1
+            if len(values) != len(header):
+                yield row_no, ValueError(f"应为 {len(header)} 列，实际 {len(values)} 列")
+                continue
+            # CSV 中的空字符串视为未提供
+            yield row_no, {k: v for k, v in zip(header, values) if v != ""}
+    else:
+        async for line in lines:
+            if isinstance(line, UnicodeDecodeError):
+                row_no += 1
+                yield row_no, line
+                continue
+            if not line.strip():
+                continue
+            row_no += 1
+            try:
+                yield row_no, json.loads(line)
+            except ValueError as e:
+                yield row_no, e
+
+
+async def _iter_batches(rows: AsyncIterator[Tuple[int, object]], schema: Type[BaseModel], report: ImportReport):
+    """
+    按批次校验行数据，无效行记入报告，不影响同批其他行
+    """
+    batch = []
+    async for row_no, data in rows:
+        report.total += 1
+        if isinstance(data, Exception):
+            report.add_error(row_no, f"无效的行: {data}")
+            continue
+        try:
+            batch.append((row_no, schema.model_validate(data)))
+        except ValidationError as e:
+            report.add_error(row_no, "; ".join(
+                f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in e.errors()
+            ))
+            continue
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# ---------- 写入 ----------
+
+async def _insert_batch(db: AsyncSession, model, rows: List[Tuple[int, dict]], report: ImportReport):
+    """
+    集合式批量插入；若整批失败则退回到逐行 SAVEPOINT，定位出错的行
+    """
+    if not rows:
+        return
+    try:
+        await db.execute(insert(model), [values for _, values in rows])
+        await db.commit()
+        report.inserted += len(rows)
+        return
+    except SQLAlchemyError as e:
+        await db.rollback()
+        logger.info(f"批量写入 {model.__tablename__} 失败，改为逐行写入: {e.__class__.__name__}")
+
+    for row_no, values in rows:
+        try:
+            async with db.begin_nested():
+                await db.execute(insert(model), [values])
+            report.inserted += 1
+        except SQLAlchemyError as e:
+            report.add_error(row_no, f"数据库错误: {getattr(e, 'orig', e)}")
+    await db.commit()
+
+
+async def _resolve_user_ids(db: AsyncSession, batch) -> Dict[str, int]:
+    """
+    一次查询解析本批次中出现的 username -> user_id
+    """
+    usernames = {item.username for _, item in batch if item.user_id is None and item.username}
+    if not usernames:
+        return {}
+    result = await db.execute(select(User.username, User.id).where(User.username.in_(usernames)))
+    return dict(result.all())
+
+
+async def _existing_ids(db: AsyncSession, column, ids) -> set:
+    if not ids:
+        return set()
+    result = await db.execute(select(column).where(column.in_(ids)))
+    return set(result.scalars().all())
+
+
+async def import_users(db: AsyncSession, rows: AsyncIterator[Tuple[int, object]]) -> ImportReport:
+    report = ImportReport()
+    loop = asyncio.get_running_loop()
+    async for batch in _iter_batches(rows, UserImport, report):
+        # 过滤已存在及本批次内重复的用户名
+        existing = await _existing_ids(db, User.username, [item.username for _, item in batch])
+        accepted = []
+        for row_no, item in batch:
+            if item.username in existing:
+                report.add_error(row_no, "用户名已存在")
+                continue
+            existing.add(item.username)
+            accepted.append((row_no, item))
+
+        # 并行计算密码哈希
+        hashes = await asyncio.gather(*(
+            loop.run_in_executor(_hash_pool, hash_password, item.password) for _, item in accepted
+        ))
+        values = [
+            (row_no, {
+                "username": item.username,
+                "password_hash": password_hash,
+                "user_type": item.user_type,
+                "status": item.status,
+                "model_quota": 10 if item.model_quota is None else item.model_quota,
+                "membership_type": item.membership_type or "basic",
+            })
+            for (row_no, item), password_hash in zip(accepted, hashes)
+        ]
+        await _insert_batch(db, User, values, report)
+    return report
+
+
+async def import_prompts(db: AsyncSession, rows: AsyncIterator[Tuple[int, object]]) -> ImportReport:
+    report = ImportReport()
+    async for batch in _iter_batches(rows, PromptImport, report):
+        usernames = await _resolve_user_ids(db, batch)
+        user_ids = await _existing_ids(db, User.id, {item.user_id for _, item in batch if item.user_id is not None})
+        values = []
+        for row_no, item in batch:
+            user_id = item.user_id if item.user_id is not None else usernames.get(item.username)
+            if user_id is None or (item.user_id is not None and user_id not in user_ids):
+                report.add_error(row_no, "用户不存在")
+                continue
+            values.append((row_no, {"content": item.content, "user_id": user_id}))
+        await _insert_batch(db, Prompt, values, report)
+    return report
+
+
+async def import_questions(db: AsyncSession, rows: AsyncIterator[Tuple[int, object]]) -> ImportReport:
+    report = ImportReport()
+    async for batch in _iter_batches(rows, QuestionImport, report):
+        usernames = await _resolve_user_ids(db, batch)
+        user_ids = await _existing_ids(db, User.id, {item.user_id for _, item in batch if item.user_id is not None})
+        prompt_ids = await _existing_ids(db, Prompt.id, {item.prompt_id for _, item in batch if item.prompt_id is not None})
+        values = []
+        for row_no, item in batch:
+            user_id = item.user_id if item.user_id is not None else usernames.get(item.username)
+            if user_id is None or (item.user_id is not None and user_id not in user_ids):
+                report.add_error(row_no, "用户不存在")
+                continue
+            if item.prompt_id is not None and item.prompt_id not in prompt_ids:
+                report.add_error(row_no, "Prompt 不存在")
+                continue
+            values.append((row_no, {
+                "question_content": item.question_content,
+                "answer_content": item.answer_content,
+                "user_id": user_id,
+                "prompt_id": item.prompt_id,
+            }))
+        if SHARDING_ENABLED:
+            await _insert_sharded_questions(values, report)
+        else:
+            await _insert_batch(db, Question, values, report)
+        await history_cache.drop_users(row["user_id"] for _, row in values)
+        await answer_filter.add([(row["user_id"], row["prompt_id"], row["question_content"]) for _, row in values])
+    return report
+
+
+async def _insert_sharded_questions(values, report: ImportReport):
+    """分片模式：分配全局 ID 后按用户所在分片分别写入"""
+    for (_, row), question_id in zip(values, await allocate_question_ids(len(values))):
+        row["id"] = question_id
+    for index, user_ids in (await group_by_shard(row["user_id"] for _, row in values)).items():
+        user_ids = set(user_ids)
+        async with shard_session_makers[index]() as shard_db:
+            await _insert_batch(shard_db, Question, [(row_no, row) for row_no, row in values if row["user_id"] in user_ids], report)
+
+
+IMPORTERS = {
+    "users": import_users,
+    "prompts": import_prompts,
+    "questions": import_questions,
+}
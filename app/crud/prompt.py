@@ -1,7 +1,12 @@
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import delete, update
 from sqlalchemy.future import select
-from models import Prompt
+from models import Prompt, Question, UserPrompt
 from schemas import PromptCreate, PromptUpdate
+from sharding import execute_on_shards
+import history_cache
+import answer_cache
+from fieldsets import PROMPT_PREVIEWS, rows_to_dicts, select_columns
 
 
 # 创建提示
@@ -22,6 +27,12 @@ async def get_prompt_by_id(db: AsyncSession, prompt_id: int):
     return result.scalars().first()
 
 
+# 批量获取提示，返回 {prompt_id: Prompt}
+async def get_prompts_by_ids(db: AsyncSession, prompt_ids):
+    result = await db.execute(select(Prompt).where(Prompt.id.in_(prompt_ids)))
+    return {prompt.id: prompt for prompt in result.scalars().all()}
+
+
 # 获取用户的所有提示
 async def get_prompts_by_user(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 10):
     result = await db.execute(
@@ -35,7 +46,11 @@ async def get_prompts_by_user(db: AsyncSession, user_id: int, skip: int = 0, lim
 
 
 # 获取所有提示
-async def get_all_prompts(db: AsyncSession, skip: int = 0, limit: int = 10):
+# 传入 fields 时只查询对应的列（预览字段在 SQL 中截取），返回 dict 列表
+async def get_all_prompts(db: AsyncSession, skip: int = 0, limit: int = 10, fields: tuple = None):
+    if fields:
+        result = await db.execute(select(*select_columns(Prompt, fields, PROMPT_PREVIEWS)).offset(skip).limit(limit))
+        return rows_to_dicts(result, PROMPT_PREVIEWS)
     result = await db.execute(select(Prompt).offset(skip).limit(limit))
     return result.scalars().all()
 
@@ -45,18 +60,32 @@ async def update_prompt(db: AsyncSession, prompt_id: int, prompt_update: PromptU
     db_prompt = await get_prompt_by_id(db, prompt_id)
     if not db_prompt:
         return None
-    for key, value in prompt_update.dict(exclude_unset=True).items():
+    changes = prompt_update.dict(exclude_unset=True)
+    for key, value in changes.items():
         setattr(db_prompt, key, value)
     await db.commit()
     await db.refresh(db_prompt)
+    if "content" in changes:
+        # 共享缓存中的回答基于旧的 Prompt 内容生成
+        await answer_cache.drop_prompt(prompt_id)
     return db_prompt
 
 
 # 删除提示
+# 使用批量语句解除问题关联，避免 ORM 加载该提示下的全部问题后逐行更新
 async def delete_prompt(db: AsyncSession, prompt_id: int):
     db_prompt = await get_prompt_by_id(db, prompt_id)
     if not db_prompt:
         return None
-    await db.delete(db_prompt)
+    await db.execute(
+        update(Question).where(Question.prompt_id == prompt_id).values(prompt_id=None),
+        execution_options={"synchronize_session": False},
+    )
+    await db.execute(delete(UserPrompt).where(UserPrompt.prompt_id == prompt_id), execution_options={"synchronize_session": False})
+    await db.execute(delete(Prompt).where(Prompt.id == prompt_id), execution_options={"synchronize_session": False})
     await db.commit()
+    await execute_on_shards(update(Question).where(Question.prompt_id == prompt_id).values(prompt_id=None))
+    # 引用该 Prompt 的历史记录条目已变化，无法直接确定涉及的用户，清空全部索引
+    await history_cache.drop_all()
+    await answer_cache.drop_prompt(prompt_id)
     return db_prompt
@@ -1,15 +1,21 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.exc import NoResultFound
-from models import Question, User
+from sqlalchemy import and_, case, insert, or_
+from models import Question, User, text_md5
 from schemas import QuestionCreate, QuestionUpdate
 from mylogger import logger
 from fastapi import HTTPException
 from datetime import datetime
+from sharding import allocate_question_ids, new_question_id
+import history_cache
+from answer_filter import answer_filter
+from fieldsets import QUESTION_PREVIEWS, rows_to_dicts, select_columns
 
 # 创建问题
 async def create_question(db: AsyncSession, question: QuestionCreate):
     db_question = Question(
+        id=await new_question_id(),  # 分片模式下由全局计数器分配，否则为 None（数据库自增）
         question_content=question.question_content,
         user_id=question.user_id,
         prompt_id=question.prompt_id,
@@ -17,6 +23,8 @@ async def create_question(db: AsyncSession, question: QuestionCreate):
     db.add(db_question)
     await db.commit()
     await db.refresh(db_question)
+    await history_cache.put_question(db_question)
+    await answer_filter.add_questions([db_question])
     return db_question
 
 # 根据 ID 获取问题
@@ -33,9 +41,15 @@ async def get_questions_by_user(db: AsyncSession, user_id: int):
     )
     return result.scalars().all()
 
-# 获取所有问题
-async def get_all_questions(db: AsyncSession, skip: int = 0, limit: int = 10):
-    result = await db.execute(select(Question).offset(skip).limit(limit))
+# 获取所有问题（传入 user_id 时仅返回该用户的问题）
+# 传入 fields 时只查询对应的列（预览字段在 SQL 中截取），返回 dict 列表
+async def get_all_questions(db: AsyncSession, skip: int = 0, limit: int = 10, user_id: int = None, fields: tuple = None):
+    query = select(*select_columns(Question, fields, QUESTION_PREVIEWS)) if fields else select(Question)
+    if user_id is not None:
+        query = query.where(Question.user_id == user_id)
+    result = await db.execute(query.order_by(Question.id).offset(skip).limit(limit))
+    if fields:
+        return rows_to_dicts(result, QUESTION_PREVIEWS)
     return result.scalars().all()
 
 # 更新问题
@@ -47,6 +61,8 @@ async def update_question(db: AsyncSession, question_id: int, question_update: Q
         setattr(db_question, key, value)
     await db.commit()
     await db.refresh(db_question)
+    await history_cache.put_question(db_question)
+    await answer_filter.add_questions([db_question])
     return db_question
 
 # 删除问题
@@ -56,10 +72,15 @@ async def delete_question(db: AsyncSession, question_id: int):
         return None
     await db.delete(db_question)
     await db.commit()
+    await history_cache.remove_question(db_question.user_id, db_question.id)
     return db_question
 
 # GPT API调用相关
-async def create_call_record(db: AsyncSession, user_id: int, question_content: str, prompt_id: int, answer_content: str = None):
+# question_db 为问答所在分片的会话，未分片时与 db 相同，问答与额度扣减在同一事务中提交
+# routing 为大模型路由结果与用量（route / model / prompt_tokens / completion_tokens / latency_ms）
+# charge_quota 为 False 时（回答来自共享缓存，未调用大模型）只保存记录，不扣减额度
+async def create_call_record(db: AsyncSession, user_id: int, question_content: str, prompt_id: int, answer_content: str = None, question_db: AsyncSession = None, routing: dict = None, charge_quota: bool = True):
+    question_db = question_db or db
     # 查询用户
     result = await db.execute(select(User).where(User.id == user_id))
     user = result.scalars().first()
@@ -67,33 +88,96 @@ async def create_call_record(db: AsyncSession, user_id: int, question_content: s
         raise HTTPException(status_code=404, detail="User not found")
 
     # 检查用户的 model_quota 是否足够
-    if user.model_quota <= 0:
+    if charge_quota and user.model_quota <= 0:
         raise HTTPException(status_code=403, detail="Insufficient model quota")
     
     # 创建问题记录并存储在 questions_and_answers 表中
     record = Question(
+        id=await new_question_id(),
         question_content=question_content,
         answer_content=answer_content,
         user_id=user_id,
         prompt_id=prompt_id,
+        **(routing or {}),
     )
-    db.add(record)
+    question_db.add(record)
+    if question_db is not db:
+        # 跨库无法共用事务：先保存回答，再扣减额度
+        await question_db.commit()
 
     # 减少用户的 model_quota
-    user.model_quota -= 1
-    user.updated_at = datetime.now()
+    if charge_quota:
+        user.model_quota -= 1
+        user.updated_at = datetime.now()
 
     await db.commit()
-    await db.refresh(record)
+    await question_db.refresh(record)
+    await history_cache.put_question(record)
+    await answer_filter.add_questions([record])
     return record
 
-# 查询是否已存在匹配的提问内容和提示词的记录
+# 批量保存同一问题在多个提示词下的调用记录，一次扣减额度（同一事务；分片模式下先保存回答再扣减额度）
+# records 为 [(prompt_id, answer_content, routing), ...]，charged 为需要扣减的额度（默认每条记录扣 1）
+async def create_call_records(db: AsyncSession, user_id: int, question_content: str, records: list, question_db: AsyncSession = None, charged: int = None):
+    question_db = question_db or db
+    result = await db.execute(select(User).where(User.id == user_id))
+    user = result.scalars().first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    charged = len(records) if charged is None else charged
+    if user.model_quota < charged:
+        raise HTTPException(status_code=403, detail="Insufficient model quota")
+
+    ids = await allocate_question_ids(len(records))
+    values = []
+    for question_id, (prompt_id, answer_content, routing) in zip(ids, records):
+        row = {
+            "question_content": question_content,
+            "answer_content": answer_content,
+            "user_id": user_id,
+            "prompt_id": prompt_id,
+            **(routing or {}),
+        }
+        if question_id is not None:
+            row["id"] = question_id
+        values.append(row)
+    # 批量 INSERT ... RETURNING：一条语句写入并返回 ORM 对象
+    result = await question_db.execute(insert(Question).returning(Question), values)
+    rows = result.scalars().all()
+    if question_db is not db:
+        await question_db.commit()
+
+    if charged:
+        user.model_quota -= charged
+        user.updated_at = datetime.now()
+    await db.commit()
+    await history_cache.put_questions(rows)
+    await answer_filter.add_questions(rows)
+    return rows
+
+# 批量查询同一问题在多个提示词下的已有回答，返回 {prompt_id: Question}
+async def get_existing_answers(db: AsyncSession, question_content: str, prompt_ids, user_id: int):
+    result = await db.execute(
+        select(Question).where(
+            Question.user_id == user_id,
+            Question.question_hash == text_md5(question_content),
+            Question.question_content == question_content,
+            Question.prompt_id.in_(prompt_ids),
+        )
+    )
+    answers = {}
+    for question in result.scalars().all():
+        answers.setdefault(question.prompt_id, question)
+    return answers
+
+# 查询是否已存在匹配的提问内容和提示词的记录（通过 (user_id, question_hash) 索引查找，再比较原文）
 async def get_existing_answer(db: AsyncSession, question_content: str, prompt_id: int, user_id: int):
     try:
         result = await db.execute(
             select(Question)
             .where(
                 Question.user_id == user_id,
+                Question.question_hash == text_md5(question_content),
                 Question.question_content == question_content,
                 Question.prompt_id == prompt_id,
             )
@@ -109,3 +193,48 @@ async def get_existing_answer(db: AsyncSession, question_content: str, prompt_id
     except NoResultFound:
         logger.info("没有记录")
         return None
+
+# 按内容精确查找用户的问答（问题或回答与 content 完全相同）
+# 通过 (user_id, 哈希) 索引定位，再比较原文排除哈希碰撞
+async def get_question_by_content(db: AsyncSession, user_id: int, content: str):
+    content_hash = text_md5(content)
+    result = await db.execute(
+        select(Question).where(
+            Question.user_id == user_id,
+            or_(
+                and_(Question.question_hash == content_hash, Question.question_content == content),
+                and_(Question.answer_hash == content_hash, Question.answer_content == content),
+            ),
+        )
+    )
+    return result.scalars().first()
+
+def _escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+# 搜索用户的历史问答：每个关键词都须出现在问题或回答中（不区分大小写，PostgreSQL 上由 pg_trgm GIN 索引支持），
+# 关键词出现在问题中计 2 分、出现在回答中计 1 分，按得分、创建时间倒序排列；多取一条用于判断是否还有下一页
+async def search_questions(db: AsyncSession, user_id: int, terms: list, skip: int = 0, limit: int = 20):
+    patterns = [f"%{_escape_like(term)}%" for term in terms]
+    score = sum(
+        case((Question.question_content.ilike(pattern, escape="\\"), 2), else_=0)
+        + case((Question.answer_content.ilike(pattern, escape="\\"), 1), else_=0)
+        for pattern in patterns
+    )
+    result = await db.execute(
+        select(
+            Question.id, Question.prompt_id, Question.question_content, Question.answer_content,
+            Question.created_at, score.label("score"),
+        )
+        .where(
+            Question.user_id == user_id,
+            *(
+                or_(Question.question_content.ilike(pattern, escape="\\"), Question.answer_content.ilike(pattern, escape="\\"))
+                for pattern in patterns
+            ),
+        )
+        .order_by(score.desc(), Question.created_at.desc(), Question.id.desc())
+        .offset(skip)
+        .limit(limit + 1)
+    )
+    return result.all()
@@ -1,8 +1,11 @@
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import delete, update
 from sqlalchemy.future import select
-from models import User
+from models import User, Prompt, Question, UserPrompt
 from schemas import UserCreate, UserUpdate
 from passlib.context import CryptContext
+from sharding import SHARDING_ENABLED, execute_on_shards, forget_user
+import history_cache
 
 # 配置密码哈希算法
 pwd_context = CryptContext(
@@ -60,10 +63,35 @@ async def update_user(db: AsyncSession, user_id: int, user_update: UserUpdate):
     return db_user
 
 # 删除用户
+# 使用批量语句删除关联数据，避免 ORM 逐个加载 questions / prompts 关系并逐行更新
 async def delete_user(db: AsyncSession, user_id: int):
     db_user = await get_user_by_id(db, user_id)  # 异步获取用户
     if not db_user:
         return None
-    await db.delete(db_user)  # 异步删除
+    user_prompt_ids = select(Prompt.id).where(Prompt.user_id == user_id).scalar_subquery()
+    if SHARDING_ENABLED:
+        # 分片库中没有 prompts 表，需先取出 Prompt ID 再到各分片执行
+        prompt_ids = (await db.execute(select(Prompt.id).where(Prompt.user_id == user_id))).scalars().all()
+    # 其他用户引用了该用户 Prompt 的问题保留，只解除关联
+    await db.execute(
+        update(Question).where(Question.prompt_id.in_(user_prompt_ids)).values(prompt_id=None),
+        execution_options={"synchronize_session": False},
+    )
+    await db.execute(delete(Question).where(Question.user_id == user_id), execution_options={"synchronize_session": False})
+    await db.execute(
+        delete(UserPrompt).where((UserPrompt.user_id == user_id) | UserPrompt.prompt_id.in_(user_prompt_ids)),
+        execution_options={"synchronize_session": False},
+    )
+    await db.execute(delete(Prompt).where(Prompt.user_id == user_id), execution_options={"synchronize_session": False})
+    await db.execute(delete(User).where(User.id == user_id), execution_options={"synchronize_session": False})
     await db.commit()  # 异步提交
+
+    if SHARDING_ENABLED:
+        await execute_on_shards(
+            update(Question).where(Question.prompt_id.in_(prompt_ids)).values(prompt_id=None),
+            delete(Question).where(Question.user_id == user_id),
+        )
+        await forget_user(user_id)
+    # 其他用户的历史记录中可能引用了被删除的 Prompt
+    await history_cache.drop_all()
     return db_user
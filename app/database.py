@@ -1,40 +1,159 @@
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional
 from fastapi import HTTPException
+from sqlalchemy import event, text
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from config import settings
 from mylogger import logger
+from metrics import InstrumentedRedis, TimedAsyncAdaptedQueuePool, instrument_engine
 
-# 引入异步 Redis 客户端
-import aioredis
-
-# 异步 Redis 客户端
-redis_client = aioredis.from_url(
+# 异步 Redis 客户端（记录每条命令耗时）
+redis_client = InstrumentedRedis.from_url(
     settings.redis_url, 
     decode_responses=True, 
     password="cuipi123"
 )
 
-# 异步数据库引擎
-engine = create_async_engine(
-    settings.DATABASE_URL,
-    echo=True  # 设置为 True 可用于调试，生产环境建议关闭
-)
+# 创建异步数据库引擎，连接池参数由 Settings 配置
+def build_engine(url: str):
+    connect_args = {}
+    if url.startswith("postgresql+asyncpg"):
+        connect_args["statement_cache_size"] = settings.db_statement_cache_size
+    engine = create_async_engine(
+        url,
+        poolclass=TimedAsyncAdaptedQueuePool,  # 记录连接池等待时间
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        pool_recycle=settings.db_pool_recycle,
+        connect_args=connect_args,
+    )
+    # 记录语句耗时，只有慢查询写入日志，更慢的查询记录执行计划
+    instrument_engine(engine, slow_query_ms=settings.slow_query_ms, explain_slow_query_ms=settings.explain_slow_query_ms)
+    return engine
+
+
+# 当前请求的用户（由 get_current_user 设置），用于读写一致性路由
+current_user_id: ContextVar[Optional[int]] = ContextVar("current_user_id", default=None)
+
+
+# 主库会话：提交了写操作且已知当前用户时，标记该用户近期有写入，
+# 之后 read_your_writes_seconds 内该用户的读请求也走主库，保证读到自己的写入
+class PrimarySession(AsyncSession):
+    async def commit(self):
+        await super().commit()
+        user_id = current_user_id.get()
+        if self.info.pop("has_writes", False) and user_id and read_session_makers:
+            await mark_recent_write(user_id)
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_flush_writes(session, flush_context):
+    session.info["has_writes"] = True
+
 
-# 异步会话工厂
+@event.listens_for(Session, "do_orm_execute")
+def _mark_statement_writes(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["has_writes"] = True
+
+
+# 主库引擎与会话工厂
+engine = build_engine(settings.DATABASE_URL)
 async_session_maker = sessionmaker(
     bind=engine,
-    class_=AsyncSession,
+    class_=PrimarySession,
     expire_on_commit=False
 )
 
+# 只读副本，轮询使用；未配置时读请求也走主库
+read_engines = [build_engine(url.strip()) for url in settings.read_replica_urls.split(",") if url.strip()]
+read_session_makers = [
+    sessionmaker(bind=read_engine, class_=AsyncSession, expire_on_commit=False)
+    for read_engine in read_engines
+]
+_replica_cycle = itertools.cycle(read_session_makers)
+
+RECENT_WRITE_KEY = "db:recent_write:{}"
+
+
+async def mark_recent_write(user_id: int):
+    try:
+        await redis_client.set(RECENT_WRITE_KEY.format(user_id), 1, ex=settings.read_your_writes_seconds)
+    except Exception as e:
+        logger.error(f"Failed to mark recent write for user {user_id}: {e}")
+
+
+async def has_recent_write(user_id: int) -> bool:
+    try:
+        return bool(await redis_client.exists(RECENT_WRITE_KEY.format(user_id)))
+    except Exception as e:
+        # 无法确认时走主库，宁可多占主库也不返回过期数据
+        logger.error(f"Failed to check recent write for user {user_id}: {e}")
+        return True
+
+
+@asynccontextmanager
+async def read_session(user_id: int = None):
+    """
+    只读会话：优先使用副本；用户近期有写入时使用主库
+    """
+    if not read_session_makers or (user_id and await has_recent_write(user_id)):
+        session_maker = async_session_maker
+    else:
+        session_maker = next(_replica_cycle)
+    async with session_maker() as session:
+        yield session
+
+
 Base = declarative_base()
 
-# Dependency：获取异步数据库会话
+# Dependency：获取异步数据库会话（主库）
 async def get_db():
     async with async_session_maker() as session:
         yield session
 
+# Dependency：获取只读数据库会话（无用户信息，不做读写一致性路由）
+async def get_read_db():
+    async with read_session() as session:
+        yield session
+
+
+# 预热连接池：并发建立若干数据库和 Redis 连接，避免首批请求承担建连开销
+async def warm_up_pools(db_connections: int, redis_connections: int):
+    async def warm_one():
+        # 每个连接在自己的 async with 中打开，建连失败或 wait_for 超时取消时已打开的连接也会归还连接池
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    async def warm_db():
+        # 各连接同时处于建连中，连接池会保留全部 db_connections 个连接
+        await asyncio.gather(*(warm_one() for _ in range(db_connections)))
+
+    async def warm_redis():
+        await asyncio.gather(*(redis_client.ping() for _ in range(redis_connections)))
+
+    await asyncio.gather(warm_db(), warm_redis())
+
+
+# 依赖检查：返回数据库与 Redis 的状态
+async def check_dependencies() -> dict:
+    async def check_db():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    results = await asyncio.gather(check_db(), redis_client.ping(), return_exceptions=True)
+    return {
+        name: "ok" if not isinstance(result, Exception) else f"error: {result}"
+        for name, result in zip(("database", "redis"), results)
+    }
+
 
 # 配置
 LOGIN_ATTEMPT_LIMIT = 5  # 最大尝试次数
@@ -0,0 +1,165 @@
+"""
+请求截止时间与客户端断开检测
+
+- 每个请求有一个截止时间：取自请求头 X-Request-Timeout（秒），否则使用路由类别的默认值，不超过 max_request_deadline_seconds。
+  截止时间保存在上下文变量中，整个处理过程（数据库、Redis、排队与大模型调用）在截止时被取消，返回 504；
+  大模型调用额外把剩余时间作为 SDK 的超时参数传给上游。
+- 请求体读取完毕后监听 http.disconnect。客户端断开时，通过 unless_disconnected() 执行的大模型调用被取消，
+  不再消耗 token、也不保存结果（返回 499）。以下情况会继续完成生成并保存：
+  - cancel_upstream_on_disconnect 关闭（回答值得缓存，供之后相同的问题直接命中）
+  - 请求携带 Idempotency-Key 且 keep_idempotent_on_disconnect 开启：客户端重试或正在等待同一结果的请求会直接重放
+"""
+import asyncio
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi import HTTPException
+from config import settings
+from metrics import DEADLINE_EXCEEDED, UPSTREAM_CANCELLED
+from mylogger import logger
+from responses import ORJSONResponse
+
+TIMEOUT_HEADER = b"x-request-timeout"
+
+# 按顺序匹配路径前缀，返回默认截止时间的配置项
+ROUTE_DEADLINES = (
+    ("/gpt", "gpt_deadline_seconds"),
+    ("/import", "import_deadline_seconds"),
+)
+
+current_deadline: ContextVar[Optional[float]] = ContextVar("current_deadline", default=None)
+client_disconnected: ContextVar[Optional[asyncio.Event]] = ContextVar("client_disconnected", default=None)
+cancel_on_disconnect: ContextVar[bool] = ContextVar("cancel_on_disconnect", default=False)
+
+
+def _default_timeout(path: str) -> float:
+    for prefix, name in ROUTE_DEADLINES:
+        if path.startswith(prefix):
+            return getattr(settings, name)
+    return settings.request_deadline_seconds
+
+
+def _request_timeout(scope) -> float:
+    timeout = _default_timeout(scope["path"])
+    for name, value in scope["headers"]:
+        if name == TIMEOUT_HEADER:
+            try:
+                timeout = float(value)
+            except ValueError:
+                pass
+            break
+    return max(0.0, min(timeout, settings.max_request_deadline_seconds))
+
+
+def remaining() -> Optional[float]:
+    """距截止时间的剩余秒数；不在请求上下文中时返回 None"""
+    deadline = current_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - asyncio.get_running_loop().time()
+
+
+def check_deadline():
+    """截止时间已过时直接返回 504，避免开始注定无法完成的工作"""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+
+
+async def unless_disconnected(coro):
+    """
+    执行 coro（大模型调用）；客户端在完成前断开且允许取消时，取消 coro 并返回 499
+    """
+    task = asyncio.ensure_future(coro)
+    disconnected = client_disconnected.get()
+    if disconnected is None or not cancel_on_disconnect.get():
+        return await task
+
+    waiter = asyncio.ensure_future(disconnected.wait())
+    try:
+        await asyncio.wait({task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        # 截止时间到达或请求被取消
+        task.cancel()
+        UPSTREAM_CANCELLED.labels("deadline").inc()
+        raise
+    finally:
+        waiter.cancel()
+
+    if task.done():
+        return task.result()
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    UPSTREAM_CANCELLED.labels("disconnect").inc()
+    logger.info("客户端已断开，取消进行中的大模型调用")
+    raise HTTPException(status_code=499, detail="Client closed request")
+
+
+class DeadlineMiddleware:
+    """纯 ASGI 中间件：设置请求截止时间，超时取消处理并返回 504；请求体读完后监听客户端断开"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        loop = asyncio.get_running_loop()
+        timeout = _request_timeout(scope)
+        disconnected = asyncio.Event()
+        watcher = None
+        has_idempotency_key = any(name == b"idempotency-key" for name, _ in scope["headers"])
+        tokens = (
+            current_deadline.set(loop.time() + timeout),
+            client_disconnected.set(disconnected),
+            cancel_on_disconnect.set(
+                settings.cancel_upstream_on_disconnect
+                and not (has_idempotency_key and settings.keep_idempotent_on_disconnect)
+            ),
+        )
+
+        async def watch_disconnect():
+            # 请求体读完后服务器只会再发送 http.disconnect
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+
+        async def wrapped_receive():
+            nonlocal watcher
+            if watcher is not None:
+                # 由监听任务独占 receive，其他读取者等待断开事件
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            elif not message.get("more_body"):
+                watcher = loop.create_task(watch_disconnect())
+            return message
+
+        response_started = False
+
+        async def wrapped_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await asyncio.wait_for(self.app(scope, wrapped_receive, wrapped_send), timeout)
+        except asyncio.TimeoutError:
+            DEADLINE_EXCEEDED.inc()
+            logger.warning(f"请求超过截止时间 {timeout}s: {scope['method']} {scope['path']}")
+            if not response_started:
+                response = ORJSONResponse(status_code=504, content={"detail": "Request deadline exceeded"})
+                await response(scope, receive, send)
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            for var, token in zip((current_deadline, client_disconnected, cancel_on_disconnect), tokens):
+                var.reset(token)
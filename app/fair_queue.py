@@ -0,0 +1,188 @@
+"""
+大模型调用的准入与调度（按会员等级 membership_type 区分：no / basic / premium）
+
+1. 限流：Redis 令牌桶，每个用户一个桶、每个会员等级一个共享桶，一次 Lua 调用原子地检查并扣减。
+   超出限额的请求直接返回 429（带 Retry-After），不进入排队、不占用 worker。
+2. 调度：每个 worker 同时进行的大模型调用数不超过 upstream_concurrency，其余请求排队，
+   按用户加权公平排队（WFQ）出队：每个用户是一个流，权重取决于会员等级，
+   高等级用户获得更多的调用份额，单个用户的大量请求只会排在自己的流后面，不会饿死其他用户。
+   某个等级排队已满时同样直接返回 429。
+各等级的排队长度、等待时间与拒绝次数见 /metrics（upstream_queue_*）。
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from time import perf_counter
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+from config import settings
+from database import redis_client
+from metrics import UPSTREAM_QUEUE_DEPTH, UPSTREAM_QUEUE_WAIT, UPSTREAM_REJECTIONS
+from mylogger import logger
+
+DEFAULT_TIER = "no"
+USER_BUCKET_KEY = "ratelimit:user:{}"
+TIER_BUCKET_KEY = "ratelimit:tier:{}"
+
+# KEYS: 用户桶、等级桶；ARGV: 当前时间, 用户每秒速率, 用户桶容量, 等级每秒速率, 等级桶容量
+# 两个桶都有令牌时各扣减一个并返回 0，否则不扣减，返回需要等待的秒数（字符串，避免被截断为整数）
+TAKE_TOKEN_SCRIPT = """
+local now = tonumber(ARGV[1])
+local function refill(key, rate, capacity)
+    local bucket = redis.call('hmget', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    return math.min(capacity, tokens + math.max(0, now - ts) * rate)
+end
+local function save(key, tokens, rate, capacity)
+    redis.call('hset', key, 'tokens', tokens, 'ts', now)
+    redis.call('expire', key, math.ceil(capacity / rate) + 1)
+end
+
+local user_rate, user_capacity = tonumber(ARGV[2]), tonumber(ARGV[3])
+local tier_rate, tier_capacity = tonumber(ARGV[4]), tonumber(ARGV[5])
+local user_tokens = refill(KEYS[1], user_rate, user_capacity)
+local tier_tokens = refill(KEYS[2], tier_rate, tier_capacity)
+
+local wait = 0
+if user_tokens < 1 then wait = math.max(wait, (1 - user_tokens) / user_rate) end
+if tier_tokens < 1 then wait = math.max(wait, (1 - tier_tokens) / tier_rate) end
+if wait == 0 then
+    user_tokens = user_tokens - 1
+    tier_tokens = tier_tokens - 1
+end
+save(KEYS[1], user_tokens, user_rate, user_capacity)
+save(KEYS[2], tier_tokens, tier_rate, tier_capacity)
+return tostring(wait)
+"""
+
+
+def _parse_tiers(spec: str) -> Dict[str, float]:
+    """解析 "no=1,basic=2,premium=4" 形式的按等级配置"""
+    values = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        tier, _, value = item.partition("=")
+        values[tier.strip()] = float(value)
+    return values
+
+
+TIER_WEIGHTS = _parse_tiers(settings.tier_weights)
+USER_RATE_LIMITS = _parse_tiers(settings.user_rate_limits)
+TIER_RATE_LIMITS = _parse_tiers(settings.tier_rate_limits)
+
+
+def tier_of(user) -> str:
+    tier = user.membership_type or DEFAULT_TIER
+    return tier if tier in TIER_WEIGHTS else DEFAULT_TIER
+
+
+def _too_many_requests(tier: str, reason: str, retry_after: float, detail: str) -> HTTPException:
+    UPSTREAM_REJECTIONS.labels(tier, reason).inc()
+    return HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+async def check_rate_limit(user_id: int, tier: str):
+    """扣减用户与等级令牌桶各一个令牌，超出限额时抛出 429；Redis 不可用时放行"""
+    user_limit = USER_RATE_LIMITS.get(tier, 0)
+    tier_limit = TIER_RATE_LIMITS.get(tier, 0)
+    if user_limit <= 0 or tier_limit <= 0:
+        return  # 未配置或配置为 0 表示不限流
+    try:
+        wait = float(await redis_client.eval(
+            TAKE_TOKEN_SCRIPT, 2, USER_BUCKET_KEY.format(user_id), TIER_BUCKET_KEY.format(tier),
+            time.time(), user_limit / 60, user_limit, tier_limit / 60, tier_limit,
+        ))
+    except Exception as e:
+        logger.error(f"限流检查失败: {e}")
+        return
+    if wait > 0:
+        raise _too_many_requests(tier, "rate_limit", wait, "Rate limit exceeded, please retry later")
+
+
+class FairQueue:
+    """
+    单个 worker 内的加权公平排队：
+    请求的完成标签 = max(虚拟时间, 该用户上一个请求的完成标签) + 1 / 权重，按完成标签从小到大获得调用名额；
+    虚拟时间为最近出队请求的完成标签。
+    """
+
+    def __init__(self, concurrency: int, queue_limit: int):
+        self.available = concurrency
+        self.concurrency = concurrency
+        self.queue_limit = queue_limit
+        self.virtual_time = 0.0
+        self.last_finish: Dict[int, float] = {}
+        self.depth: Dict[str, int] = {}
+        self.heap = []
+        self.sequence = itertools.count()
+        self.average_service_time = 1.0  # 调用耗时的指数移动平均，用于估算 Retry-After
+
+    async def acquire(self, user_id: int, tier: str):
+        if self.available > 0 and not self.heap:
+            self.available -= 1
+            UPSTREAM_QUEUE_WAIT.labels(tier).observe(0)
+            return
+
+        depth = self.depth.get(tier, 0)
+        if depth >= self.queue_limit:
+            retry_after = len(self.heap) / self.concurrency * self.average_service_time
+            raise _too_many_requests(tier, "queue_full", retry_after, "Too many queued requests, please retry later")
+
+        finish = max(self.virtual_time, self.last_finish.get(user_id, 0.0)) + 1 / TIER_WEIGHTS[tier]
+        self.last_finish[user_id] = finish
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.heap, (finish, next(self.sequence), future, tier))
+        self.depth[tier] = depth + 1
+        UPSTREAM_QUEUE_DEPTH.labels(tier).inc()
+
+        start = perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已获得名额但请求被取消（如客户端断开），把名额交给下一个请求
+                self.release()
+            raise
+        finally:
+            self.depth[tier] -= 1
+            UPSTREAM_QUEUE_DEPTH.labels(tier).dec()
+            UPSTREAM_QUEUE_WAIT.labels(tier).observe(perf_counter() - start)
+
+    def release(self, service_time: Optional[float] = None):
+        if service_time is not None:
+            self.average_service_time = 0.9 * self.average_service_time + 0.1 * service_time
+        while self.heap:
+            finish, _, future, _ = heapq.heappop(self.heap)
+            if future.cancelled():
+                continue
+            self.virtual_time = finish
+            future.set_result(None)
+            return
+        # 所有流都已空闲，完成标签不再影响后续请求
+        self.last_finish.clear()
+        self.available += 1
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, tier: str):
+        await self.acquire(user_id, tier)
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.release(perf_counter() - start)
+
+
+upstream_queue = FairQueue(settings.upstream_concurrency, settings.upstream_queue_limit)
+
+
+@asynccontextmanager
+async def upstream_slot(user):
+    """限流检查通过后，按加权公平排队等待调用名额；调用结束后释放"""
+    tier = tier_of(user)
+    await check_rate_limit(user.id, tier)
+    async with upstream_queue.slot(user.id, tier):
+        yield
@@ -0,0 +1,72 @@
+"""
+列表接口的字段投影
+
+- fields=id,created_at,answer_preview：只返回指定字段，SQL 中只查询对应的列
+- summary=true：返回 ID、日期与截断后的预览（*_preview），完整文本通过详情接口按需获取
+预览在 SQL 中用 substr 截取，长文本列不会整列读出和传输。
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import func
+
+PREVIEW_CHARS = 60
+ELLIPSIS = "…"
+
+# 可投影的字段：普通列，以及 预览字段 -> 来源列
+QUESTION_COLUMNS = ("id", "question_content", "answer_content", "user_id", "prompt_id", "created_at", "updated_at")
+QUESTION_PREVIEWS = {"question_preview": "question_content", "answer_preview": "answer_content"}
+QUESTION_SUMMARY = ("id", "prompt_id", "created_at", "updated_at", "question_preview", "answer_preview")
+
+PROMPT_COLUMNS = ("id", "content", "user_id", "created_at", "updated_at")
+PROMPT_PREVIEWS = {"content_preview": "content"}
+PROMPT_SUMMARY = ("id", "user_id", "created_at", "updated_at", "content_preview")
+
+
+def parse_fields(fields: Optional[str], summary: bool, columns: Iterable[str], previews: Dict[str, str], summary_fields: Tuple[str, ...]) -> Optional[Tuple[str, ...]]:
+    """
+    解析 fields / summary 参数，返回要输出的字段（始终包含 id）；都未指定时返回 None，表示完整输出
+    """
+    if fields:
+        requested = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = [field for field in requested if field not in columns and field not in previews]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        return tuple(dict.fromkeys(["id", *requested]))
+    if summary:
+        return summary_fields
+    return None
+
+
+def select_columns(model, fields: Tuple[str, ...], previews: Dict[str, str]) -> list:
+    """字段 -> SQL 列表达式；预览字段多取一个字符，用于判断是否被截断"""
+    return [
+        func.substr(getattr(model, previews[field]), 1, PREVIEW_CHARS + 1).label(field) if field in previews
+        else getattr(model, field)
+        for field in fields
+    ]
+
+
+def preview(text: Optional[str]) -> Optional[str]:
+    if text is None or len(text) <= PREVIEW_CHARS:
+        return text
+    return text[:PREVIEW_CHARS] + ELLIPSIS
+
+
+def rows_to_dicts(rows, previews: Dict[str, str]) -> List[dict]:
+    result = []
+    for row in rows:
+        item = dict(row._mapping)
+        for field in previews:
+            if field in item:
+                item[field] = preview(item[field])
+        result.append(item)
+    return result
+
+
+def project(item: dict, fields: Tuple[str, ...], previews: Dict[str, str]) -> dict:
+    """对已有的完整条目做投影（如历史记录索引中的条目）"""
+    return {
+        field: preview(item.get(previews[field])) if field in previews else item.get(field)
+        for field in fields
+    }
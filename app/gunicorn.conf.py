@@ -0,0 +1,47 @@
+"""
+生产环境多进程部署配置
+
+    gunicorn -c gunicorn.conf.py main:app
+
+- 每个 CPU 核心一个 uvicorn worker（可通过 WEB_CONCURRENCY 覆盖）
+- 不预加载应用：数据库连接池、Redis 客户端、线程池等在每个 worker 导入 main 时各自创建，
+  不会在 fork 之间共享连接
+- 收到 SIGTERM 后 worker 停止接收新请求，等待进行中的请求完成，再执行 lifespan 关闭流程
+  （等待进行中的大模型调用、刷入缓冲的使用计数、释放连接），超过 graceful_timeout 后强制退出
+"""
+import multiprocessing
+import os
+import shutil
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = False
+
+# 大模型调用可能持续数十秒，超时与优雅关闭时间需覆盖一次完整的生成
+timeout = int(os.getenv("WORKER_TIMEOUT", 120))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+
+accesslog = None  # 请求日志由应用内的 JSON 日志输出
+loglevel = os.getenv("LOG_LEVEL", "info").lower()
+
+# 多进程下 Prometheus 指标写入共享目录，由 /metrics 汇总
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc")
+
+
+def on_starting(server):
+    # 清理上次运行遗留的指标文件
+    multiproc_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def post_fork(server, worker):
+    server.log.info(f"Worker spawned (pid: {worker.pid})")
+
+
+def child_exit(server, worker):
+    # 退出的 worker 不再计入 livesum 类指标（如进行中的请求数）
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,222 @@
+"""
+按用户物化的历史记录索引（Redis）
+
+- history:{user_id}:ids    zset: 问题 ID -> 创建时间戳，用于排序和按日期分组
+- history:{user_id}:items  hash: 问题 ID -> 已编码的 JSON 条目
+- history:{user_id}:pages  hash: "page:limit[:fields]" -> 已编码的整页 JSON，索引有任何变化时整体删除
+- history:{user_id}:built  标记索引已从数据库完整构建；未构建时读请求查库并懒加载
+- history:{user_id}:version 每次增量更新递增；构建时 WATCH 该键，期间有写入则放弃本次构建，避免写回过期数据
+
+命中时一页历史记录只需一次 HGET。创建、更新、删除问题时增量维护索引。
+"""
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+import orjson
+
+from aioredis.exceptions import WatchError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from config import settings
+from database import redis_client
+from models import Question
+from mylogger import logger
+from responses import Preserialized, dump_json
+from fieldsets import QUESTION_PREVIEWS, project
+
+KEY_PREFIX = "history:{}:"
+
+# 仅当索引版本未变化时才缓存整页，避免并发写入后写回过期的页面
+STORE_PAGE_SCRIPT = """
+if (redis.call('get', KEYS[1]) or '0') == ARGV[1] then
+    redis.call('hset', KEYS[2], ARGV[2], ARGV[3])
+    return redis.call('expire', KEYS[2], ARGV[4])
+end
+return 0
+"""
+
+
+def _keys(user_id: int):
+    prefix = KEY_PREFIX.format(user_id)
+    return prefix + "ids", prefix + "items", prefix + "pages", prefix + "built", prefix + "version"
+
+
+async def _load_questions(db: AsyncSession, user_id: int):
+    result = await db.execute(
+        select(Question).where(Question.user_id == user_id).order_by(Question.created_at.desc())
+    )
+    return result.scalars().all()
+
+
+def _item(question) -> str:
+    return dump_json({
+        "id": question.id,
+        "question_content": question.question_content,
+        "answer_content": question.answer_content,
+        "user_id": question.user_id,
+        "prompt_id": question.prompt_id,
+        "created_at": question.created_at.strftime("%Y-%m-%d"),  # 只返回日期部分
+        "updated_at": question.updated_at.strftime("%Y-%m-%d"),
+    }).decode()
+
+
+def _render_page(entries: List[tuple], page: int, limit: int, fields: Optional[Tuple[str, ...]] = None) -> bytes:
+    """
+    entries 为按创建时间倒序的 (创建时间戳, 条目 JSON)；按日期分组后取第 page 页（每页 limit 个日期），
+    直接拼接已编码的条目，无需再次序列化；指定 fields 时对本页条目做投影
+    """
+    groups = []
+    for timestamp, item in entries:
+        date = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d")
+        if not groups or groups[-1][0] != date:
+            groups.append((date, []))
+        groups[-1][1].append(item)
+
+    start = (page - 1) * limit
+    groups = groups[start:start + limit]
+    if fields:
+        groups = [
+            (date, [dump_json(project(orjson.loads(item), fields, QUESTION_PREVIEWS)).decode() for item in items])
+            for date, items in groups
+        ]
+    return ("[" + ",".join(
+        f'{{"date":"{date}","questions":[{",".join(items)}]}}' for date, items in groups
+    ) + "]").encode()
+
+
+async def _build(db: AsyncSession, user_id: int, version: str) -> List[tuple]:
+    """从数据库加载用户全部问题并写入索引，返回 (创建时间戳, 条目 JSON) 列表"""
+    ids_key, items_key, pages_key, built_key, version_key = _keys(user_id)
+    questions = await _load_questions(db, user_id)
+    entries = [(question.created_at.timestamp(), _item(question)) for question in questions]
+
+    try:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            await pipe.watch(version_key)
+            if (await pipe.get(version_key) or "0") != version:
+                return entries
+            pipe.multi()
+            pipe.delete(ids_key, items_key, pages_key)
+            if questions:
+                pipe.hset(items_key, mapping={question.id: item for question, (_, item) in zip(questions, entries)})
+                pipe.zadd(ids_key, {question.id: timestamp for question, (timestamp, _) in zip(questions, entries)})
+            pipe.set(built_key, 1)
+            for key in (ids_key, items_key, built_key):
+                pipe.expire(key, settings.history_cache_ttl_seconds)
+            await pipe.execute()
+    except WatchError:
+        # 构建期间有新的写入，本次结果可能已过期，下次读取时重新构建
+        pass
+    except Exception as e:
+        # 写入索引失败不影响本次读取，直接使用已加载的条目
+        logger.error(f"写入历史记录索引失败: {e}")
+    return entries
+
+
+async def history_page(db: AsyncSession, user_id: int, page: int, limit: int, fields: Optional[Tuple[str, ...]] = None) -> Preserialized:
+    """返回按日期分组的一页历史记录（已编码的 JSON），指定 fields 时只包含这些字段"""
+    ids_key, items_key, pages_key, built_key, version_key = _keys(user_id)
+    field = f"{page}:{limit}:{','.join(fields)}" if fields else f"{page}:{limit}"
+    entries, version = None, None
+    try:
+        cached = await redis_client.hget(pages_key, field)
+        if cached is not None:
+            return Preserialized(cached.encode())
+
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.get(version_key)
+        pipe.exists(built_key)
+        pipe.zrevrange(ids_key, 0, -1, withscores=True)
+        pipe.hgetall(items_key)
+        version, built, ids, items = await pipe.execute()
+        version = version or "0"
+        if built:
+            entries = [(timestamp, items[question_id]) for question_id, timestamp in ids if question_id in items]
+    except Exception as e:
+        # Redis 不可用时直接查库，也不再写入索引
+        logger.error(f"历史记录缓存不可用: {e}")
+        version = None
+
+    if entries is None:
+        if version is not None:
+            entries = await _build(db, user_id, version)
+        else:
+            questions = await _load_questions(db, user_id)
+            entries = [(question.created_at.timestamp(), _item(question)) for question in questions]
+
+    body = _render_page(entries, page, limit, fields)
+    if version is not None:
+        try:
+            await redis_client.eval(
+                STORE_PAGE_SCRIPT, 2, version_key, pages_key, version, field, body.decode(), settings.history_cache_ttl_seconds
+            )
+        except Exception as e:
+            logger.error(f"缓存历史记录页失败: {e}")
+    return Preserialized(body)
+
+
+async def _apply(user_id: int, upserts: Iterable = (), removed_ids: Iterable[int] = ()):
+    ids_key, items_key, pages_key, built_key, version_key = _keys(user_id)
+    upserts = list(upserts)
+    removed_ids = list(removed_ids)
+    try:
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.incr(version_key)
+        pipe.expire(version_key, settings.history_cache_ttl_seconds)
+        if upserts:
+            pipe.hset(items_key, mapping={question.id: _item(question) for question in upserts})
+            pipe.zadd(ids_key, {question.id: question.created_at.timestamp() for question in upserts})
+        if removed_ids:
+            pipe.hdel(items_key, *removed_ids)
+            pipe.zrem(ids_key, *removed_ids)
+        pipe.delete(pages_key)
+        for key in (ids_key, items_key):
+            pipe.expire(key, settings.history_cache_ttl_seconds)
+        await pipe.execute()
+    except Exception as e:
+        logger.error(f"更新历史记录缓存失败: {e}")
+        await drop_user(user_id)
+
+
+async def put_questions(questions: Iterable):
+    """新建或更新问题后写入索引"""
+    by_user = {}
+    for question in questions:
+        by_user.setdefault(question.user_id, []).append(question)
+    for user_id, user_questions in by_user.items():
+        await _apply(user_id, upserts=user_questions)
+
+
+async def put_question(question):
+    await put_questions([question])
+
+
+async def remove_question(user_id: int, question_id: int):
+    await _apply(user_id, removed_ids=[question_id])
+
+
+async def drop_users(user_ids: Iterable[int]):
+    """删除用户的索引，下次读取时重新构建"""
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for user_id in set(user_ids):
+            ids_key, items_key, pages_key, built_key, version_key = _keys(user_id)
+            pipe.delete(ids_key, items_key, pages_key, built_key)
+            pipe.incr(version_key)  # 使进行中的构建失效
+            pipe.expire(version_key, settings.history_cache_ttl_seconds)
+        await pipe.execute()
+    except Exception as e:
+        logger.error(f"删除历史记录缓存失败: {e}")
+
+
+async def drop_user(user_id: int):
+    await drop_users([user_id])
+
+
+async def drop_all():
+    """删除所有用户的索引（如删除 Prompt 后，受影响的用户无法直接确定）"""
+    try:
+        async for key in redis_client.scan_iter(match=KEY_PREFIX.format("*") + "built", count=1000):
+            await drop_user(int(key.split(":")[1]))
+    except Exception as e:
+        logger.error(f"清空历史记录缓存失败: {e}")
@@ -0,0 +1,73 @@
+"""
+HTTP 条件请求（ETag / Last-Modified）
+
+资源未变化时返回 304，不查询关联数据也不序列化响应体。
+ETag 由调用方提供的 updated_at 与内容哈希等计算，并区分 JSON / MessagePack 两种表示。
+"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Callable, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+from responses import negotiated_response, wants_msgpack
+
+# 用户私有数据：允许客户端缓存，但每次使用前需重新验证
+PRIVATE_REVALIDATE = "private, no-cache"
+# 公共数据：短时间内可直接使用缓存，之后重新验证
+PUBLIC_SHORT = "public, max-age=60"
+
+
+def make_etag(*parts: Any) -> str:
+    digest = hashlib.sha1("\x1f".join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def http_date(value: datetime) -> str:
+    # 数据库中为本地时间（naive），转换为 GMT
+    return format_datetime(value.astimezone(timezone.utc).replace(microsecond=0), usegmt=True)
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """If-None-Match 优先；未携带时再比较 If-Modified-Since（秒级精度）"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        # 弱比较：忽略 W/ 前缀
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return etag.removeprefix("W/") in candidates
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+            # 时区为 -0000 时返回 naive 时间，按 RFC 5322 视为 UTC
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            return last_modified.astimezone(timezone.utc).replace(microsecond=0) <= since
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def conditional_response(
+    request: Request,
+    etag: str,
+    content: Callable[[], Any],
+    last_modified: Optional[datetime] = None,
+    cache_control: str = PRIVATE_REVALIDATE,
+) -> Response:
+    """
+    资源未变化时返回 304；否则调用 content() 生成内容，按 Accept 协商编码，并附带缓存校验头
+    """
+    if wants_msgpack(request):
+        etag = etag[:-1] + '-msgpack"'
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept, Authorization"}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    return negotiated_response(request, content(), headers=headers)
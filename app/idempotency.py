@@ -0,0 +1,205 @@
+"""
+Idempotency-Key 支持（Redis）
+
+客户端对 POST /gpt/、POST /questions/、PUT /questions/... 携带 Idempotency-Key 请求头时：
+- 首个请求在 Redis 中占位（SET NX，带锁超时），正常执行，完成后保存响应（状态码、响应头、响应体），保留 idempotency_ttl_seconds
+- 相同用户、相同键的重复请求：
+  - 首个请求仍在执行时，等待其完成后重放保存的响应；等待超过 idempotency_wait_seconds 或首个请求失败时返回 409
+  - 已完成时直接重放保存的响应（响应头 Idempotent-Replayed: true），不再调用大模型、不再扣减配额
+  - 请求体与首个请求不同时返回 422
+- 首个请求失败（5xx、异常）或结果可重试（408 / 409 / 429）时删除占位，允许客户端重试
+键按用户隔离（取自 JWT），未携带有效 Token 的请求不做处理，由路由返回 401。
+"""
+import asyncio
+import base64
+import hashlib
+import re
+import uuid
+
+import orjson
+
+from config import settings
+from database import redis_client
+from mylogger import logger
+from responses import ORJSONResponse
+from utils import decode_jwt
+
+HEADER = b"idempotency-key"
+KEY_PREFIX = "idempotency:{}:{}:{}"
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.1
+# 这些状态码表示请求可以重试，不保存结果
+RETRYABLE_STATUS = {408, 409, 429}
+
+IDEMPOTENT_ROUTES = (
+    ("POST", re.compile(r"^/gpt/?$")),
+    ("POST", re.compile(r"^/questions/?$")),
+    ("PUT", re.compile(r"^/questions/[^/]+/?$")),
+)
+
+# 仅当占位仍属于本请求时才写入结果 / 删除占位（锁超时后可能已被其他请求占用）
+COMPLETE_SCRIPT = """
+local current = redis.call('get', KEYS[1])
+if not current or cjson.decode(current)['token'] ~= ARGV[1] then
+    return 0
+end
+if ARGV[2] == '' then
+    return redis.call('del', KEYS[1])
+end
+redis.call('set', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+
+def _is_idempotent_route(method: str, path: str) -> bool:
+    return any(method == route_method and pattern.match(path) for route_method, pattern in IDEMPOTENT_ROUTES)
+
+
+def _header(scope, name: bytes):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def _user_id(scope):
+    authorization = _header(scope, b"authorization") or ""
+    if not authorization.lower().startswith("bearer "):
+        return None
+    payload = decode_jwt(authorization[7:])
+    return payload.get("sub") if payload else None
+
+
+def _error(status_code: int, detail: str, headers: dict = None) -> ORJSONResponse:
+    return ORJSONResponse(status_code=status_code, content={"detail": detail}, headers=headers)
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+def _replay(record: dict):
+    async def app(scope, receive, send):
+        headers = [(key.encode("latin-1"), value.encode("latin-1")) for key, value in record["headers"]]
+        headers.append((b"idempotent-replayed", b"true"))
+        await send({"type": "http.response.start", "status": record["status"], "headers": headers})
+        await send({"type": "http.response.body", "body": base64.b64decode(record["body"])})
+    return app
+
+
+async def _wait_for_result(key: str):
+    """等待首个请求完成，返回保存的记录；超时或占位被删除（首个请求失败）时返回 None"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.idempotency_wait_seconds
+    while loop.time() < deadline:
+        raw = await redis_client.get(key)
+        if raw is None:
+            return None
+        record = orjson.loads(raw)
+        if record["state"] == "done":
+            return record
+        await asyncio.sleep(POLL_INTERVAL)
+    return None
+
+
+class IdempotencyMiddleware:
+    """纯 ASGI 中间件：对指定路由按 Idempotency-Key 去重"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _is_idempotent_route(scope["method"], scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        idempotency_key = _header(scope, HEADER)
+        if idempotency_key is None:
+            await self.app(scope, receive, send)
+            return
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+            await _error(400, "Invalid Idempotency-Key")(scope, receive, send)
+            return
+        user_id = _user_id(scope)
+        if user_id is None:
+            await self.app(scope, receive, send)
+            return
+
+        body = await _read_body(receive)
+        fingerprint = hashlib.sha256(f"{scope['method']} {scope['path']}\n".encode() + body).hexdigest()
+        key = KEY_PREFIX.format(user_id, scope["method"], idempotency_key)
+        token = uuid.uuid4().hex
+
+        try:
+            acquired = await redis_client.set(
+                key, orjson.dumps({"state": "pending", "token": token, "fingerprint": fingerprint}).decode(),
+                nx=True, ex=settings.idempotency_lock_seconds,
+            )
+            raw = None if acquired else await redis_client.get(key)
+            record = orjson.loads(raw) if raw else None
+        except Exception as e:
+            # Redis 不可用时不做去重
+            logger.error(f"Idempotency-Key 检查失败: {e}")
+            acquired, record = False, None
+
+        async def replay_receive():
+            nonlocal body
+            if body is None:
+                return await receive()
+            message = {"type": "http.request", "body": body, "more_body": False}
+            body = None
+            return message
+
+        if record is not None:
+            if record.get("fingerprint") not in (None, fingerprint):
+                await _error(422, "Idempotency-Key was used with a different request")(scope, receive, send)
+                return
+            if record["state"] == "pending":
+                record = await _wait_for_result(key)
+                if record is None:
+                    await _error(409, "A request with this Idempotency-Key is in progress", {"Retry-After": "1"})(scope, receive, send)
+                    return
+            if record["state"] == "done":
+                await _replay(record)(scope, receive, send)
+                return
+
+        if not acquired:
+            await self.app(scope, replay_receive, send)
+            return
+
+        status = 500
+        headers = []
+        chunks = []
+
+        async def capture_send(message):
+            nonlocal status, headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = [(name.decode("latin-1"), value.decode("latin-1")) for name, value in message.get("headers", [])]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        completed = ""
+        try:
+            await self.app(scope, replay_receive, capture_send)
+            if status < 500 and status not in RETRYABLE_STATUS:
+                completed = orjson.dumps({
+                    "state": "done",
+                    "fingerprint": fingerprint,
+                    "status": status,
+                    "headers": headers,
+                    "body": base64.b64encode(b"".join(chunks)).decode(),
+                }).decode()
+        finally:
+            try:
+                await redis_client.eval(COMPLETE_SCRIPT, 1, key, token, completed, settings.idempotency_ttl_seconds)
+            except Exception as e:
+                logger.error(f"保存 Idempotency-Key 结果失败: {e}")
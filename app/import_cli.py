@@ -0,0 +1,55 @@
+"""
+批量导入命令行工具
+
+用法（在 app 目录下执行）:
+    python import_cli.py users students.csv
+    python import_cli.py questions bank.ndjson
+    cat bank.ndjson | python import_cli.py questions -
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from database import async_session_maker
+from crud.bulk import IMPORTERS, iter_lines, iter_rows
+
+CHUNK_SIZE = 1 << 16
+
+
+async def _read_chunks(stream):
+    # 文件读取是阻塞操作，放到线程中进行
+    while True:
+        chunk = await asyncio.to_thread(stream.read, CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def run(kind: str, path: str, fmt: str) -> dict:
+    stream = sys.stdin.buffer if path == "-" else open(path, "rb")
+    try:
+        async with async_session_maker() as db:
+            rows = iter_rows(iter_lines(_read_chunks(stream)), fmt)
+            report = await IMPORTERS[kind](db, rows)
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+    return report.to_dict()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从 NDJSON/CSV 批量导入数据")
+    parser.add_argument("kind", choices=sorted(IMPORTERS), help="导入的数据类型")
+    parser.add_argument("path", help="数据文件路径，- 表示标准输入")
+    parser.add_argument("--format", choices=["ndjson", "csv"], help="默认按文件扩展名判断")
+    args = parser.parse_args()
+
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+    report = asyncio.run(run(args.kind, args.path, fmt))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    sys.exit(1 if report["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
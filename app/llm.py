@@ -0,0 +1,118 @@
+import asyncio
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Optional
+from config import settings
+from mylogger import logger
+from metrics import LLM_REQUEST_LATENCY, LLM_TIME_TO_FIRST_TOKEN, LLM_TOKENS
+from profiling import record_upstream
+from deadlines import check_deadline, remaining
+from model_router import upstream_health
+
+DEFAULT_MODEL = "deepseek-chat"
+DEFAULT_MAX_TOKENS = 500
+
+_client = None
+
+# 正在进行的大模型调用（所在的任务），关闭时等待它们完成
+_inflight = set()
+
+
+@dataclass
+class Generation:
+    text: str
+    model: str
+    elapsed: float
+    prompt_tokens: Optional[int] = None  # 上游返回的实际用量，未返回时为 None
+    completion_tokens: Optional[int] = None
+
+
+def get_client():
+    """
+    首次使用时再初始化 OpenAI 客户端：openai SDK 导入较慢，延迟加载可缩短冷启动时间
+    """
+    global _client
+    if _client is None:
+        if not settings.API_KEY or not settings.API_URL:
+            logger.error("API_KEY or API_URL not configured in settings!")
+            raise RuntimeError("OpenAI API configuration missing!")
+        from openai import AsyncOpenAI
+        _client = AsyncOpenAI(api_key=settings.API_KEY, base_url=settings.API_URL)
+    return _client
+
+
+def preload_client():
+    """在后台预先加载客户端，失败时只记录日志，首次调用时会再次尝试"""
+    try:
+        get_client()
+    except Exception as e:
+        logger.error(f"Failed to preload OpenAI client: {e}")
+
+
+async def drain(timeout: float):
+    """等待进行中的大模型调用结束，超时后放弃等待，返回仍未完成的数量"""
+    pending = {task for task in _inflight if task is not asyncio.current_task()}
+    if not pending:
+        return 0
+    logger.info(f"Waiting for {len(pending)} in-flight LLM request(s) to finish")
+    _, pending = await asyncio.wait(pending, timeout=timeout)
+    if pending:
+        logger.warning(f"{len(pending)} LLM request(s) still running after {timeout}s drain timeout")
+    return len(pending)
+
+
+async def generate_answer(system_prompt: str, question_content: str, model: str = DEFAULT_MODEL, max_tokens: int = DEFAULT_MAX_TOKENS) -> Generation:
+    """
+    调用大模型生成回答。
+    内部以流式方式读取，以便记录首 token 延迟；返回回答文本、耗时与 token 用量。
+    在请求上下文中调用时，以请求剩余的时间作为上游超时。
+    """
+    check_deadline()
+    options = {}
+    timeout = remaining()
+    if timeout is not None:
+        options["timeout"] = timeout
+    start = perf_counter()
+    parts = []
+    usage = None
+    task = asyncio.current_task()
+    _inflight.add(task)
+    try:
+        stream = await get_client().chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": question_content},
+            ],
+            stream=True,
+            stream_options={"include_usage": True},
+            max_tokens=max_tokens,
+            **options,
+        )
+        async for chunk in stream:
+            if chunk.usage:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                if not parts:
+                    LLM_TIME_TO_FIRST_TOKEN.labels(model).observe(perf_counter() - start)
+                parts.append(chunk.choices[0].delta.content)
+    except Exception:
+        elapsed = perf_counter() - start
+        LLM_REQUEST_LATENCY.labels(model, "error").observe(elapsed)
+        record_upstream(elapsed)
+        upstream_health.record(model, elapsed, ok=False)
+        raise
+    finally:
+        _inflight.discard(task)
+
+    elapsed = perf_counter() - start
+    LLM_REQUEST_LATENCY.labels(model, "success").observe(elapsed)
+    record_upstream(elapsed)
+    upstream_health.record(model, elapsed, ok=True)
+    generation = Generation("".join(parts).strip(), model, elapsed)
+    if usage:
+        LLM_TOKENS.labels(model, "prompt").inc(usage.prompt_tokens)
+        LLM_TOKENS.labels(model, "completion").inc(usage.completion_tokens)
+        generation.prompt_tokens = usage.prompt_tokens
+        generation.completion_tokens = usage.completion_tokens
+    return generation
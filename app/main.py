@@ -1,31 +1,100 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.exceptions import RequestValidationError
 from admin import create_admin
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from tasks import reset_model_quota  # 导入定时任务函数
+from tasks import reset_model_quota, flush_usage_counts  # 导入定时任务函数
+from cluster_scheduler import ClusterScheduler, daily_run_key
+from cache_warmup import warm_answer_cache, window_seconds
+from config import settings
+from responses import ORJSONResponse
+from metrics import MetricsMiddleware, render_metrics
+from mylogger import logger, RequestIdMiddleware
+from profiling import ProfilingMiddleware
+from admission import AdmissionMiddleware, admission
+from answer_filter import answer_filter
+from idempotency import IdempotencyMiddleware
+from deadlines import DeadlineMiddleware
+from database import engine, read_engines, redis_client, warm_up_pools
+import llm
+from model_router import preload_tokenizer
 
-# 初始化 FastAPI 应用
-app = FastAPI()
+# 应用生命周期：预热连接池 -> 启动定时任务 -> 标记就绪；关闭时按相反顺序释放资源
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+    try:
+        await asyncio.wait_for(
+            warm_up_pools(settings.warmup_db_connections, settings.warmup_redis_connections),
+            timeout=settings.startup_timeout_seconds,
+        )
+    except Exception as e:
+        # 预热失败不阻止启动，/readyz 会反映依赖的实际状态
+        logger.error(f"Connection pool warm-up failed: {e!r}")
 
-# 初始化定时任务
-# 每天凌晨 0 点执行一次 reset_model_quota
+    # 启动定时任务；reset_model_quota 由当选的 leader 在后台补跑，不阻塞启动
+    scheduler.start()
+    logger.info("APScheduler started.")
+    admission.start()
+    # 在后台构建已有回答的 Bloom 过滤器，构建完成前 /gpt 照常查询数据库
+    answer_filter.start()
+    app.state.ready = True
+
+    # 就绪后在后台线程中加载 openai SDK，避免首个 /gpt 请求承担导入开销
+    asyncio.get_running_loop().run_in_executor(None, llm.preload_client)
+    # 同样在后台加载计算输入 token 数的分词器，加载完成前按字符数估算
+    asyncio.get_running_loop().run_in_executor(None, preload_tokenizer)
+
+    yield
+
+    # 优雅关闭：uvicorn 已停止接收新请求，等待进行中的大模型调用完成后再持久化缓冲的计数
+    app.state.ready = False
+    await llm.drain(settings.shutdown_drain_seconds)
+    await admission.stop()
+    await answer_filter.stop()
+    try:
+        await cluster_scheduler.run_now("flush_usage_counts")
+    except Exception as e:
+        logger.error(f"Final usage flush failed: {e!r}")
+    # 停止 APScheduler 并释放 leader 租约
+    await cluster_scheduler.shutdown()
+    await asyncio.gather(engine.dispose(), *(read_engine.dispose() for read_engine in read_engines))
+    await redis_client.close()
+
+# 初始化 FastAPI 应用（默认使用 orjson 编码响应）
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+
+# 初始化定时任务（集群中只有 leader 执行，见 cluster_scheduler）
 scheduler = AsyncIOScheduler()
-scheduler.add_job(reset_model_quota, 'cron', hour=0, minute=0)
+cluster_scheduler = ClusterScheduler(scheduler, lease_seconds=settings.scheduler_lease_seconds)
+# 每天凌晨 0 点执行一次 reset_model_quota；新 leader 上任时补跑当天未执行的重置
+cluster_scheduler.add_job(reset_model_quota, 'cron', hour=0, minute=0, run_key=daily_run_key, catch_up=True)
+# 定期将 Redis 中的使用次数计数刷入数据库
+cluster_scheduler.add_job(flush_usage_counts, 'interval', seconds=settings.usage_flush_interval_seconds)
+# 闲时预热共享回答缓存，每天一次，运行到预热窗口结束
+if settings.warmup_rate_per_minute > 0:
+    cluster_scheduler.add_job(
+        warm_answer_cache, 'cron', hour=settings.warmup_start_hour, minute=0,
+        run_key=daily_run_key, timeout=window_seconds() + 600,
+    )
 
 # 配置管理面板
 create_admin(app)
 
 # 注册路由
-from routes import gpt_routes, prompt_routes, question_routes, user_routes
+from routes import gpt_routes, prompt_routes, question_routes, user_routes, import_routes, debug_routes, health_routes
+app.include_router(health_routes.router, tags=["Health"])
 app.include_router(user_routes.router, prefix="/auth", tags=["Authentication"])
 app.include_router(question_routes.router, prefix="/questions", tags=["Questions"])
 app.include_router(gpt_routes.router, prefix="/gpt", tags=["GPT"])
 app.include_router(prompt_routes.router, prefix="/prompts", tags=["Prompts"])
+app.include_router(import_routes.router, prefix="/import", tags=["Import"])
+app.include_router(debug_routes.router, prefix="/debug", tags=["Debug"])
 
 # 添加全局异常处理
-from mylogger import logger
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request, exc):
     logger.error(f"请求校验失败: {exc}")
@@ -49,6 +118,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 请求剖析与慢请求记录
+app.add_middleware(ProfilingMiddleware)
+
+# Idempotency-Key：重试的请求重放首次的响应，不重复调用大模型
+app.add_middleware(IdempotencyMiddleware)
+
+# 过载保护：按路由类别准入，过载时优先拒绝低优先级请求
+app.add_middleware(AdmissionMiddleware)
+
+# 请求截止时间与客户端断开检测
+app.add_middleware(DeadlineMiddleware)
+
+# 请求 ID 中间件，日志中携带 request_id
+app.add_middleware(RequestIdMiddleware)
+
+# 请求指标中间件（最后添加，位于最外层）
+app.add_middleware(MetricsMiddleware)
+
 # 打印启动日志
 logger.info("FastAPI application started!")
 logger.info("Access admin panel at: http://127.0.0.1:8000/admin")
@@ -58,16 +145,8 @@ logger.info("Access admin panel at: http://127.0.0.1:8000/admin")
 def home():
     return {"message": "Welcome to the API!"}
 
-# 在应用启动时启动 APScheduler
-@app.on_event("startup")
-async def startup_event():
-    scheduler.start()
-    print("APScheduler started.")
-    print("Executing reset_model_quota task on startup.")
-    await reset_model_quota()  # 直接调用异步任务
-
-# 在应用关闭时停止 APScheduler
-@app.on_event("shutdown")
-def shutdown_event():
-    scheduler.shutdown()
-    
\ No newline at end of file
+# Prometheus 指标
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, media_type=content_type)
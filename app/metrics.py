@@ -0,0 +1,229 @@
+"""
+Prometheus 指标
+
+多进程部署（多个 uvicorn worker）时需设置环境变量 PROMETHEUS_MULTIPROC_DIR 指向一个空目录，
+各 worker 的指标写入该目录下的 mmap 文件，/metrics 汇总所有 worker 的数据（gunicorn.conf.py 已默认设置）。
+"""
+import logging
+import os
+from time import perf_counter
+
+import aioredis
+from aioredis.client import Pipeline
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from profiling import record_plan, record_redis, record_sql
+
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+REDIS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+
+# ---------- HTTP ----------
+REQUEST_COUNT = Counter("http_requests_total", "HTTP 请求数", ["method", "route", "status"])
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "HTTP 请求耗时", ["method", "route"])
+DEADLINE_EXCEEDED = Counter("http_deadline_exceeded_total", "超过截止时间被取消的请求数")
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "正在处理的 HTTP 请求数", ["method"], multiprocess_mode="livesum")
+
+# ---------- 过载保护 ----------
+ADMISSION_IN_FLIGHT = Gauge("admission_in_flight", "各路由类别进行中的请求数", ["route_class"], multiprocess_mode="livesum")
+ADMISSION_LIMIT = Gauge("admission_concurrency_limit", "各路由类别当前的自适应并发上限", ["route_class"], multiprocess_mode="livesum")
+ADMISSION_SHED = Counter("admission_shed_total", "过载保护拒绝的请求数", ["route_class", "reason"])
+EVENT_LOOP_LAG = Gauge("event_loop_lag_seconds", "事件循环延迟（平滑后）", multiprocess_mode="livemax")
+
+# ---------- 数据库 ----------
+DB_QUERY_LATENCY = Histogram("db_query_duration_seconds", "SQL 语句耗时", ["operation"], buckets=DB_BUCKETS)
+DB_POOL_CHECKOUT_WAIT = Histogram("db_pool_checkout_wait_seconds", "从连接池获取连接的等待时间", buckets=DB_BUCKETS)
+
+# ---------- Redis ----------
+REDIS_COMMAND_LATENCY = Histogram("redis_command_duration_seconds", "Redis 命令耗时", ["command"], buckets=REDIS_BUCKETS)
+
+# ---------- 大模型 ----------
+LLM_REQUEST_LATENCY = Histogram("llm_request_duration_seconds", "大模型调用总耗时", ["model", "outcome"], buckets=LLM_BUCKETS)
+LLM_TIME_TO_FIRST_TOKEN = Histogram("llm_time_to_first_token_seconds", "大模型首个 token 延迟", ["model"], buckets=LLM_BUCKETS)
+LLM_TOKENS = Counter("llm_tokens_total", "大模型消耗的 token 数", ["model", "kind"])
+GPT_CACHE_LOOKUPS = Counter("gpt_cache_lookups_total", "/gpt 缓存查询结果（hit / shared_hit / miss）", ["result"])
+UPSTREAM_QUEUE_DEPTH = Gauge("upstream_queue_depth", "等待大模型调用名额的请求数", ["tier"], multiprocess_mode="livesum")
+UPSTREAM_QUEUE_WAIT = Histogram("upstream_queue_wait_seconds", "等待大模型调用名额的时间", ["tier"], buckets=LLM_BUCKETS)
+MODEL_ROUTE_DECISIONS = Counter("model_route_decisions_total", "大模型路由结果", ["route", "model", "outcome"])
+UPSTREAM_CANCELLED = Counter("upstream_cancelled_total", "因客户端断开或超过截止时间而取消的大模型调用", ["reason"])
+ANSWER_FILTER_CHECKS = Counter("answer_filter_checks_total", "/gpt 查询已有回答前的 Bloom 过滤器判断（absent / maybe / not_ready）", ["result"])
+ANSWER_FILTER_FALSE_POSITIVES = Counter("answer_filter_false_positives_total", "Bloom 过滤器判为可能存在但数据库中没有的次数")
+UPSTREAM_REJECTIONS = Counter("upstream_rejections_total", "因限流或排队已满被拒绝的大模型调用", ["tier", "reason"])
+
+SQL_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+
+slow_query_logger = logging.getLogger("sql.slow")
+
+
+def route_template(scope) -> str:
+    """
+    将请求路径还原为路由模板：把路径参数的取值替换回 {参数名}
+    未匹配到路由的请求统一记为 unmatched
+    """
+    if "endpoint" not in scope:
+        return "unmatched"
+    path = scope["path"]
+    path_params = scope.get("path_params")
+    if path_params:
+        names = {str(value): "{%s}" % name for name, value in path_params.items()}
+        path = "/".join(names.get(segment, segment) for segment in path.split("/"))
+    return path
+
+
+class MetricsMiddleware:
+    """
+    纯 ASGI 中间件：记录各路由的请求数、耗时和并发数。
+    路由标签使用路径模板（如 /questions/{question_id}），避免标签基数爆炸。
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        in_flight = REQUESTS_IN_FLIGHT.labels(method)
+        in_flight.inc()
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = perf_counter() - start
+            in_flight.dec()
+            route_path = route_template(scope)
+            REQUEST_COUNT.labels(method, route_path, str(status_code)).inc()
+            REQUEST_LATENCY.labels(method, route_path).observe(elapsed)
+
+
+def render_metrics():
+    """返回 (响应体, Content-Type)，多进程模式下汇总所有 worker"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+# ---------- SQLAlchemy ----------
+
+class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    """记录连接池 checkout 等待时间的连接池"""
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.observe(perf_counter() - start)
+
+
+def _sql_operation(statement: str) -> str:
+    operation = statement.lstrip()[:6].upper()
+    return operation if operation in SQL_OPERATIONS else "OTHER"
+
+
+def _explain(conn, statement, parameters) -> str:
+    """
+    在同一连接上获取语句的执行计划（不执行 ANALYZE，不会重复执行语句）
+    在 SAVEPOINT 中执行：EXPLAIN 失败时回滚到保存点，调用方的事务不会因此进入 aborted 状态
+    """
+    cursor = conn.connection.cursor()
+    savepoint = conn.in_transaction()
+    try:
+        if savepoint:
+            cursor.execute("SAVEPOINT explain_plan")
+        try:
+            cursor.execute(f"EXPLAIN {statement}", parameters)
+            plan = "\n".join(str(row[0]) for row in cursor.fetchall())
+        except Exception:
+            if savepoint:
+                cursor.execute("ROLLBACK TO SAVEPOINT explain_plan")
+            raise
+        finally:
+            if savepoint:
+                cursor.execute("RELEASE SAVEPOINT explain_plan")
+        return plan
+    finally:
+        cursor.close()
+
+
+def instrument_engine(engine, slow_query_ms: int = 200, explain_slow_query_ms: int = 0):
+    """
+    为异步引擎注册语句计时事件：
+    超过 slow_query_ms 的语句记录到日志；超过 explain_slow_query_ms（>0 时）的 SELECT 额外记录执行计划（仅 PostgreSQL）
+    """
+    sync_engine = engine.sync_engine
+    slow_query_seconds = slow_query_ms / 1000
+    explain_seconds = explain_slow_query_ms / 1000
+    can_explain = explain_slow_query_ms > 0 and sync_engine.dialect.name == "postgresql"
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = perf_counter() - conn.info["query_start_time"].pop()
+        DB_QUERY_LATENCY.labels(_sql_operation(statement)).observe(elapsed)
+        record_sql(elapsed)
+        if elapsed >= slow_query_seconds:
+            slow_query_logger.warning(f"慢查询 {elapsed * 1000:.1f}ms: {statement}")
+        if can_explain and not executemany and elapsed >= explain_seconds and _sql_operation(statement) == "SELECT":
+            try:
+                record_plan(statement, elapsed, _explain(conn, statement, parameters))
+            except Exception as e:
+                slow_query_logger.warning(f"获取执行计划失败: {e}")
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start_time"):
+            conn.info["query_start_time"].pop()
+
+
+# ---------- Redis ----------
+
+class InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        start = perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            elapsed = perf_counter() - start
+            REDIS_COMMAND_LATENCY.labels("PIPELINE").observe(elapsed)
+            record_redis(elapsed)
+
+
+class InstrumentedRedis(aioredis.Redis):
+    """记录每条命令耗时的 Redis 客户端（管道按一次 execute 统计）"""
+    async def execute_command(self, *args, **options):
+        start = perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            elapsed = perf_counter() - start
+            REDIS_COMMAND_LATENCY.labels(str(args[0]).upper()).observe(elapsed)
+            record_redis(elapsed)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
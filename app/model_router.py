@@ -0,0 +1,168 @@
+"""
+大模型路由：按输入长度、会员等级与上游状态选择模型和 max_tokens
+
+- 输入长度：在本地计算 Prompt 与问题的 token 数（不调用上游）。启动后在后台加载分词器：
+  配置了 tokenizer_path（DeepSeek 发布的 tokenizer.json，需安装 tokenizers）时使用 DeepSeek 分词器；
+  否则安装了 tiktoken 时使用 tiktoken_encoding；都不可用或尚未加载完成时按字符数估算。
+  超过 max_input_tokens 的输入在付费前截断问题（trim_oversized_input）或直接返回 413
+- 路由规则（settings.model_routes）按顺序匹配，第一条满足条件的规则生效：
+    name         规则名，记录在问答记录的 route 列上
+    model        使用的模型
+    max_tokens   回答的最大 token 数
+    tiers        可选，限定会员等级
+    max_input_tokens 可选，输入 token 数不超过该值时才匹配
+    degraded     可选，true 表示只在上游降级（高延迟或高错误率）时匹配
+- 上游状态：每个 worker 按模型统计调用耗时与错误率的指数移动平均，超过阈值即视为降级。
+  统计值按 router_health_half_life_seconds 随时间衰减：降级后流量切到其他模型，原模型不再被调用时
+  也能在数个半衰期后恢复为正常，重新接收流量（此时的调用相当于探测，仍然很慢会再次进入降级）
+路由结果与实际消耗的 token 数、耗时一起保存到 questions_and_answers，用于按路由统计成本与延迟。
+"""
+import math
+import re
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Tuple
+
+from fastapi import HTTPException
+from config import settings
+from metrics import MODEL_ROUTE_DECISIONS
+from mylogger import logger
+
+# DeepSeek 官方给出的换算：1 个中文字符约 0.6 token，1 个英文字符约 0.3 token
+CJK_TOKENS_PER_CHAR = 0.6
+OTHER_TOKENS_PER_CHAR = 0.3
+CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+
+def _estimate_by_chars(text: str) -> int:
+    cjk = len(CJK_RE.findall(text))
+    return math.ceil(cjk * CJK_TOKENS_PER_CHAR + (len(text) - cjk) * OTHER_TOKENS_PER_CHAR)
+
+
+_count_tokens: Callable[[str], int] = _estimate_by_chars
+
+
+def _load_tokenizer() -> Callable[[str], int]:
+    if settings.tokenizer_path:
+        try:
+            from tokenizers import Tokenizer
+            tokenizer = Tokenizer.from_file(settings.tokenizer_path)
+            logger.info(f"使用分词器 {settings.tokenizer_path} 计算 token 数")
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+        except Exception as e:
+            logger.warning(f"加载分词器 {settings.tokenizer_path} 失败: {e!r}")
+    if settings.tiktoken_encoding:
+        try:
+            import tiktoken
+            encoding = tiktoken.get_encoding(settings.tiktoken_encoding)
+            logger.info(f"使用 tiktoken {settings.tiktoken_encoding} 计算 token 数")
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        except ImportError:
+            pass
+        except Exception as e:
+            logger.warning(f"加载 tiktoken {settings.tiktoken_encoding} 失败: {e!r}")
+    logger.info("未加载分词器，按字符数估算 token 数")
+    return _estimate_by_chars
+
+
+def preload_tokenizer():
+    """在后台线程中加载分词器（读取词表可能较慢），加载完成前按字符数估算"""
+    global _count_tokens
+    _count_tokens = _load_tokenizer()
+
+
+def estimate_tokens(text: str) -> int:
+    return _count_tokens(text)
+
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    """保留开头部分，使估算的 token 数不超过 max_tokens"""
+    tokens = estimate_tokens(text)
+    while tokens > max_tokens and text:
+        text = text[:int(len(text) * max_tokens / tokens * 0.98)]
+        tokens = estimate_tokens(text)
+    return text
+
+
+class UpstreamHealth:
+    """按模型统计调用耗时与错误率（指数移动平均，随时间衰减）"""
+
+    def __init__(self, alpha: float = 0.1):
+        self.alpha = alpha
+        self.latency: Dict[str, float] = {}
+        self.error_rate: Dict[str, float] = {}
+        self.updated_at: Dict[str, float] = {}
+
+    def _current(self, model: str, now: float) -> Tuple[float, float]:
+        """按距上次调用的时间衰减后的 (耗时, 错误率)"""
+        decay = 0.5 ** ((now - self.updated_at[model]) / settings.router_health_half_life_seconds)
+        return self.latency[model] * decay, self.error_rate[model] * decay
+
+    def record(self, model: str, elapsed: float, ok: bool):
+        now = time.monotonic()
+        latency, error_rate = self._current(model, now) if model in self.latency else (elapsed, 0.0)
+        self.latency[model] = (1 - self.alpha) * latency + self.alpha * elapsed
+        self.error_rate[model] = (1 - self.alpha) * error_rate + self.alpha * (0.0 if ok else 1.0)
+        self.updated_at[model] = now
+
+    def degraded(self) -> bool:
+        """任一模型（衰减后）的平均耗时或错误率超过阈值"""
+        now = time.monotonic()
+        for model in list(self.latency):
+            latency, error_rate = self._current(model, now)
+            if latency > settings.router_degraded_latency_seconds or error_rate > settings.router_degraded_error_rate:
+                return True
+        return False
+
+
+upstream_health = UpstreamHealth()
+
+
+@dataclass
+class RouteDecision:
+    route: str
+    model: str
+    max_tokens: int
+    question: str  # 发送给上游的问题（可能已截断）
+    input_tokens: int  # 估算的输入 token 数（Prompt + 截断后的问题）
+    trimmed: bool = False
+
+
+def _matches(rule: dict, tier: str, input_tokens: int, degraded: bool) -> bool:
+    if rule.get("tiers") and tier not in rule["tiers"]:
+        return False
+    if rule.get("max_input_tokens") is not None and input_tokens > rule["max_input_tokens"]:
+        return False
+    if "degraded" in rule and bool(rule["degraded"]) != degraded:
+        return False
+    return True
+
+
+def route_request(system_prompt: str, question: str, tier: str) -> RouteDecision:
+    """选择模型与 max_tokens；输入过长时截断问题或抛出 413"""
+    prompt_tokens = estimate_tokens(system_prompt)
+    question_tokens = estimate_tokens(question)
+    trimmed = False
+    if prompt_tokens + question_tokens > settings.max_input_tokens:
+        allowed = settings.max_input_tokens - prompt_tokens
+        if not settings.trim_oversized_input or allowed <= 0:
+            MODEL_ROUTE_DECISIONS.labels("-", "-", "rejected").inc()
+            raise HTTPException(
+                status_code=413,
+                detail=f"Input too long: about {prompt_tokens + question_tokens} tokens, limit {settings.max_input_tokens}",
+            )
+        question = trim_to_tokens(question, allowed)
+        question_tokens = estimate_tokens(question)
+        trimmed = True
+
+    input_tokens = prompt_tokens + question_tokens
+    degraded = upstream_health.degraded()
+    for rule in settings.model_routes:
+        if _matches(rule, tier, input_tokens, degraded):
+            decision = RouteDecision(rule["name"], rule["model"], rule["max_tokens"], question, input_tokens, trimmed)
+            break
+    else:
+        raise HTTPException(status_code=500, detail="No model route configured for this request")
+
+    MODEL_ROUTE_DECISIONS.labels(decision.route, decision.model, "trimmed" if trimmed else "routed").inc()
+    return decision
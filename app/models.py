@@ -1,8 +1,20 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime
+import hashlib
+
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Index, UniqueConstraint, event
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
 
+def text_md5(value):
+    """文本的 MD5（十六进制），与 PostgreSQL 的 md5() 一致，迁移时可直接在 SQL 中回填"""
+    return hashlib.md5(value.encode("utf-8")).hexdigest() if value is not None else None
+
+def _md5_default(column: str):
+    """INSERT 未指定哈希时按同一行的内容计算（覆盖批量 insert(Question) 等不经过 ORM 属性的写入）"""
+    def default(context):
+        return text_md5(context.get_current_parameters().get(column))
+    return default
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
@@ -13,31 +25,62 @@ class User(Base):
     model_quota = Column(Integer, default=0)
     membership_type = Column(String, default="no")  # 'basic', 'premium'
     created_at = Column(DateTime, default=datetime.now)
-    updated_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
     questions = relationship("Question", back_populates="user")
     prompts = relationship("Prompt", back_populates="user")
 
 class Question(Base):
     __tablename__ = "questions_and_answers"
+    __table_args__ = (
+        # 按用户精确查找问题 / 回答内容（哈希等值，避免对长文本建 B 树索引）
+        Index("ix_questions_and_answers_user_question_hash", "user_id", "question_hash"),
+        Index("ix_questions_and_answers_user_answer_hash", "user_id", "answer_hash"),
+        # 历史记录搜索：pg_trgm 三元组 GIN 索引，支持 LIKE '%关键词%'（见 crud.question.search_questions）
+        Index(
+            "ix_questions_and_answers_question_trgm", "question_content",
+            postgresql_using="gin", postgresql_ops={"question_content": "gin_trgm_ops"},
+        ),
+        Index(
+            "ix_questions_and_answers_answer_trgm", "answer_content",
+            postgresql_using="gin", postgresql_ops={"answer_content": "gin_trgm_ops"},
+        ),
+    )
     id = Column(Integer, primary_key=True, index=True)
     question_content = Column(Text, nullable=False)
     answer_content = Column(Text, nullable=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     prompt_id = Column(Integer, ForeignKey("prompts.id"), nullable=True)
+    # 大模型路由结果与实际消耗（见 model_router.py），手动创建的问题为空
+    route = Column(String, nullable=True)
+    model = Column(String, nullable=True)
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
+    latency_ms = Column(Integer, nullable=True)
+    # 内容的 MD5，随内容写入与修改自动维护
+    question_hash = Column(String(32), nullable=True, default=_md5_default("question_content"))
+    answer_hash = Column(String(32), nullable=True, default=_md5_default("answer_content"))
     created_at = Column(DateTime, default=datetime.now)
-    updated_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
     user = relationship("User", back_populates="questions")
     prompt = relationship("Prompt", back_populates="questions")
 
+@event.listens_for(Question.question_content, "set")
+def _set_question_hash(target, value, oldvalue, initiator):
+    target.question_hash = text_md5(value)
+
+@event.listens_for(Question.answer_content, "set")
+def _set_answer_hash(target, value, oldvalue, initiator):
+    target.answer_hash = text_md5(value)
+
 class Prompt(Base):
     __tablename__ = "prompts"
     id = Column(Integer, primary_key=True, index=True)
     content = Column(Text, nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False) # 使用者id
     created_at = Column(DateTime, default=datetime.now)
-    updated_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
     user = relationship("User", back_populates="prompts")
     questions = relationship("Question", back_populates="prompt")
@@ -45,12 +88,26 @@ class Prompt(Base):
 # 用户和 Prompt 的关联表
 class UserPrompt(Base):
     __tablename__ = "user_prompts"
+    __table_args__ = (UniqueConstraint("user_id", "prompt_id", name="uq_user_prompts_user_prompt"),)
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     prompt_id = Column(Integer, ForeignKey("prompts.id"), nullable=False)
     created_at = Column(DateTime, default=datetime.now)
-    updated_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
     # 可选：添加更多字段，比如状态、使用次数等
     status = Column(String, default="active")  # 'active', 'archived'
-    usage_count = Column(Integer, default=0)
\ No newline at end of file
+    usage_count = Column(Integer, default=0)
+
+# 定时任务执行记录（job_name + run_key 唯一，保证每个周期在集群中只执行一次）
+class JobRun(Base):
+    __tablename__ = "job_runs"
+    __table_args__ = (UniqueConstraint("job_name", "run_key", name="uq_job_runs_job_run_key"),)
+    id = Column(Integer, primary_key=True, index=True)
+    job_name = Column(String, nullable=False)
+    run_key = Column(String, nullable=False)
+    worker_id = Column(String, nullable=False)
+    status = Column(String, default="running")  # 'running', 'success', 'failed'
+    error = Column(Text, nullable=True)
+    started_at = Column(DateTime, default=datetime.now)
+    finished_at = Column(DateTime, nullable=True)
@@ -1,22 +1,150 @@
+import atexit
+import json
 import logging
+import queue
+import random
+import uuid
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from config import settings
 
-# 创建日志器
-logger = logging.getLogger("my_logger")
-logger.setLevel(logging.INFO)
+# 当前请求 ID，由 RequestIdMiddleware 设置
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+QUEUE_SIZE = 10000
+
+
+def _parse_sampling(spec: str) -> dict:
+    """解析 "my_logger=0.1,apscheduler=0.01" 形式的采样率配置"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    """结构化 JSON 日志，每行一条记录"""
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_text:
+            payload["exception"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    在事件循环线程中只做采样、截断和上下文采集，格式化与 I/O 交给后台监听线程。
+    队列已满时直接丢弃日志，绝不阻塞调用方。
+    """
+    def __init__(self, log_queue, sampling: dict, max_chars: int):
+        super().__init__(log_queue)
+        self.sampling = sampling
+        self.max_chars = max_chars
+        self.dropped = 0
+
+    def _sample_rate(self, name: str) -> float:
+        # 按 logger 名称逐级向上查找采样率，例如 sqlalchemy.engine -> sqlalchemy
+        while name:
+            if name in self.sampling:
+                return self.sampling[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+    def emit(self, record: logging.LogRecord):
+        # WARNING 及以上级别不采样
+        if record.levelno < logging.WARNING and self.sampling:
+            rate = self._sample_rate(record.name)
+            if rate < 1.0 and random.random() >= rate:
+                return
+        super().emit(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        message = record.getMessage()
+        if len(message) > self.max_chars:
+            message = f"{message[:self.max_chars]}...(truncated {len(message) - self.max_chars} chars)"
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = message
+        record.args = None
+        record.exc_info = None
+        record.request_id = request_id_var.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
 
-# 创建终端输出的处理器
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
 
-# 创建文件输出的处理器
-file_handler = logging.FileHandler("app.log")
-file_handler.setLevel(logging.INFO)
+class RequestIdMiddleware:
+    """
+    为每个请求设置请求 ID（优先使用客户端传入的 X-Request-ID），并写入响应头
+    """
+    def __init__(self, app):
+        self.app = app
 
-# 设置日志格式
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-console_handler.setFormatter(formatter)
-file_handler.setFormatter(formatter)
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-# 添加处理器到日志器
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
\ No newline at end of file
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", []).append((b"x-request-id", request_id.encode("latin-1")))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_id_var.reset(token)
+
+
+def setup_logging() -> NonBlockingQueueHandler:
+    formatter = JsonFormatter()
+
+    # 创建终端输出的处理器
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+
+    # 创建文件输出的处理器
+    file_handler = logging.FileHandler(settings.log_file)
+    file_handler.setFormatter(formatter)
+
+    # 处理器运行在后台线程中，事件循环只负责入队
+    log_queue = queue.Queue(QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(
+        log_queue,
+        sampling=_parse_sampling(settings.log_sampling),
+        max_chars=settings.log_max_message_chars,
+    )
+    listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.setLevel(settings.log_level)
+    root.addHandler(queue_handler)
+    return queue_handler
+
+
+queue_handler = setup_logging()
+
+# 创建日志器
+logger = logging.getLogger("my_logger")
+logger.setLevel(settings.log_level)
@@ -0,0 +1,214 @@
+"""
+按需请求剖析与慢请求记录
+
+- 每个请求都会累计 SQL / Redis / 上游调用的次数与耗时（只是几次加法，开销可忽略）
+- 管理员请求头 X-Profile: 1 + X-Admin-Key，或按 profile_sample_rate 采样时，额外开启 pyinstrument 采样剖析
+- 超过 slow_request_ms 的请求（以及所有被剖析的请求）保存在本 worker 的环形缓冲区中
+- 路由可通过 @query_budget(n) 声明 SQL 语句数上限，超出时告警；query_budget_strict 开启时直接抛错（用于测试/CI，见 test/test_query_budget.py）
+"""
+import hmac
+import itertools
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Optional
+
+from config import settings
+from mylogger import logger, request_id_var
+
+
+class RequestProfile:
+    __slots__ = (
+        "id", "method", "path", "request_id", "started_at", "duration",
+        "sql_count", "sql_time", "redis_count", "redis_time",
+        "upstream_count", "upstream_time", "profiled", "report",
+    )
+
+    def __init__(self, method: str, path: str, profiled: bool):
+        self.id = 0
+        self.method = method
+        self.path = path
+        self.request_id = request_id_var.get()
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.redis_count = 0
+        self.redis_time = 0.0
+        self.upstream_count = 0
+        self.upstream_time = 0.0
+        self.profiled = profiled
+        self.report = None
+
+    def to_dict(self, with_report: bool = False) -> dict:
+        data = {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "request_id": self.request_id,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 2),
+            "sql": {"count": self.sql_count, "time_ms": round(self.sql_time * 1000, 2)},
+            "redis": {"count": self.redis_count, "time_ms": round(self.redis_time * 1000, 2)},
+            "upstream": {"count": self.upstream_count, "time_ms": round(self.upstream_time * 1000, 2)},
+            "profiled": self.profiled,
+        }
+        if with_report:
+            data["report"] = self.report
+        return data
+
+
+current_profile: ContextVar[Optional[RequestProfile]] = ContextVar("request_profile", default=None)
+
+# 慢请求环形缓冲区（每个 worker 一份）
+slow_requests: deque = deque(maxlen=settings.slow_request_buffer_size)
+# 慢查询执行计划
+slow_query_plans: deque = deque(maxlen=settings.slow_request_buffer_size)
+_profile_ids = itertools.count(1)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(max_queries: int):
+    """
+    声明路由处理函数允许执行的 SQL 语句数（含认证依赖中的查询），需放在路由装饰器之下:
+
+        @router.get("/{question_id}")
+        @query_budget(2)
+        async def get_question_api(...):
+    """
+    def decorator(func):
+        func.__query_budget__ = max_queries
+        return func
+    return decorator
+
+
+def check_query_budget(name: str, budget: int, used: int):
+    if used <= budget:
+        return
+    message = f"{name} 执行了 {used} 条 SQL，超出预算 {budget}"
+    if settings.query_budget_strict:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+@contextmanager
+def assert_max_queries(max_queries: int, name: str = "block"):
+    """
+    在测试中统计代码块内的 SQL 语句数，超出时抛出 QueryBudgetExceeded:
+
+        with assert_max_queries(2):
+            await crud_question.get_questions_by_user(db, user_id)
+    """
+    profile = RequestProfile("-", name, False)
+    token = current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        current_profile.reset(token)
+    if profile.sql_count > max_queries:
+        raise QueryBudgetExceeded(f"{name} 执行了 {profile.sql_count} 条 SQL，超出预算 {max_queries}")
+
+
+def record_plan(statement: str, elapsed: float, plan: str):
+    slow_query_plans.append({
+        "request_id": request_id_var.get(),
+        "captured_at": time.time(),
+        "duration_ms": round(elapsed * 1000, 2),
+        "statement": statement,
+        "plan": plan,
+    })
+    logger.warning(f"慢查询 {elapsed * 1000:.1f}ms 执行计划:\n{plan}")
+
+
+def record_sql(elapsed: float):
+    profile = current_profile.get()
+    if profile is not None:
+        profile.sql_count += 1
+        profile.sql_time += elapsed
+
+
+def record_redis(elapsed: float):
+    profile = current_profile.get()
+    if profile is not None:
+        profile.redis_count += 1
+        profile.redis_time += elapsed
+
+
+def record_upstream(elapsed: float):
+    profile = current_profile.get()
+    if profile is not None:
+        profile.upstream_count += 1
+        profile.upstream_time += elapsed
+
+
+def get_slow_request(profile_id: int) -> Optional[RequestProfile]:
+    for profile in slow_requests:
+        if profile.id == profile_id:
+            return profile
+    return None
+
+
+def _wants_profile(scope) -> bool:
+    headers = dict(scope["headers"])
+    if headers.get(b"x-profile") == b"1":
+        admin_key = headers.get(b"x-admin-key", b"").decode("latin-1")
+        if hmac.compare_digest(admin_key, settings.ADMIN_KEY):
+            return True
+    return settings.profile_sample_rate > 0 and random.random() < settings.profile_sample_rate
+
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.slow_threshold = settings.slow_request_ms / 1000
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profiled = _wants_profile(scope)
+        profile = RequestProfile(scope["method"], scope["path"], profiled)
+        token = current_profile.set(profile)
+
+        profiler = None
+        if profiled:
+            profile.id = next(_profile_ids)
+            from pyinstrument import Profiler  # 仅在开启剖析时加载
+            profiler = Profiler(async_mode="enabled")
+            profiler.start()
+
+        async def send_wrapper(message):
+            # 被剖析的请求在响应头中返回剖析记录 ID，便于在管理接口中查看
+            if profiled and message["type"] == "http.response.start":
+                message.setdefault("headers", []).append((b"x-profile-id", str(profile.id).encode()))
+            await send(message)
+
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper if profiled else send)
+        finally:
+            profile.duration = perf_counter() - start
+            current_profile.reset(token)
+            if profiler is not None:
+                profiler.stop()
+                profile.report = profiler.output_text(unicode=True, color=False)
+            if profiled or profile.duration >= self.slow_threshold:
+                if not profile.id:
+                    profile.id = next(_profile_ids)
+                slow_requests.append(profile)
+                logger.info(
+                    f"记录请求剖析 {profile.method} {profile.path} {profile.duration * 1000:.1f}ms "
+                    f"(sql={profile.sql_count}, redis={profile.redis_count}, upstream={profile.upstream_count})"
+                )
+
+        # 响应已发送后再检查查询预算，严格模式下抛错使测试失败
+        budget = getattr(scope.get("endpoint"), "__query_budget__", None)
+        if budget is not None:
+            check_query_budget(f"{profile.method} {profile.path}", budget, profile.sql_count)
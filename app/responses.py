@@ -0,0 +1,127 @@
+import html
+import re
+from datetime import date, datetime
+from typing import Any, Iterable, Optional
+
+import msgpack
+import orjson
+from fastapi import Request
+from fastapi.responses import Response
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+MSGPACK_ACCEPT_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+def _msgpack_default(obj):
+    # msgpack 没有日期类型，与 JSON 保持一致输出 ISO 格式字符串
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not msgpack serializable")
+
+
+def dump_json(content: Any) -> bytes:
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+def dump_msgpack(content: Any) -> bytes:
+    return msgpack.packb(content, default=_msgpack_default, use_bin_type=True, datetime=False)
+
+
+class ORJSONResponse(Response):
+    """使用 orjson 编码的 JSON 响应，作为应用默认响应类"""
+    media_type = JSON_MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        return dump_json(content)
+
+
+class MsgPackResponse(Response):
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        return dump_msgpack(content)
+
+
+class Preserialized:
+    """
+    已编码好的响应体（例如缓存中的 JSON 字节），直接透传，无需再次序列化
+    """
+    __slots__ = ("body", "media_type")
+
+    def __init__(self, body: bytes, media_type: str = JSON_MEDIA_TYPE):
+        self.body = body
+        self.media_type = media_type
+
+    def decode(self) -> Any:
+        if self.media_type == MSGPACK_MEDIA_TYPE:
+            return msgpack.unpackb(self.body, raw=False)
+        return orjson.loads(self.body)
+
+
+def wants_msgpack(request: Request) -> bool:
+    accept = request.headers.get("accept", "")
+    return any(media_type in accept for media_type in MSGPACK_ACCEPT_TYPES)
+
+
+def negotiated_response(request: Request, content: Any, status_code: int = 200, headers: Optional[dict] = None) -> Response:
+    """
+    按 Accept 头选择 MessagePack 或 JSON 编码。
+    返回 Response 对象会跳过 response_model 的校验与序列化，调用方需保证 content 已是可编码的 dict/list。
+    """
+    media_type = MSGPACK_MEDIA_TYPE if wants_msgpack(request) else JSON_MEDIA_TYPE
+    if isinstance(content, Preserialized):
+        if content.media_type == media_type:
+            return Response(content.body, status_code=status_code, headers=headers, media_type=media_type)
+        content = content.decode()
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return MsgPackResponse(content, status_code=status_code, headers=headers)
+    return ORJSONResponse(content, status_code=status_code, headers=headers)
+
+
+# ---------- ORM 对象转 dict ----------
+
+def question_to_dict(question) -> dict:
+    return {
+        "id": question.id,
+        "question_content": question.question_content,
+        "answer_content": question.answer_content,
+        "user_id": question.user_id,
+        "prompt_id": question.prompt_id,
+        "created_at": question.created_at,
+        "updated_at": question.updated_at,
+    }
+
+
+def prompt_to_dict(prompt) -> dict:
+    return {
+        "id": prompt.id,
+        "content": prompt.content,
+        "user_id": prompt.user_id,
+        "created_at": prompt.created_at,
+        "updated_at": prompt.updated_at,
+    }
+
+
+# ---------- 搜索结果摘要 ----------
+
+def highlight_snippet(text: Optional[str], terms: Iterable[str], width: int = 80) -> Optional[str]:
+    """
+    截取 text 中第一个关键词附近约 width 个字符，关键词（不区分大小写）用 <mark> 标出，其余内容做 HTML 转义；
+    不包含关键词时返回开头部分
+    """
+    if not text:
+        return text
+    pattern = re.compile("|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    match = pattern.search(text)
+    start = max(0, match.start() - width // 4) if match else 0
+    end = min(len(text), start + width)
+    window = text[start:end]
+    parts = []
+    last = 0
+    for found in pattern.finditer(window):
+        parts.append(html.escape(window[last:found.start()]))
+        parts.append(f"<mark>{html.escape(found.group())}</mark>")
+        last = found.end()
+    parts.append(html.escape(window[last:]))
+    return ("…" if start > 0 else "") + "".join(parts) + ("…" if end < len(text) else "")
@@ -0,0 +1,71 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from database import get_db
+from models import JobRun
+from profiling import get_slow_request, slow_requests, slow_query_plans
+from utils import get_current_admin
+import answer_cache
+from cache_warmup import recent_reports
+
+# 初始化 APIRouter
+router = APIRouter()
+
+@router.get("/slow-requests", summary="慢请求列表")
+async def list_slow_requests(current_user: dict = Depends(get_current_admin)):
+    """
+    返回当前 worker 记录的慢请求及被剖析请求的耗时分解（最新的在前）。
+    """
+    return [profile.to_dict() for profile in reversed(slow_requests)]
+
+@router.get("/slow-requests/{profile_id}", summary="慢请求详情")
+async def get_slow_request_api(profile_id: int, current_user: dict = Depends(get_current_admin)):
+    """
+    返回单个请求的耗时分解及采样剖析报告。
+    """
+    profile = get_slow_request(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile.to_dict(with_report=True)
+
+@router.get("/slow-queries", summary="慢查询执行计划")
+async def list_slow_queries(current_user: dict = Depends(get_current_admin)):
+    """
+    返回当前 worker 捕获的慢查询及其 EXPLAIN 执行计划（最新的在前）。
+    """
+    return list(reversed(slow_query_plans))
+
+@router.get("/job-runs", summary="定时任务执行记录")
+async def list_job_runs(
+    limit: int = Query(50, ge=1, le=500),
+    db: AsyncSession = Depends(get_db),
+    current_user: dict = Depends(get_current_admin)
+):
+    """
+    返回最近的定时任务执行记录。
+    """
+    result = await db.execute(select(JobRun).order_by(JobRun.started_at.desc()).limit(limit))
+    return [
+        {
+            "job_name": run.job_name,
+            "run_key": run.run_key,
+            "worker_id": run.worker_id,
+            "status": run.status,
+            "error": run.error,
+            "started_at": run.started_at,
+            "finished_at": run.finished_at,
+        }
+        for run in result.scalars().all()
+    ]
+
+@router.get("/answer-cache", summary="共享回答缓存命中率与预热报告")
+async def answer_cache_report(
+    limit: int = Query(10, ge=1, le=100),
+    current_user: dict = Depends(get_current_admin)
+):
+    """
+    返回自上次预热以来 /gpt 查询共享回答缓存的次数与命中率，以及最近的预热报告（最新的在前）。
+    """
+    stats = await answer_cache.peek_stats()
+    stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 4) if stats["lookups"] else None
+    return {"since_last_warmup": stats, "warmup_reports": await recent_reports(limit)}
@@ -1,20 +1,25 @@
+import asyncio
+from typing import List
 from utils import get_current_user
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.ext.asyncio import AsyncSession
-from pydantic import BaseModel
-from database import get_db
-from mylogger import logger
-from crud.question import create_call_record, get_existing_answer
-from crud.prompt import get_prompt_by_id
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
 from config import settings
-from openai import OpenAI
-
-# 初始化 OpenAI 客户端
-if not settings.API_KEY or not settings.API_URL:
-    logger.error("API_KEY or API_URL not configured in settings!")
-    raise RuntimeError("OpenAI API configuration missing!")
-
-client = OpenAI(api_key=settings.API_KEY, base_url=settings.API_URL)
+from database import async_session_maker, read_session
+from sharding import SHARDING_ENABLED, question_read_session, shard_session
+from mylogger import logger
+from profiling import query_budget
+from crud.question import create_call_record, create_call_records, get_existing_answer, get_existing_answers
+from crud.prompt import get_prompt_by_id, get_prompts_by_ids
+from usage import record_usage
+from llm import generate_answer
+from fair_queue import tier_of, upstream_slot
+from model_router import route_request
+from deadlines import unless_disconnected
+from metrics import ANSWER_FILTER_FALSE_POSITIVES, GPT_CACHE_LOOKUPS
+import answer_cache
+from answer_filter import answer_filter
+from responses import dump_json
 
 # 初始化 APIRouter
 router = APIRouter()
@@ -25,14 +30,35 @@ class GPTRequest(BaseModel):
     prompt_id: int
     user_id: int
 
+class FanOutRequest(BaseModel):
+    question_content: str
+    prompt_ids: List[int] = Field(..., min_length=1)
+
+
+# 回答来自共享缓存（未调用大模型）的记录的 route
+SHARED_CACHE_ROUTE = "shared_cache"
+
+
+def _routing(decision, generation) -> dict:
+    """问答记录上保存的路由结果与用量"""
+    return {
+        "route": decision.route,
+        "model": generation.model,
+        "prompt_tokens": generation.prompt_tokens or decision.input_tokens,
+        "completion_tokens": generation.completion_tokens,
+        "latency_ms": round(generation.elapsed * 1000),
+    }
+
 @router.post("/", summary="处理 GPT 请求")
+@query_budget(7)
 async def handle_gpt_request(
     request: GPTRequest,
-    db: AsyncSession = Depends(get_db),
+    background_tasks: BackgroundTasks,
     current_user: dict = Depends(get_current_user)  # 添加 JWT 认证
 ):
     """
     处理 GPT 请求
+    每个数据库会话只在各自的查询期间持有连接：调用大模型的数秒内不占用连接池。
     """
     question_content = request.question_content
     prompt_id = request.prompt_id
@@ -40,58 +66,210 @@ async def handle_gpt_request(
 
     logger.info(f"current user: {user_id}")
 
-    # 检查是否有缓存记录
-    try:
-        logger.info("检查是否有缓存")
-        existing_record = await get_existing_answer(db, question_content, prompt_id, user_id)
-    except Exception as db_error:
-        logger.error(f"Database query failed: {db_error}")
-        raise HTTPException(status_code=500, detail="Database query error")
+    # 检查是否有缓存记录；Bloom 过滤器判定一定不存在时跳过数据库查询
+    existing_record = None
+    if answer_filter.might_exist(user_id, prompt_id, question_content):
+        try:
+            logger.info("检查是否有缓存")
+            async with question_read_session(user_id) as db:
+                existing_record = await get_existing_answer(db, question_content, prompt_id, user_id)
+        except Exception as db_error:
+            logger.error(f"Database query failed: {db_error}")
+            raise HTTPException(status_code=500, detail="Database query error")
+        if existing_record is None and answer_filter.bloom is not None:
+            ANSWER_FILTER_FALSE_POSITIVES.inc()
 
     if existing_record:
+        GPT_CACHE_LOOKUPS.labels("hit").inc()
+        background_tasks.add_task(record_usage, user_id, prompt_id, question_content)
         return {
             "status": "success",
             "source": "database",
             "result": existing_record.answer_content
         }
 
+    # 其他用户问过相同的问题（或已由闲时预热生成）：直接使用共享缓存中的回答，不调用大模型、不扣减额度
+    shared_answer = await answer_cache.get(prompt_id, question_content)
+    if shared_answer is not None:
+        GPT_CACHE_LOOKUPS.labels("shared_hit").inc()
+        await _save_record(user_id, question_content, prompt_id, shared_answer, {"route": SHARED_CACHE_ROUTE}, charge_quota=False)
+        background_tasks.add_task(record_usage, user_id, prompt_id, question_content)
+        return {
+            "status": "success",
+            "source": "shared_cache",
+            "result": shared_answer
+        }
+
+    GPT_CACHE_LOOKUPS.labels("miss").inc()
+
     # 调用大模型 API
     try:
-        prompt = await get_prompt_by_id(db, prompt_id)
+        async with read_session(user_id) as db:
+            prompt = await get_prompt_by_id(db, prompt_id)
         if not prompt:
             raise HTTPException(status_code=404, detail="Prompt not found")
 
-        logger.info(f"prompt_content: {prompt.content}")
-        logger.info(f"question_content: {question_content}")
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": prompt.content},
-                {"role": "user", "content": question_content},
-            ],
-            stream=False,
-            max_tokens=500,
-        )
-        generated_answer = response.choices[0].message.content.strip()
+        # 按输入长度、会员等级与上游状态选择模型和 max_tokens，超长输入在调用前截断或拒绝
+        decision = route_request(prompt.content, question_content, tier_of(current_user))
+        logger.info(f"prompt_id: {prompt_id}, 路由: {decision.route} ({decision.model}, max_tokens={decision.max_tokens}), 估算输入 token: {decision.input_tokens}")
+        # 按会员等级限流并公平排队，超出限额时直接返回 429；客户端中途断开时取消调用，不保存结果
+        async with upstream_slot(current_user):
+            generation = await unless_disconnected(
+                generate_answer(prompt.content, decision.question, decision.model, decision.max_tokens)
+            )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"OpenAI API call failed: {e}")
         raise HTTPException(status_code=500, detail="Error calling OpenAI API")
 
-    # 保存结果到数据库
-    try:
-        new_record = await create_call_record(
-            db,
-            user_id=user_id,
-            question_content=question_content,
-            prompt_id=prompt_id,
-            answer_content=generated_answer
-        )
-    except Exception as db_error:
-        logger.error(f"Failed to save record to database: {db_error}")
-        raise HTTPException(status_code=500, detail="Error saving result to database")
-
+    await answer_cache.put(prompt_id, question_content, generation.text)
+    new_record = await _save_record(user_id, question_content, prompt_id, generation.text, _routing(decision, generation))
+    # 只在成功返回回答后记录使用次数（只写入 Redis 计数，响应返回后执行）：
+    # 404 / 403 / 413 / 429 等失败的请求不计入热门 Prompt / 问题排行，避免影响闲时预热的选择
+    background_tasks.add_task(record_usage, user_id, prompt_id, question_content)
     return {
         "status": "success",
         "source": "generated",
         "result": new_record.answer_content
     }
+
+
+async def _save_record(user_id: int, question_content: str, prompt_id: int, answer_content: str, routing: dict, charge_quota: bool = True):
+    """保存结果到数据库"""
+    try:
+        async with async_session_maker() as db:
+            if SHARDING_ENABLED:
+                async with shard_session(user_id) as question_db:
+                    return await create_call_record(db, user_id, question_content, prompt_id, answer_content, question_db=question_db, routing=routing, charge_quota=charge_quota)
+            return await create_call_record(db, user_id, question_content, prompt_id, answer_content, routing=routing, charge_quota=charge_quota)
+    except HTTPException:
+        raise
+    except Exception as db_error:
+        logger.error(f"Failed to save record to database: {db_error}")
+        raise HTTPException(status_code=500, detail="Error saving result to database")
+
+
+@router.post("/fan-out", summary="同一问题使用多个提示并行生成")
+@query_budget(6)
+async def fan_out(
+    request: FanOutRequest,
+    background_tasks: BackgroundTasks,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    用多个提示回答同一个问题，以 NDJSON 流式返回，每个回答就绪后立即输出一行：
+    {"prompt_id": 1, "status": "success", "source": "database" | "shared_cache" | "generated", "result": "..."}
+    {"prompt_id": 2, "status": "error", "status_code": 404, "detail": "Prompt not found"}
+    最后一行为汇总 {"status": "done", "cached": n, "generated": n, "failed": n, "saved": n}。
+    用户的记录、共享回答缓存与提示均为一次批量查询；未命中的组合并发调用大模型（每个请求最多 fanout_concurrency 个，
+    同样经过限流、公平排队与模型路由），全部完成后在一个事务中批量保存并一次扣减额度。
+    """
+    question_content = request.question_content
+    prompt_ids = list(dict.fromkeys(request.prompt_ids))
+    if len(prompt_ids) > settings.fanout_max_prompts:
+        raise HTTPException(status_code=400, detail=f"At most {settings.fanout_max_prompts} prompts per request")
+    user_id = current_user.id
+    tier = tier_of(current_user)
+
+    try:
+        cached = {}
+        candidates = [prompt_id for prompt_id in prompt_ids if answer_filter.might_exist(user_id, prompt_id, question_content)]
+        if candidates:
+            async with question_read_session(user_id) as db:
+                cached = await get_existing_answers(db, question_content, candidates, user_id)
+            if answer_filter.bloom is not None:
+                ANSWER_FILTER_FALSE_POSITIVES.inc(len(candidates) - len(cached))
+        misses = [prompt_id for prompt_id in prompt_ids if prompt_id not in cached]
+        shared = await answer_cache.get_many(misses, question_content)
+        misses = [prompt_id for prompt_id in misses if prompt_id not in shared]
+        prompts = {}
+        if misses:
+            async with read_session(user_id) as db:
+                prompts = await get_prompts_by_ids(db, misses)
+    except Exception as db_error:
+        logger.error(f"Database query failed: {db_error}")
+        raise HTTPException(status_code=500, detail="Database query error")
+    GPT_CACHE_LOOKUPS.labels("hit").inc(len(cached))
+    GPT_CACHE_LOOKUPS.labels("shared_hit").inc(len(shared))
+    GPT_CACHE_LOOKUPS.labels("miss").inc(len(misses))
+
+    semaphore = asyncio.Semaphore(settings.fanout_concurrency)
+
+    async def generate(prompt):
+        async with semaphore:
+            decision = route_request(prompt.content, question_content, tier)
+            async with upstream_slot(current_user):
+                generation = await generate_answer(prompt.content, decision.question, decision.model, decision.max_tokens)
+            return decision, generation
+
+    async def run(prompt_id):
+        """返回 (prompt_id, 输出行, 待保存的记录或 None)"""
+        try:
+            decision, generation = await generate(prompts[prompt_id])
+        except HTTPException as e:
+            return prompt_id, {"prompt_id": prompt_id, "status": "error", "status_code": e.status_code, "detail": e.detail}, None
+        except Exception as e:
+            logger.error(f"OpenAI API call failed: {e}")
+            return prompt_id, {"prompt_id": prompt_id, "status": "error", "status_code": 500, "detail": "Error calling OpenAI API"}, None
+        line = {"prompt_id": prompt_id, "status": "success", "source": "generated", "result": generation.text}
+        return prompt_id, line, (prompt_id, generation.text, _routing(decision, generation))
+
+    async def stream():
+        for prompt_id, record in cached.items():
+            yield dump_json({"prompt_id": prompt_id, "status": "success", "source": "database", "result": record.answer_content}) + b"\n"
+        # 共享缓存命中的回答同样保存到用户的记录，但不扣减额度
+        records = [(prompt_id, answer, {"route": SHARED_CACHE_ROUTE}) for prompt_id, answer in shared.items()]
+        for prompt_id, answer in shared.items():
+            yield dump_json({"prompt_id": prompt_id, "status": "success", "source": "shared_cache", "result": answer}) + b"\n"
+
+        # 不存在的提示直接返回 404，不占用额度；额度不足以覆盖其余未命中的组合时，超出部分不调用大模型
+        for prompt_id in misses:
+            if prompt_id not in prompts:
+                yield dump_json({"prompt_id": prompt_id, "status": "error", "status_code": 404, "detail": "Prompt not found"}) + b"\n"
+        known = [prompt_id for prompt_id in misses if prompt_id in prompts]
+        allowed = known[:max(0, current_user.model_quota)]
+        for prompt_id in known[len(allowed):]:
+            yield dump_json({"prompt_id": prompt_id, "status": "error", "status_code": 403, "detail": "Insufficient model quota"}) + b"\n"
+
+        tasks = [asyncio.ensure_future(run(prompt_id)) for prompt_id in allowed]
+        generated = []
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                prompt_id, line, record = await next_done
+                if record is not None:
+                    generated.append(record)
+                yield dump_json(line) + b"\n"
+        finally:
+            # 客户端断开时取消尚未完成的调用
+            for task in tasks:
+                task.cancel()
+
+        # 与 /gpt 相同，只有成功返回回答的提示计入使用次数（流结束后由 background_tasks 执行）
+        for prompt_id in [*cached, *shared, *(prompt_id for prompt_id, _, _ in generated)]:
+            background_tasks.add_task(record_usage, user_id, prompt_id, question_content)
+        if generated:
+            await answer_cache.put_many([(prompt_id, answer) for prompt_id, answer, _ in generated], question_content)
+        records += generated
+        saved = 0
+        summary = {
+            "status": "done", "cached": len(cached) + len(shared), "generated": len(generated),
+            "failed": len(prompt_ids) - len(cached) - len(shared) - len(generated),
+        }
+        if records:
+            try:
+                async with async_session_maker() as db:
+                    if SHARDING_ENABLED:
+                        async with shard_session(user_id) as question_db:
+                            saved = len(await create_call_records(db, user_id, question_content, records, question_db=question_db, charged=len(generated)))
+                    else:
+                        saved = len(await create_call_records(db, user_id, question_content, records, charged=len(generated)))
+            except HTTPException as e:
+                summary["error"] = e.detail
+            except Exception as db_error:
+                logger.error(f"Failed to save records to database: {db_error}")
+                summary["error"] = "Error saving results to database"
+        summary["saved"] = saved
+        yield dump_json(summary) + b"\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
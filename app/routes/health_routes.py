@@ -0,0 +1,31 @@
+import asyncio
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+from config import settings
+from database import check_dependencies
+
+# 初始化 APIRouter
+router = APIRouter()
+
+@router.get("/healthz", summary="存活检查")
+async def healthz():
+    """
+    只要事件循环能响应即视为存活，不检查外部依赖。
+    """
+    return {"status": "ok"}
+
+@router.get("/readyz", summary="就绪检查")
+async def readyz(request: Request):
+    """
+    启动预热完成且数据库、Redis 均可用时返回 200，否则返回 503。
+    """
+    if not getattr(request.app.state, "ready", False):
+        return JSONResponse(status_code=503, content={"status": "starting"})
+
+    try:
+        checks = await asyncio.wait_for(check_dependencies(), timeout=settings.readiness_timeout_seconds)
+    except asyncio.TimeoutError:
+        return JSONResponse(status_code=503, content={"status": "timeout"})
+
+    ready = all(result == "ok" for result in checks.values())
+    return JSONResponse(status_code=200 if ready else 503, content={"status": "ok" if ready else "degraded", "checks": checks})
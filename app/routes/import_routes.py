@@ -0,0 +1,38 @@
+from fastapi import APIRouter, HTTPException, Depends, Request, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from database import get_db
+from crud.bulk import IMPORTERS, iter_lines, iter_rows
+from utils import get_current_admin
+from mylogger import logger
+
+# 初始化 APIRouter
+router = APIRouter()
+
+def _detect_format(request: Request, fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    content_type = request.headers.get("content-type", "")
+    return "csv" if "csv" in content_type else "ndjson"
+
+@router.post("/{kind}", summary="批量导入用户、提示或问题")
+async def bulk_import_api(
+    kind: str,
+    request: Request,
+    fmt: Optional[str] = Query(None, alias="format", pattern="^(ndjson|csv)$", description="ndjson 或 csv，默认按 Content-Type 判断"),
+    db: AsyncSession = Depends(get_db),
+    current_user: dict = Depends(get_current_admin)  # 仅管理员可用
+):
+    """
+    以 NDJSON 或 CSV 流批量导入 users / prompts / questions。
+    按批校验并集合式写入，无效行记录在返回的 errors 中，不会中断整个导入。
+    """
+    importer = IMPORTERS.get(kind)
+    if not importer:
+        raise HTTPException(status_code=404, detail="Unknown import type")
+
+    fmt = _detect_format(request, fmt)
+    rows = iter_rows(iter_lines(request.stream()), fmt)
+    report = await importer(db, rows)
+    logger.info(f"批量导入 {kind}: 共 {report.total} 行，成功 {report.inserted} 行，失败 {report.failed} 行")
+    return report.to_dict()
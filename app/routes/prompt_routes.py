@@ -1,37 +1,67 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
-from database import get_db
+from database import get_db, get_read_db
+from profiling import query_budget
 from crud import prompt as crud_prompt
 from schemas import PromptCreate, PromptUpdate, PromptResponse
+from usage import top_prompts
+from responses import negotiated_response, prompt_to_dict
+from http_cache import PUBLIC_SHORT, conditional_response, make_etag
+from fieldsets import PROMPT_COLUMNS, PROMPT_PREVIEWS, PROMPT_SUMMARY, parse_fields
 
 # 初始化 APIRouter
 router = APIRouter()
 
 @router.post("/", response_model=PromptResponse, summary="创建提示")
+@query_budget(2)
 async def create_prompt_api(prompt: PromptCreate, db: AsyncSession = Depends(get_db)):
     """
     创建一个新的提示（Prompt）。
     """
     return await crud_prompt.create_prompt(db, prompt)
 
+@router.get("/top", summary="最常用的提示")
+async def top_prompts_api(limit: int = Query(10, ge=1, le=100)):
+    """
+    按使用次数降序返回提示 ID，直接读取 Redis 有序集合。
+    """
+    return await top_prompts(limit)
+
 @router.get("/{prompt_id}", response_model=PromptResponse, summary="获取提示详情")
-async def get_prompt_api(prompt_id: int, db: AsyncSession = Depends(get_db)):
+@query_budget(1)
+async def get_prompt_api(request: Request, prompt_id: int, db: AsyncSession = Depends(get_read_db)):
     """
     根据 ID 获取提示详情。
+    支持 If-None-Match / If-Modified-Since，未变化时返回 304。
     """
     prompt = await crud_prompt.get_prompt_by_id(db, prompt_id)
     if not prompt:
         raise HTTPException(status_code=404, detail="Prompt not found")
-    return prompt
+    etag = make_etag("prompt", prompt.id, prompt.updated_at.isoformat(), prompt.content)
+    return conditional_response(
+        request, etag, lambda: prompt_to_dict(prompt), last_modified=prompt.updated_at, cache_control=PUBLIC_SHORT
+    )
 
 @router.get("/", response_model=list[PromptResponse], summary="获取提示列表")
-async def list_prompts_api(skip: int = 0, limit: int = 10, db: AsyncSession = Depends(get_db)):
+@query_budget(1)
+async def list_prompts_api(
+    request: Request,
+    skip: int = 0,
+    limit: int = 10,
+    fields: str = Query(None, description="逗号分隔的返回字段，如 id,content_preview"),
+    summary: bool = Query(False, description="只返回 ID、日期与内容预览"),
+    db: AsyncSession = Depends(get_read_db)
+):
     """
     获取提示列表，支持分页。
+    指定 fields 或 summary 时只返回部分字段，完整内容通过详情接口获取。
     """
-    return await crud_prompt.get_all_prompts(db, skip, limit)
+    selected = parse_fields(fields, summary, PROMPT_COLUMNS, PROMPT_PREVIEWS, PROMPT_SUMMARY)
+    prompts = await crud_prompt.get_all_prompts(db, skip, limit, fields=selected)
+    return negotiated_response(request, prompts if selected else [prompt_to_dict(p) for p in prompts])
 
 @router.put("/{prompt_id}", response_model=PromptResponse, summary="更新提示")
+@query_budget(3)
 async def update_prompt_api(prompt_id: int, prompt_update: PromptUpdate, db: AsyncSession = Depends(get_db)):
     """
     更新指定的提示信息。
@@ -42,6 +72,7 @@ async def update_prompt_api(prompt_id: int, prompt_update: PromptUpdate, db: Asy
     return updated_prompt
 
 @router.delete("/{prompt_id}", response_model=PromptResponse, summary="删除提示")
+@query_budget(4)
 async def delete_prompt_api(prompt_id: int, db: AsyncSession = Depends(get_db)):
     """
     删除指定的提示。
@@ -1,22 +1,31 @@
 from typing import List
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from schemas import QuestionCreate, QuestionResponse, QuestionUpdate
 from crud import question as crud_question
-from crud.question import get_questions_by_user
+from history_cache import history_page, put_question
+from answer_filter import answer_filter
 from models import Question
-from database import get_db
 from mylogger import logger
-from utils import get_current_user
+from profiling import query_budget
+from utils import get_current_user, get_current_admin, get_question_db, get_question_read_db
+from usage import top_questions
+from responses import highlight_snippet, negotiated_response, question_to_dict
+from http_cache import conditional_response, make_etag
+from fieldsets import QUESTION_COLUMNS, QUESTION_PREVIEWS, QUESTION_SUMMARY, parse_fields
+from sharding import scatter_gather
 from sqlalchemy import select
 
 # 初始化 APIRouter
 router = APIRouter()
 
+SEARCH_MAX_TERMS = 5
+
 @router.post("/", response_model=QuestionResponse, summary="创建问题")
+@query_budget(3)
 async def create_question_api(
     question: QuestionCreate, 
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_question_db),
     current_user: dict = Depends(get_current_user)  # 添加 JWT 认证
 ):
     """
@@ -28,82 +37,134 @@ async def create_question_api(
 
 # 分页读取历史记录并按日期分组
 @router.get("/history", response_model=List[dict], summary="分页读取历史记录并按日期分组")
+@query_budget(2)
 async def get_questions_history(
+    request: Request,
     page: int = Query(1, ge=1, description="分页页码，默认为1"),
     limit: int = Query(10, ge=1, le=100, description="分页大小，默认为10，最大值100"),
-    db: AsyncSession = Depends(get_db),
+    fields: str = Query(None, description="逗号分隔的返回字段，如 id,created_at,question_preview"),
+    summary: bool = Query(False, description="只返回 ID、日期与问题/回答预览"),
+    db: AsyncSession = Depends(get_question_read_db),
     current_user: dict = Depends(get_current_user)  # 添加 JWT 认证
 ):
-    # 查询所有属于用户的记录
-    all_questions = await get_questions_by_user(db, current_user.id)
-    if not all_questions:
-        # 如果没有历史记录，返回空列表
-        return []
-
-    # 按日期分组问题
-    grouped_data = {}
-    for question in all_questions:
-        created_date = question.created_at.date()
-        if created_date not in grouped_data:
-            grouped_data[created_date] = []
-        grouped_data[created_date].append({
-            "id": question.id,
-            "question_content": question.question_content,
-            "answer_content": question.answer_content,
-            "user_id": question.user_id,
-            "prompt_id": question.prompt_id,
-            "created_at": question.created_at.strftime("%Y-%m-%d"),  # 只返回日期部分
-            "updated_at": question.updated_at.strftime("%Y-%m-%d"),
-        })
-
-    # 转换为列表并按日期排序
-    grouped_list = [{"date": str(date), "questions": questions} for date, questions in grouped_data.items()]
-    grouped_list.sort(key=lambda x: x["date"], reverse=True)  # 日期降序排序
-    # logger.info(f"grouped_list:{len(grouped_list)}")
-
-    # 按日期分页
-    # logger.info(f"page,limit:{page},{limit}")
-    start = (page - 1) * limit
-    end = start + limit
-    paginated_data = grouped_list[start:end]
-    # logger.info(f"start,end:{start},{end}")
-    
-    # logger.info(f"paginated_data:{len(paginated_data)}")
+    selected = parse_fields(fields, summary, QUESTION_COLUMNS, QUESTION_PREVIEWS, QUESTION_SUMMARY)
+    # 从 Redis 中的历史记录索引读取已编码好的整页，未命中时由索引构建（必要时查库）
+    body = await history_page(db, current_user.id, page, limit, fields=selected)
+    # ETag 取自已编码的整页内容，未变化时返回 304
+    return conditional_response(request, make_etag("history", body.body), lambda: body)
+
 
-    return paginated_data
+@router.get("/top", summary="最常被提问的问题")
+async def top_questions_api(
+    limit: int = Query(10, ge=1, le=100),
+    current_user: dict = Depends(get_current_admin)  # 包含所有用户的数据，仅管理员可用
+):
+    """
+    按提问次数降序返回问题，直接读取 Redis 有序集合。
+    """
+    return await top_questions(limit)
+
+
+@router.get("/all", response_model=List[QuestionResponse], summary="所有用户的最新问题")
+async def list_all_questions_api(
+    limit: int = Query(20, ge=1, le=100),
+    current_user: dict = Depends(get_current_admin)  # 包含所有用户的数据，仅管理员可用
+):
+    """
+    按创建时间倒序返回所有用户的最新问题；启用分片时在各分片上并发查询后合并。
+    """
+    async def latest(db: AsyncSession):
+        result = await db.execute(select(Question).order_by(Question.created_at.desc()).limit(limit))
+        return result.scalars().all()
+
+    questions = [question for shard in await scatter_gather(latest) for question in shard]
+    questions.sort(key=lambda question: question.created_at, reverse=True)
+    return questions[:limit]
+
+
+@router.get("/search", summary="搜索历史问答")
+@query_budget(2)
+async def search_questions_api(
+    q: str = Query(..., min_length=1, max_length=200, description="关键词，多个关键词用空格分隔，须全部出现"),
+    page: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1, le=50),
+    db: AsyncSession = Depends(get_question_read_db),
+    current_user: dict = Depends(get_current_user)  # 添加 JWT 认证
+):
+    """
+    在当前用户的问答中搜索关键词（不区分大小写），按相关度（关键词出现在问题中优先）与时间排序分页返回。
+    question_snippet / answer_snippet 为关键词附近的摘要，关键词以 <mark> 标出，其余内容已做 HTML 转义。
+    PostgreSQL 上由 pg_trgm GIN 索引支持；中文关键词需数据库的 LC_CTYPE 为 UTF-8 区域设置（非 C），
+    少于 3 个字的关键词无法使用三元组索引，只在该用户的记录中逐行匹配。
+    """
+    terms = list(dict.fromkeys(q.split()))[:SEARCH_MAX_TERMS]
+    if not terms:
+        raise HTTPException(status_code=400, detail="Search query is required")
+    rows = await crud_question.search_questions(db, current_user.id, terms, (page - 1) * limit, limit)
+    return {
+        "page": page,
+        "limit": limit,
+        "has_more": len(rows) > limit,
+        "results": [
+            {
+                "id": row.id,
+                "prompt_id": row.prompt_id,
+                "created_at": row.created_at,
+                "score": row.score,
+                "question_snippet": highlight_snippet(row.question_content, terms),
+                "answer_snippet": highlight_snippet(row.answer_content, terms),
+            }
+            for row in rows[:limit]
+        ],
+    }
 
 
 @router.get("/{question_id}", response_model=QuestionResponse, summary="获取问题详情")
+@query_budget(2)
 async def get_question_api(
+    request: Request,
     question_id: int, 
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_question_read_db),
     current_user: dict = Depends(get_current_user)  # 添加 JWT 认证
     ):
     """
     根据问题 ID 获取问题详情。
+    支持 If-None-Match / If-Modified-Since，未变化时返回 304。
     """
     question = await crud_question.get_question_by_id(db, question_id)
     if not question or question.user_id != current_user.id:  # 验证用户权限
         raise HTTPException(status_code=403, detail="Permission denied")
-    return question
+    etag = make_etag(
+        "question", question.id, question.updated_at.isoformat(), question.prompt_id,
+        question.question_content, question.answer_content,
+    )
+    return conditional_response(request, etag, lambda: question_to_dict(question), last_modified=question.updated_at)
 
 @router.get("/", response_model=List[QuestionResponse], summary="获取问题列表")
+@query_budget(2)
 async def list_questions_api(
+    request: Request,
     skip: int = 0, 
     limit: int = 10, 
-    db: AsyncSession = Depends(get_db),
+    fields: str = Query(None, description="逗号分隔的返回字段，如 id,created_at,question_preview"),
+    summary: bool = Query(False, description="只返回 ID、日期与问题/回答预览"),
+    db: AsyncSession = Depends(get_question_read_db),
     current_user: dict = Depends(get_current_user)  # 添加 JWT 认证
 ):
     """
     获取问题列表，支持分页。
+    指定 fields 或 summary 时只返回部分字段，完整内容通过 GET /questions/{id} 获取。
     """
-    return await crud_question.get_all_questions(db, skip, limit, user_id=current_user.id)  # 限制为当前用户的问题
+    selected = parse_fields(fields, summary, QUESTION_COLUMNS, QUESTION_PREVIEWS, QUESTION_SUMMARY)
+    questions = await crud_question.get_all_questions(db, skip, limit, user_id=current_user.id, fields=selected)  # 限制为当前用户的问题
+    return negotiated_response(request, questions if selected else [question_to_dict(q) for q in questions])
 
 
 @router.put("/update-by-original-content", summary="通过原始内容更新问题")
+@query_budget(3)
 async def update_by_original_content(
     request: dict, 
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_question_db),
     current_user: dict = Depends(get_current_user)  # 添加 JWT 认证
 ):
     # 获取请求参数
@@ -117,18 +178,12 @@ async def update_by_original_content(
     if not question_content and not answer_content:
         raise HTTPException(status_code=400, detail="At least one of question_content or answer_content is required")
 
-    # 查找记录
+    # 查找记录：按 (user_id, 内容哈希) 索引在当前用户的记录中查找
     logger.info(f"Received original_content: {original_content}")
-    result = await db.execute(
-        select(Question).where(
-            (Question.question_content == original_content) |
-            (Question.answer_content == original_content)
-        )
-    )
-    question = result.scalars().first()
+    question = await crud_question.get_question_by_content(db, current_user.id, original_content)
 
     # 检查记录是否存在
-    if not question or question.user_id != current_user.id:  # 验证用户权限:
+    if not question:
         raise HTTPException(status_code=404, detail="Question not found")
 
     logger.info(f"Found question: {question}")
@@ -141,15 +196,18 @@ async def update_by_original_content(
 
     # 提交更改
     await db.commit()
+    await put_question(question)
+    await answer_filter.add_questions([question])
 
     return {"question_id": question.id, "message": "Update successful"}
 
 
 @router.put("/{question_id}", response_model=QuestionResponse, summary="更新问题")
+@query_budget(5)
 async def update_question_api(
     question_id: int, 
     question_update: QuestionUpdate, 
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_question_db),
     current_user: dict = Depends(get_current_user)  # 添加 JWT 认证
 ):
     """
@@ -163,16 +221,17 @@ async def update_question_api(
     return updated_question
 
 @router.delete("/{question_id}", response_model=QuestionResponse, summary="删除问题")
+@query_budget(4)
 async def delete_question_api(
     question_id: int, 
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_question_db),
     current_user: dict = Depends(get_current_user)  # 添加 JWT 认证
 ):
     """
     删除指定问题。
     """
     question = await crud_question.get_question_by_id(db, question_id)
-    if not deleted_question or question.user_id != current_user.id:  # 验证用户权限
+    if not question or question.user_id != current_user.id:  # 验证用户权限
         raise HTTPException(status_code=404, detail="Question not found")
     
     deleted_question = await crud_question.delete_question(db, question_id)
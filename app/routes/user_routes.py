@@ -24,12 +24,14 @@ from utils import (
 from database import get_db, get_delay, redis_client
 from config import settings
 from mylogger import logger
+from profiling import query_budget
 
 # 初始化 APIRouter
 router = APIRouter()
 
 # 用户注册
 @router.post("/register", response_model=UserResponse, summary="用户注册")
+@query_budget(5)
 async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
     db_user = await get_user_by_username(db, user.username)
     if db_user:
@@ -57,6 +59,7 @@ async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
 
 # 用户登录
 @router.post("/login", summary="用户登录")
+@query_budget(2)
 async def login(user: UserCreate, db: AsyncSession = Depends(get_db)):
 
     # 检查 Redis 中的延迟
@@ -127,6 +130,7 @@ async def logout(token: str = Depends(oauth2_scheme)):
 
 # 获取当前用户信息
 @router.get("/me", response_model=UserResponse, summary="获取当前用户信息")
+@query_budget(1)
 async def get_me(current_user: UserResponse = Depends(get_current_user)):
     return current_user
 
@@ -145,6 +149,7 @@ async def protected_route(token: str = Depends(oauth2_scheme), db: AsyncSession
 
 # 创建用户（管理员功能）
 @router.post("/", response_model=UserResponse, summary="创建用户")
+@query_budget(3)
 async def create_user_api(user: UserCreate, db: AsyncSession = Depends(get_db)):
     db_user = await get_user_by_username(db, user.username)
     if db_user:
@@ -153,6 +158,7 @@ async def create_user_api(user: UserCreate, db: AsyncSession = Depends(get_db)):
 
 # 获取用户详情
 @router.get("/{user_id}", response_model=UserResponse, summary="获取用户详情")
+@query_budget(1)
 async def read_user(user_id: int, db: AsyncSession = Depends(get_db)):
     db_user = await get_user_by_id(db, user_id)
     if not db_user:
@@ -161,11 +167,13 @@ async def read_user(user_id: int, db: AsyncSession = Depends(get_db)):
 
 # 列出所有用户
 @router.get("/", response_model=list[UserResponse], summary="列出用户")
+@query_budget(1)
 async def list_users(skip: int = 0, limit: int = 10, db: AsyncSession = Depends(get_db)):
     return await get_users(db, skip, limit)
 
 # 更新用户信息
 @router.put("/{user_id}", response_model=UserResponse, summary="更新用户信息")
+@query_budget(3)
 async def update_user(user_id: int, user_update: UserUpdate, db: AsyncSession = Depends(get_db)):
     db_user = await crud_update_user(db, user_id, user_update)
     if not db_user:
@@ -174,6 +182,7 @@ async def update_user(user_id: int, user_update: UserUpdate, db: AsyncSession =
 
 # 删除用户
 @router.delete("/{user_id}", response_model=UserResponse, summary="删除用户")
+@query_budget(6)
 async def delete_user(user_id: int, db: AsyncSession = Depends(get_db)):
     db_user = await crud_delete_user(db, user_id)
     if not db_user:
@@ -87,4 +87,20 @@ class CallRecordCreate(BaseModel):
 
 class HistoryItem(BaseModel):
     date: str
-    questions: List[QuestionResponse]  # 每天的问答记录
\ No newline at end of file
+    questions: List[QuestionResponse]  # 每天的问答记录
+
+# 批量导入相关模型（user_id 与 username 二选一）
+class UserImport(UserBase):
+    password: str
+    model_quota: Optional[int] = None
+    membership_type: Optional[str] = None
+
+class PromptImport(PromptBase):
+    user_id: Optional[int] = None
+    username: Optional[str] = None
+
+class QuestionImport(QuestionBase):
+    answer_content: Optional[str] = None
+    prompt_id: Optional[int] = None
+    user_id: Optional[int] = None
+    username: Optional[str] = None
@@ -0,0 +1,77 @@
+"""
+问答分片运维命令行工具（需配置 QUESTION_SHARD_URLS）
+
+用法（在 app 目录下执行）:
+    python shard_cli.py init                  # 在各分片建表（已有的表补充新增的列），初始化问答 ID 计数器
+    python shard_cli.py import-primary        # 将主库中已有的问答复制到各分片
+    python shard_cli.py status                # 各分片的用户数与问答数
+    python shard_cli.py move 42 1             # 将用户 42 迁移到分片 1
+    python shard_cli.py rebalance --dry-run   # 按问答数量均衡各分片（--dry-run 只输出计划）
+    python shard_cli.py rebuild-directory     # 根据分片中的数据重建 Redis 中的分片目录
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+import sharding
+
+
+async def status():
+    return [
+        {"shard": index, "users": len(counts), "questions": sum(counts.values())}
+        for index, counts in enumerate(await sharding.user_counts())
+    ]
+
+
+async def rebalance(dry_run: bool):
+    moves = sharding.plan_rebalance(await sharding.user_counts())
+    if not dry_run:
+        for user_id, _, target in moves:
+            await sharding.move_user(user_id, target)
+    return {"moves": [{"user_id": user_id, "from": source, "to": target} for user_id, source, target in moves], "dry_run": dry_run}
+
+
+async def run(args):
+    if args.command == "init":
+        await sharding.init_shards()
+        return {"shards": len(sharding.shard_engines)}
+    if args.command == "import-primary":
+        return {"copied": await sharding.import_from_primary()}
+    if args.command == "status":
+        return await status()
+    if args.command == "move":
+        return {"moved": await sharding.move_user(args.user_id, args.shard)}
+    if args.command == "rebalance":
+        return await rebalance(args.dry_run)
+    if args.command == "rebuild-directory":
+        return {"users": await sharding.rebuild_directory()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="问答分片运维")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("init", help="在各分片建表并初始化 ID 计数器")
+    commands.add_parser("import-primary", help="将主库中的问答复制到各分片")
+    commands.add_parser("status", help="各分片的用户数与问答数")
+    move = commands.add_parser("move", help="迁移单个用户")
+    move.add_argument("user_id", type=int)
+    move.add_argument("shard", type=int)
+    balance = commands.add_parser("rebalance", help="按问答数量均衡各分片")
+    balance.add_argument("--dry-run", action="store_true")
+    commands.add_parser("rebuild-directory", help="根据分片数据重建分片目录")
+    args = parser.parse_args()
+
+    if not sharding.SHARDING_ENABLED:
+        print("QUESTION_SHARD_URLS 未配置，未启用分片", file=sys.stderr)
+        sys.exit(1)
+    if args.command == "move" and not 0 <= args.shard < len(sharding.shard_engines):
+        print(f"分片序号应在 0..{len(sharding.shard_engines) - 1} 之间", file=sys.stderr)
+        sys.exit(1)
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
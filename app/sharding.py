@@ -0,0 +1,306 @@
+"""
+问答记录（questions_and_answers）按 user_id 分片
+
+配置 QUESTION_SHARD_URLS（逗号分隔的数据库连接串）后启用；未配置时所有函数都退化为使用主库。
+- 分片目录：Redis hash user_id -> 分片序号。用户首次访问时按 user_id 取模分配并固定下来，
+  之后新增分片只影响新用户，已有用户通过 shard_cli.py rebalance 迁移
+- 迁移中的用户在目录中标记为 moving，期间其问答请求返回 503，迁移完成后切换到新分片
+- 问答 ID 由 Redis 计数器统一分配，保证跨分片唯一，迁移时保留原 ID
+- 分片库只存放 questions_and_answers 表（不含指向主库的外键），由 shard_cli.py init 创建
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from fastapi import HTTPException
+from sqlalchemy import Column, Index, MetaData, Table, delete, func, insert, inspect, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import sessionmaker
+from config import settings
+from database import async_session_maker, build_engine, read_session, redis_client
+from models import Question, text_md5
+from mylogger import logger
+
+T = TypeVar("T")
+
+DIRECTORY_KEY = "shard:directory"  # hash: user_id -> 分片序号 / "moving"
+QUESTION_ID_KEY = "shard:question_id"  # 问答 ID 计数器
+MOVING = "moving"
+
+shard_engines = [build_engine(url.strip()) for url in settings.question_shard_urls.split(",") if url.strip()]
+shard_session_makers = [
+    sessionmaker(bind=shard_engine, class_=AsyncSession, expire_on_commit=False)
+    for shard_engine in shard_engines
+]
+SHARDING_ENABLED = bool(shard_engines)
+
+
+async def shard_for_user(user_id: int) -> int:
+    """返回用户所在的分片序号，首次访问时分配并写入目录"""
+    value = await redis_client.hget(DIRECTORY_KEY, user_id)
+    if value is None:
+        await redis_client.hsetnx(DIRECTORY_KEY, user_id, user_id % len(shard_engines))
+        value = await redis_client.hget(DIRECTORY_KEY, user_id)
+    if value == MOVING:
+        raise HTTPException(status_code=503, detail="User data is being migrated, please retry", headers={"Retry-After": "2"})
+    return int(value)
+
+
+@asynccontextmanager
+async def shard_session(user_id: int):
+    """用户所在分片的会话；未启用分片时为主库会话"""
+    if not SHARDING_ENABLED:
+        async with async_session_maker() as session:
+            yield session
+        return
+    async with shard_session_makers[await shard_for_user(user_id)]() as session:
+        yield session
+
+
+def question_read_session(user_id: int):
+    """读取用户问答记录的会话：启用分片时为用户所在分片，否则为只读副本（用户近期有写入时为主库）"""
+    return shard_session(user_id) if SHARDING_ENABLED else read_session(user_id)
+
+
+async def allocate_question_ids(count: int) -> List[Optional[int]]:
+    """分配问答 ID；未启用分片时返回 None，由数据库自增生成"""
+    if not SHARDING_ENABLED:
+        return [None] * count
+    last = await redis_client.incrby(QUESTION_ID_KEY, count)
+    return list(range(last - count + 1, last + 1))
+
+
+async def new_question_id() -> Optional[int]:
+    return (await allocate_question_ids(1))[0]
+
+
+async def scatter_gather(query: Callable[[AsyncSession], Awaitable[T]]) -> List[T]:
+    """
+    在所有分片上并发执行 query(session)，按分片顺序返回结果；未启用分片时只在主库执行。
+    用于少数需要覆盖全部用户的管理查询。
+    """
+    session_makers = shard_session_makers or [async_session_maker]
+
+    async def run(session_maker):
+        async with session_maker() as session:
+            return await query(session)
+
+    return list(await asyncio.gather(*(run(session_maker) for session_maker in session_makers)))
+
+
+async def execute_on_shards(*statements):
+    """在所有分片上执行写语句（如删除用户、解除 Prompt 关联）；未启用分片时不执行"""
+    if not SHARDING_ENABLED:
+        return
+
+    async def run(session: AsyncSession):
+        for statement in statements:
+            await session.execute(statement, execution_options={"synchronize_session": False})
+        await session.commit()
+
+    await scatter_gather(run)
+
+
+async def group_by_shard(user_ids) -> Dict[int, List[int]]:
+    """将 user_id 按所在分片分组：{分片序号: [user_id, ...]}"""
+    groups: Dict[int, List[int]] = {}
+    for user_id in set(user_ids):
+        groups.setdefault(await shard_for_user(user_id), []).append(user_id)
+    return groups
+
+
+async def forget_user(user_id: int):
+    if SHARDING_ENABLED:
+        await redis_client.hdel(DIRECTORY_KEY, user_id)
+
+
+# ---- 运维：建表、迁移、重新均衡（见 shard_cli.py） ----
+
+def shard_table(metadata: MetaData) -> Table:
+    """分片库中的问答表：与主库相同的列，去掉指向 users / prompts 的外键"""
+    columns = [
+        Column(
+            column.name, column.type,
+            primary_key=column.primary_key,
+            autoincrement=False,
+            nullable=column.nullable,
+            index=column.primary_key or column.name in ("user_id", "created_at"),
+        )
+        for column in Question.__table__.columns
+    ]
+    table = Table(Question.__tablename__, metadata, *columns)
+    # 与主库相同的组合索引与搜索索引（哈希查找、pg_trgm）
+    for index in Question.__table__.indexes:
+        if len(index.columns) > 1 or index.dialect_kwargs:
+            Index(index.name, *(table.c[column.name] for column in index.columns), **index.dialect_kwargs)
+    return table
+
+
+def _add_missing_columns(conn, table: Table):
+    """已有的分片表补充新增的列（分片库不经过 alembic 迁移），新增列均为可空列"""
+    existing = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    for column in table.columns:
+        if column.name not in existing:
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+
+
+def _add_missing_indexes(conn, table: Table):
+    existing = {index["name"] for index in inspect(conn).get_indexes(table.name)}
+    for index in table.indexes:
+        if index.name not in existing:
+            index.create(conn)
+
+
+def _backfill_hashes(conn, table: Table, batch_size: int = 1000):
+    """补算新增哈希列之前写入的行（PostgreSQL 上直接用 md5()，与 models.text_md5 一致）"""
+    if conn.dialect.name == "postgresql":
+        conn.execute(
+            update(table).where(table.c.question_hash.is_(None))
+            .values(question_hash=func.md5(table.c.question_content), answer_hash=func.md5(table.c.answer_content))
+        )
+        return
+    while True:
+        rows = conn.execute(
+            select(table.c.id, table.c.question_content, table.c.answer_content)
+            .where(table.c.question_hash.is_(None)).limit(batch_size)
+        ).all()
+        for row in rows:
+            conn.execute(
+                update(table).where(table.c.id == row.id)
+                .values(question_hash=text_md5(row.question_content), answer_hash=text_md5(row.answer_content))
+            )
+        if len(rows) < batch_size:
+            return
+
+
+async def init_shards():
+    """
+    在各分片上建表（已有的表补充新增的列与索引、回填哈希列），
+    并将 ID 计数器推进到主库与各分片中已有的最大 ID 之后
+    """
+    metadata = MetaData()
+    table = shard_table(metadata)
+    for shard_engine in shard_engines:
+        async with shard_engine.begin() as conn:
+            if shard_engine.dialect.name == "postgresql":
+                await conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            await conn.run_sync(metadata.create_all)
+            await conn.run_sync(_add_missing_columns, table)
+            await conn.run_sync(_add_missing_indexes, table)
+            await conn.run_sync(_backfill_hashes, table)
+
+    max_ids = await scatter_gather(lambda session: _max_question_id(session))
+    async with async_session_maker() as session:
+        max_ids.append(await _max_question_id(session))
+    current = int(await redis_client.get(QUESTION_ID_KEY) or 0)
+    if max(max_ids) > current:
+        await redis_client.set(QUESTION_ID_KEY, max(max_ids))
+
+
+async def _max_question_id(session: AsyncSession) -> int:
+    return (await session.execute(select(func.max(Question.id)))).scalar() or 0
+
+
+async def user_counts() -> List[Dict[int, int]]:
+    """各分片中每个用户的问答数量"""
+    async def count(session: AsyncSession):
+        result = await session.execute(select(Question.user_id, func.count()).group_by(Question.user_id))
+        return dict(result.all())
+
+    return await scatter_gather(count)
+
+
+async def rebuild_directory() -> int:
+    """根据各分片中的实际数据重建目录（Redis 数据丢失时使用），返回写入的用户数"""
+    mapping = {}
+    for index, counts in enumerate(await user_counts()):
+        for user_id in counts:
+            mapping[user_id] = index
+    if mapping:
+        await redis_client.hset(DIRECTORY_KEY, mapping=mapping)
+    return len(mapping)
+
+
+async def _copy_rows(source: AsyncSession, target: AsyncSession, where) -> int:
+    rows = (await source.execute(select(Question.__table__).where(where))).mappings().all()
+    if rows:
+        await target.execute(insert(Question.__table__), [dict(row) for row in rows])
+    await target.commit()
+    return len(rows)
+
+
+async def move_user(user_id: int, target: int) -> int:
+    """
+    将用户的问答迁移到目标分片，返回迁移的行数。
+    先标记 moving 并等待进行中的请求结束，复制完成后切换目录，最后删除源分片中的数据。
+    """
+    source = await shard_for_user(user_id)
+    if source == target:
+        return 0
+
+    await redis_client.hset(DIRECTORY_KEY, user_id, MOVING)
+    await asyncio.sleep(settings.shard_move_grace_seconds)
+    try:
+        async with shard_session_makers[source]() as source_db, shard_session_makers[target]() as target_db:
+            moved = await _copy_rows(source_db, target_db, Question.user_id == user_id)
+    except Exception:
+        # 复制失败：清理目标分片中的部分数据，目录恢复为源分片
+        async with shard_session_makers[target]() as target_db:
+            await target_db.execute(delete(Question).where(Question.user_id == user_id))
+            await target_db.commit()
+        await redis_client.hset(DIRECTORY_KEY, user_id, source)
+        raise
+
+    await redis_client.hset(DIRECTORY_KEY, user_id, target)
+    async with shard_session_makers[source]() as source_db:
+        await source_db.execute(delete(Question).where(Question.user_id == user_id))
+        await source_db.commit()
+    logger.info(f"Moved {moved} question(s) of user {user_id} from shard {source} to shard {target}")
+    return moved
+
+
+async def import_from_primary(batch_size: int = 1000) -> int:
+    """将主库中已有的问答按用户复制到所在分片（启用分片时的一次性数据迁移），返回复制的行数"""
+    total = 0
+    last_id = 0
+    async with async_session_maker() as primary:
+        while True:
+            rows = (await primary.execute(
+                select(Question.__table__).where(Question.id > last_id).order_by(Question.id).limit(batch_size)
+            )).mappings().all()
+            if not rows:
+                return total
+            last_id = rows[-1]["id"]
+            by_user = {}
+            for row in rows:
+                by_user.setdefault(row["user_id"], []).append(dict(row))
+            for index, user_ids in (await group_by_shard(by_user)).items():
+                async with shard_session_makers[index]() as shard_db:
+                    await shard_db.execute(insert(Question.__table__), [row for user_id in user_ids for row in by_user[user_id]])
+                    await shard_db.commit()
+            total += len(rows)
+
+
+def plan_rebalance(counts: List[Dict[int, int]]) -> List[tuple]:
+    """
+    按问答数量均衡各分片：从高于平均值的分片中挑选用户迁往低于平均值的分片。
+    返回 [(user_id, 源分片, 目标分片), ...]
+    """
+    loads = [sum(shard.values()) for shard in counts]
+    average = sum(loads) / len(loads)
+    moves = []
+    for source, shard in enumerate(counts):
+        # 优先迁移数据量大的用户，减少迁移次数
+        for user_id, count in sorted(shard.items(), key=lambda item: -item[1]):
+            if loads[source] <= average:
+                break
+            target = min(range(len(loads)), key=lambda index: loads[index])
+            # 迁移后目标分片不能比源分片更重，否则只是在分片间来回搬运
+            if loads[target] + count >= loads[source]:
+                continue
+            moves.append((user_id, source, target))
+            loads[source] -= count
+            loads[target] += count
+    return moves
@@ -1,9 +1,12 @@
 from database import get_db
-from models import User
-from sqlalchemy import update
+from models import User, Prompt, UserPrompt
+from sqlalchemy import update, select
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
 import logging
+from config import settings
+from usage import take_pending_prompt_usage, ack_prompt_usage, trim_question_usage
 
 logger = logging.getLogger(__name__)
 
@@ -27,3 +30,47 @@ async def reset_model_quota():
             await db.commit()  # 提交所有更新
         except Exception as e:
             logger.error(f"Error updating model quota: {e}")
+            raise  # 交由调度器记录为失败，允许重试
+
+async def flush_usage_counts():
+    """
+    将 Redis 中累计的 Prompt 使用次数批量写入 user_prompts（一次 upsert），并裁剪热门问题排行
+    """
+    removed = await trim_question_usage(settings.usage_question_keep)
+    if removed:
+        logger.info(f"Trimmed {removed} questions from usage ranking")
+
+    counts = await take_pending_prompt_usage()
+    if not counts:
+        return
+
+    async for db in get_db():
+        try:
+            # 过滤掉已被删除的用户或 Prompt，避免外键错误导致整批失败
+            user_ids = {user_id for user_id, _ in counts}
+            prompt_ids = {prompt_id for _, prompt_id in counts}
+            valid_users = set((await db.execute(select(User.id).where(User.id.in_(user_ids)))).scalars())
+            valid_prompts = set((await db.execute(select(Prompt.id).where(Prompt.id.in_(prompt_ids)))).scalars())
+
+            now = datetime.now()
+            rows = [
+                {"user_id": user_id, "prompt_id": prompt_id, "usage_count": count, "created_at": now, "updated_at": now}
+                for (user_id, prompt_id), count in counts.items()
+                if user_id in valid_users and prompt_id in valid_prompts
+            ]
+            if rows:
+                stmt = insert(UserPrompt).values(rows)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[UserPrompt.user_id, UserPrompt.prompt_id],
+                    set_={
+                        "usage_count": UserPrompt.usage_count + stmt.excluded.usage_count,
+                        "updated_at": stmt.excluded.updated_at,
+                    },
+                )
+                await db.execute(stmt)
+                await db.commit()
+            await ack_prompt_usage()
+            logger.info(f"Flushed usage counts for {len(rows)} user prompts")
+        except Exception as e:
+            logger.error(f"Error flushing usage counts: {e}")
+            raise  # 交由调度器记录为失败，未确认的批次在下次执行时重新处理
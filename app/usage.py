@@ -0,0 +1,90 @@
+from database import redis_client
+from mylogger import logger
+from utils import content_hash
+
+# Redis 中的计数键
+PROMPT_PENDING_KEY = "usage:prompt:pending"    # hash: "user_id:prompt_id" -> 尚未刷入数据库的增量
+PROMPT_FLUSHING_KEY = "usage:prompt:flushing"  # 正在刷入数据库的一批增量
+PROMPT_TOP_KEY = "usage:prompt:top"            # zset: prompt_id -> 累计使用次数
+QUESTION_TOP_KEY = "usage:question:top"        # zset: 问题哈希 -> 累计使用次数
+QUESTION_TEXT_KEY = "usage:question:text"      # hash: 问题哈希 -> 问题文本（截断）
+
+QUESTION_TEXT_LIMIT = 200
+TRIM_BATCH = 1000
+
+
+async def record_usage(user_id: int, prompt_id: int, question_content: str):
+    """
+    记录一次 Prompt / 问题的使用，只写 Redis（一次管道往返），由定时任务批量刷入数据库
+    """
+    question_hash = content_hash(question_content)
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hincrby(PROMPT_PENDING_KEY, f"{user_id}:{prompt_id}", 1)
+        pipe.zincrby(PROMPT_TOP_KEY, 1, prompt_id)
+        pipe.zincrby(QUESTION_TOP_KEY, 1, question_hash)
+        pipe.hsetnx(QUESTION_TEXT_KEY, question_hash, question_content[:QUESTION_TEXT_LIMIT])
+        await pipe.execute()
+    except Exception as e:
+        # 计数失败不应影响主流程
+        logger.error(f"记录使用次数失败: {e}")
+
+
+async def trim_question_usage(keep: int) -> int:
+    """
+    只保留使用次数最多的 keep 个问题，删除其余问题的计数和文本，避免两个键随不同问题数无限增长。
+    按批取出排名最低的问题，在同一事务中 ZREM / HDEL，返回删除的问题数
+    """
+    removed = 0
+    excess = await redis_client.zcard(QUESTION_TOP_KEY) - keep
+    while excess > 0:
+        members = await redis_client.zrange(QUESTION_TOP_KEY, 0, min(excess, TRIM_BATCH) - 1)
+        if not members:
+            break
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.zrem(QUESTION_TOP_KEY, *members)
+        pipe.hdel(QUESTION_TEXT_KEY, *members)
+        await pipe.execute()
+        removed += len(members)
+        excess -= len(members)
+    return removed
+
+
+async def take_pending_prompt_usage() -> dict:
+    """
+    取出待刷入的 Prompt 使用增量，返回 {(user_id, prompt_id): count}
+    通过 RENAME 原子地切换到新的计数批次，刷入期间的新增计数不会丢失。
+    若上一次刷入失败，会先重新处理遗留的批次。
+    """
+    if not await redis_client.exists(PROMPT_FLUSHING_KEY):
+        if not await redis_client.exists(PROMPT_PENDING_KEY):
+            return {}
+        await redis_client.rename(PROMPT_PENDING_KEY, PROMPT_FLUSHING_KEY)
+
+    raw = await redis_client.hgetall(PROMPT_FLUSHING_KEY)
+    counts = {}
+    for field, value in raw.items():
+        user_id, prompt_id = field.split(":")
+        counts[(int(user_id), int(prompt_id))] = int(value)
+    return counts
+
+
+async def ack_prompt_usage():
+    """刷入数据库成功后删除已处理的批次"""
+    await redis_client.delete(PROMPT_FLUSHING_KEY)
+
+
+async def top_prompts(limit: int = 10):
+    rows = await redis_client.zrevrange(PROMPT_TOP_KEY, 0, limit - 1, withscores=True)
+    return [{"prompt_id": int(prompt_id), "usage_count": int(score)} for prompt_id, score in rows]
+
+
+async def top_questions(limit: int = 10):
+    rows = await redis_client.zrevrange(QUESTION_TOP_KEY, 0, limit - 1, withscores=True)
+    if not rows:
+        return []
+    texts = await redis_client.hmget(QUESTION_TEXT_KEY, [question_hash for question_hash, _ in rows])
+    return [
+        {"question_hash": question_hash, "question_content": text, "usage_count": int(score)}
+        for (question_hash, score), text in zip(rows, texts)
+    ]
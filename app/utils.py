@@ -1,16 +1,18 @@
+import hashlib
 from datetime import datetime, timedelta
 from jose import jwt
 from config import settings
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.ext.asyncio import AsyncSession
-from database import get_db, redis_client
+from database import async_session_maker, current_user_id, get_db, read_session, redis_client
 from crud.user import get_user_by_id
+from sharding import SHARDING_ENABLED, question_read_session, shard_session
 from mylogger import logger
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     if not token:
         raise HTTPException(status_code=401, detail="Missing token")
 
@@ -27,12 +29,41 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession
     if not await is_token_valid_for_user(user_id, token):
         raise HTTPException(status_code=401, detail="Token 已失效或被移除")
     
-    user = await get_user_by_id(db, user_id)
+    # 使用独立的短会话，查询完成即归还连接，不在整个请求期间占用；
+    # 返回的 user 已与会话分离，已加载的字段仍可直接读取
+    async with async_session_maker() as db:
+        user = await get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
-    
+
+    # 提交写操作后据此开启该用户的读写一致性路由
+    current_user_id.set(user_id)
     return user
 
+async def get_user_read_db(current_user = Depends(get_current_user)):
+    """当前用户的只读会话：走副本，用户近期有写入时走主库"""
+    async with read_session(current_user.id) as session:
+        yield session
+
+async def get_question_db(db: AsyncSession = Depends(get_db), current_user = Depends(get_current_user)):
+    """当前用户问答记录所在的会话：启用分片时为用户所在分片，否则即主库会话 db"""
+    if not SHARDING_ENABLED:
+        yield db
+        return
+    async with shard_session(current_user.id) as session:
+        yield session
+
+async def get_question_read_db(current_user = Depends(get_current_user)):
+    """读取当前用户问答记录的会话：启用分片时为用户所在分片，否则为只读副本会话"""
+    async with question_read_session(current_user.id) as session:
+        yield session
+
+async def get_current_admin(current_user = Depends(get_current_user)):
+    """仅允许管理员访问"""
+    if current_user.user_type != "admin":
+        raise HTTPException(status_code=403, detail="Permission denied")
+    return current_user
+
 def create_jwt(data: dict):
     """生成 JWT"""
     to_encode = data.copy()
@@ -94,3 +125,7 @@ async def is_token_valid_for_user(user_id: int, token: str) -> bool:
     redis_key = f"devices:{user_id}"
     tokens = await redis_client.lrange(redis_key, 0, -1)
     return token in tokens
+
+def content_hash(text: str) -> str:
+    """计算文本内容的哈希，用作 Redis 键或去重依据"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
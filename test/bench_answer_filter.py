@@ -0,0 +1,48 @@
+"""
+Bloom 过滤器容量基准：N 条已有回答时的内存占用、构建耗时与实测误判率
+
+    cd test && python bench_answer_filter.py --entries 10000000 --error-rate 0.01 --probes 1000000
+
+按 answer_filter_capacity = N 创建过滤器，加入 N 个不同的 (user_id, prompt_id, 问题) 键，
+再用 probes 个从未加入的键查询，统计被判为"可能存在"的比例（即多出的一次数据库查询）。
+只使用 app/answer_filter.py 中的 BloomFilter，不访问数据库和 Redis（仍需与服务相同的环境变量以加载配置）。
+"""
+import argparse
+import os
+import sys
+import time
+
+from logger import logger
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from answer_filter import BloomFilter, digest  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=10_000_000)
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--probes", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    bloom = BloomFilter(args.entries, args.error_rate)
+    logger.info(f"容量 {args.entries}，目标误判率 {args.error_rate:.2%}：{bloom.size} 位（{len(bloom.bits) / 2 ** 20:.2f} MiB），{bloom.hashes} 个哈希函数")
+
+    start = time.perf_counter()
+    for i in range(args.entries):
+        bloom.add(digest(i % 100_000, i % 50, f"question {i}"))
+    elapsed = time.perf_counter() - start
+    logger.info(f"加入 {args.entries} 条耗时 {elapsed:.1f}s（{elapsed / args.entries * 1e6:.2f} µs/条）")
+
+    start = time.perf_counter()
+    false_positives = sum(digest(i % 100_000, i % 50, f"absent {i}") in bloom for i in range(args.probes))
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"实测误判率 {false_positives / args.probes:.4%}（{false_positives}/{args.probes}），"
+        f"理论值 {bloom.expected_error_rate():.4%}，查询 {elapsed / args.probes * 1e6:.2f} µs/次"
+    )
+
+
+if __name__ == "__main__":
+    main()
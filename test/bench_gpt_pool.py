@@ -0,0 +1,95 @@
+"""
+连接池容量基准：固定大小的连接池能同时支撑多少个进行中的 /gpt 生成
+
+    cd test && DB_POOL_SIZE=5 DB_MAX_OVERFLOW=0 DB_POOL_TIMEOUT=5 python bench_gpt_pool.py --concurrency 50 --latency 3
+
+在进程内加载 app/main.py，以模拟的大模型客户端（固定延迟后返回）替换真实调用，
+通过 httpx 的 ASGITransport 并发发起 N 个不同问题的 /gpt 请求，
+统计成功/失败数、总耗时以及连接池中同时签出的最大连接数。
+大模型调用期间不持有数据库连接时，N 远大于连接池大小也应全部成功，总耗时约等于一次调用的延迟。
+需要与服务相同的环境变量（.env），数据库和 Redis 需可用，且用户已存在（配额需足够）。
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from types import SimpleNamespace
+
+import httpx
+from logger import logger
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import llm  # noqa: E402
+from database import engine  # noqa: E402
+from main import app  # noqa: E402
+
+
+class DelayedCompletions:
+    """模拟大模型的流式接口：等待 latency 秒后返回一段回答"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def create(self, **kwargs):
+        return self.stream()
+
+    async def stream(self):
+        await asyncio.sleep(self.latency)
+        yield SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content="ok"))])
+
+
+async def sample_pool(stop: asyncio.Event, peak: list):
+    while not stop.is_set():
+        peak[0] = max(peak[0], engine.pool.checkedout())
+        await asyncio.sleep(0.01)
+
+
+async def run(args):
+    llm._client = SimpleNamespace(chat=SimpleNamespace(completions=DelayedCompletions(args.latency)))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        login = await client.post("/auth/login", json={"username": args.username, "password": args.password})
+        login.raise_for_status()
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        me = await client.get("/auth/me", headers=headers)
+        me.raise_for_status()
+        user_id = me.json()["id"]
+        prompt = await client.post("/prompts/", json={"content": "bench", "user_id": user_id}, headers=headers)
+        prompt.raise_for_status()
+        prompt = prompt.json()
+
+        async def one(index: int) -> int:
+            payload = {"question_content": f"bench {uuid.uuid4().hex} {index}", "prompt_id": prompt["id"], "user_id": user_id}
+            try:
+                return (await client.post("/gpt/", json=payload, headers=headers)).status_code
+            except Exception as e:
+                logger.error(f"请求失败: {e}")
+                return 0
+
+        stop, peak = asyncio.Event(), [0]
+        sampler = asyncio.create_task(sample_pool(stop, peak))
+        start = time.perf_counter()
+        statuses = await asyncio.gather(*(one(index) for index in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await sampler
+
+    ok = sum(1 for status in statuses if status == 200)
+    logger.info(
+        f"并发 {args.concurrency}，连接池 {engine.pool.size()}+{engine.pool._max_overflow}，"
+        f"成功 {ok}，失败 {args.concurrency - ok}，耗时 {elapsed:.2f}s（单次调用 {args.latency}s），"
+        f"同时签出的连接数峰值 {peak[0]}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--username", default="test")
+    parser.add_argument("--password", default="test")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=3.0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
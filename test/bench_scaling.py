@@ -0,0 +1,95 @@
+"""
+多进程吞吐扩展性基准：分别以 1..N 个 worker 启动 gunicorn，压测同一接口，对比吞吐
+
+    cd test && python bench_scaling.py --workers 1 2 4 --username alice --password secret
+
+默认压测 /auth/login（bcrypt 校验，CPU 密集），可用 --path/--method 改为其他接口。
+需要与服务相同的环境变量（.env），数据库和 Redis 需可用，且用户已存在。
+理想情况下吞吐随 worker 数线性增长，效率 = 吞吐 / (单 worker 吞吐 × worker 数)。
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from logger import logger
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+
+def wait_ready(base_url: str, timeout: float):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if requests.get(f"{base_url}/readyz", timeout=0.5).status_code == 200:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.1)
+    raise TimeoutError(base_url)
+
+
+def run_load(base_url: str, args) -> float:
+    """以 args.concurrency 个并发连接持续压测 args.duration 秒，返回成功请求的 QPS"""
+    payload = {"username": args.username, "password": args.password} if args.path == "/auth/login" else None
+    deadline = time.perf_counter() + args.duration
+
+    def worker():
+        ok = errors = 0
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            try:
+                response = session.request(args.method, f"{base_url}{args.path}", json=payload, timeout=30)
+                if response.status_code < 400:
+                    ok += 1
+                else:
+                    errors += 1
+            except requests.exceptions.RequestException:
+                errors += 1
+        return ok, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda _: worker(), range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    ok = sum(r[0] for r in results)
+    errors = sum(r[1] for r in results)
+    if errors:
+        logger.warning(f"{errors} 个请求失败")
+    return ok / elapsed
+
+
+def bench(workers: int, args) -> float:
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), BIND=f"127.0.0.1:{args.port}")
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:app"], cwd=APP_DIR, env=env)
+    try:
+        base_url = f"http://127.0.0.1:{args.port}"
+        wait_ready(base_url, timeout=60)
+        run_load(base_url, argparse.Namespace(**{**vars(args), "duration": 2}))  # 预热
+        return run_load(base_url, args)
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, os.cpu_count()])
+    parser.add_argument("--path", default="/auth/login")
+    parser.add_argument("--method", default="POST")
+    parser.add_argument("--username", default="test")
+    parser.add_argument("--password", default="test")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    baseline = None
+    for workers in sorted(set(args.workers)):
+        qps = bench(workers, args)
+        baseline = baseline or qps
+        logger.info(f"workers={workers:<3} {qps:8.1f} req/s  加速比 {qps / baseline:5.2f}x  效率 {qps / baseline / workers:6.1%}")
@@ -0,0 +1,77 @@
+"""
+对比 100 条历史记录一页的序列化 CPU 耗时
+
+    cd test && python bench_serialization.py
+
+- pydantic: response_model 校验 + 标准库 json 编码（原有路径）
+- orjson / msgpack: 直接编码 dict
+- preserialized: 缓存中已编码好的字节直接透传
+"""
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from pydantic import TypeAdapter
+from fastapi.encoders import jsonable_encoder
+from logger import logger
+from schemas import QuestionResponse
+from responses import Preserialized, dump_json, dump_msgpack
+
+ITEMS = 100
+ROUNDS = 500
+
+answer = "一、简要回应问题，明确目标和原则。二、详细展开行动方案，逻辑清晰，层次分明。" * 20  # 约 800 字
+now = datetime.now()
+page = [
+    {
+        "id": i,
+        "question_content": "为吸引青年人才来本地就业发展，某市打造多家青年驿站，假如由你负责，你怎么做？",
+        "answer_content": answer,
+        "user_id": 1,
+        "prompt_id": 1,
+        "created_at": now - timedelta(minutes=i),
+        "updated_at": now - timedelta(minutes=i),
+    }
+    for i in range(ITEMS)
+]
+adapter = TypeAdapter(List[QuestionResponse])
+cached = Preserialized(dump_json(page))
+
+
+def via_pydantic():
+    validated = adapter.validate_python(page)
+    return json.dumps(jsonable_encoder(validated), ensure_ascii=False).encode("utf-8")
+
+
+def via_orjson():
+    return dump_json(page)
+
+
+def via_msgpack():
+    return dump_msgpack(page)
+
+
+def via_preserialized():
+    return cached.body
+
+
+def bench(name, fn):
+    size = len(fn())
+    start = time.process_time()
+    for _ in range(ROUNDS):
+        fn()
+    per_request = (time.process_time() - start) / ROUNDS * 1e6
+    logger.info(f"{name:>14}: {per_request:9.1f} µs CPU/请求, {size / 1024:7.1f} KiB")
+    return per_request
+
+
+if __name__ == "__main__":
+    baseline = bench("pydantic+json", via_pydantic)
+    for name, fn in [("orjson", via_orjson), ("msgpack", via_msgpack), ("preserialized", via_preserialized)]:
+        cost = bench(name, fn)
+        logger.info(f"{'':>14}  相对原有路径加速 {baseline / max(cost, 1e-3):.1f}x")
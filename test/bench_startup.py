@@ -0,0 +1,88 @@
+"""
+冷启动基准：导入耗时与首个请求可用时间
+
+    cd test && python bench_startup.py --target 3.0
+
+1. 多次在新进程中 import main，统计导入耗时，并列出 -X importtime 中最慢的模块
+2. 启动 uvicorn，轮询 /healthz 与 /readyz，记录进程启动到可用的时间
+需要与服务相同的环境变量（.env），/readyz 依赖数据库和 Redis 可用。
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import requests
+from logger import logger
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+
+def measure_import(rounds: int) -> float:
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import main"], cwd=APP_DIR, check=True, capture_output=True)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    median = timings[len(timings) // 2]
+    logger.info(f"import main: 中位数 {median:.3f}s, 最快 {timings[0]:.3f}s, 最慢 {timings[-1]:.3f}s")
+    return median
+
+
+def slowest_imports(top: int):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=APP_DIR, capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.split("|")]
+        rows.append((int(cumulative_us), name))
+    # 列出累计耗时最高的若干模块
+    for cumulative_us, name in sorted(rows, reverse=True)[:top]:
+        logger.info(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+
+def wait_for(url: str, deadline: float) -> float:
+    while time.perf_counter() < deadline:
+        try:
+            if requests.get(url, timeout=0.5).status_code == 200:
+                return time.perf_counter()
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.02)
+    raise TimeoutError(url)
+
+
+def measure_time_to_first_request(port: int, timeout: float) -> float:
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=APP_DIR,
+    )
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        alive = wait_for(f"{base_url}/healthz", start + timeout) - start
+        ready = wait_for(f"{base_url}/readyz", start + timeout) - start
+        logger.info(f"进程启动 -> /healthz 可用: {alive:.3f}s, -> /readyz 就绪: {ready:.3f}s")
+        return ready
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--target", type=float, default=None, help="就绪时间目标（秒），超出时以非零状态退出")
+    args = parser.parse_args()
+
+    measure_import(args.rounds)
+    slowest_imports(top=10)
+    ready = measure_time_to_first_request(args.port, timeout=60)
+
+    if args.target is not None and ready > args.target:
+        logger.error(f"就绪时间 {ready:.3f}s 超出目标 {args.target:.3f}s")
+        sys.exit(1)
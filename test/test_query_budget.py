@@ -0,0 +1,209 @@
+"""
+路由 SQL 语句数预算测试（见 app/profiling.py 的 @query_budget / assert_max_queries）
+
+    pip install -r app/requirements.txt -r test/requirements.txt
+    cd test && python -m pytest -q test_query_budget.py
+
+开启 QUERY_BUDGET_STRICT，在进程内用 FastAPI TestClient 依次调用所有声明了 @query_budget 的路由，
+任一路由执行的 SQL 语句数超出预算时 ProfilingMiddleware 抛出 QueryBudgetExceeded，测试失败。
+数据库为临时 SQLite 文件，Redis 使用进程内的 fakeredis，大模型调用替换为立即返回的模拟客户端，
+不需要外部服务。依赖见 test/requirements.txt：历史记录缓存、幂等和令牌桶使用 Lua 脚本（EVAL），
+fakeredis 需要 lupa（fakeredis[lua]）才能执行，缺少时跳过本模块，避免被误报为查询数超出预算。
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+_db_dir = tempfile.mkdtemp(prefix="query_budget_")
+os.environ.update({
+    "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(_db_dir, 'test.sqlite')}",
+    "READ_REPLICA_URLS": "",
+    "QUESTION_SHARD_URLS": "",
+    "QUERY_BUDGET_STRICT": "true",
+})
+for name, value in {
+    "API_URL": "http://127.0.0.1:9",
+    "REDIS_URL": "redis://localhost:6379/0",
+    "JWT_SECRET_KEY": "test",
+    "JWT_ALGORITHM": "HS256",
+    "ADMIN_KEY": "test",
+}.items():
+    os.environ.setdefault(name, value)
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+sys.path.insert(0, APP_DIR)
+
+pytest.importorskip("lupa", reason="fakeredis 需要 lupa 执行 Lua 脚本：pip install 'fakeredis[lua]'")
+
+import fakeredis  # noqa: E402
+from fastapi.routing import APIRoute  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy.future import select  # noqa: E402
+
+import database  # noqa: E402
+import llm  # noqa: E402
+from database import Base, async_session_maker, engine  # noqa: E402
+from main import app  # noqa: E402
+from models import User  # noqa: E402
+from profiling import QueryBudgetExceeded, assert_max_queries  # noqa: E402
+from routes import gpt_routes, prompt_routes, question_routes, user_routes  # noqa: E402
+
+# 各模块通过 from database import redis_client 持有同一个客户端，统一替换为 fakeredis
+_redis, _real_redis = fakeredis.FakeAsyncRedis(decode_responses=True), database.redis_client
+for _module in list(sys.modules.values()):
+    if getattr(_module, "redis_client", None) is _real_redis:
+        _module.redis_client = _redis
+
+
+class _Completions:
+    """模拟大模型的流式接口：立即返回一段回答"""
+
+    async def create(self, **kwargs):
+        return self.stream()
+
+    async def stream(self):
+        yield SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content="answer"))])
+
+
+llm._client = SimpleNamespace(chat=SimpleNamespace(completions=_Completions()))
+
+
+async def _create_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+
+@pytest.fixture(scope="module")
+def client():
+    asyncio.run(_create_tables())
+    return TestClient(app)
+
+
+@pytest.fixture(scope="module")
+def auth(client):
+    response = client.post("/auth/register", json={"username": "budget", "password": "pw"})
+    assert response.status_code == 200, response.text
+    user_id = response.json()["id"]
+    client.put(f"/auth/{user_id}", json={"username": "budget", "user_type": "admin", "status": "active", "model_quota": 100})
+    response = client.post("/auth/login", json={"username": "budget", "password": "pw"})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}, response.json()["user"]
+
+
+# 与 main.py 中 include_router 的前缀一致
+ROUTERS = {
+    "/auth": user_routes.router,
+    "/questions": question_routes.router,
+    "/gpt": gpt_routes.router,
+    "/prompts": prompt_routes.router,
+}
+
+
+def _budgeted_routes():
+    return {
+        (method, prefix + route.path)
+        for prefix, router in ROUTERS.items()
+        for route in router.routes
+        if isinstance(route, APIRoute) and hasattr(route.endpoint, "__query_budget__")
+        for method in route.methods
+    }
+
+
+# 按顺序调用的路由：(方法, 路由模板)，模板中的参数由 test_route_budgets 填充
+CALLS = [
+    ("POST", "/auth/register"),
+    ("POST", "/auth/login"),
+    ("GET", "/auth/me"),
+    ("POST", "/auth/"),
+    ("GET", "/auth/{user_id}"),
+    ("GET", "/auth/"),
+    ("PUT", "/auth/{user_id}"),
+    ("POST", "/prompts/"),
+    ("GET", "/prompts/{prompt_id}"),
+    ("GET", "/prompts/"),
+    ("PUT", "/prompts/{prompt_id}"),
+    ("POST", "/questions/"),
+    ("GET", "/questions/history"),
+    ("GET", "/questions/search"),
+    ("GET", "/questions/{question_id}"),
+    ("GET", "/questions/"),
+    ("PUT", "/questions/update-by-original-content"),
+    ("PUT", "/questions/{question_id}"),
+    ("POST", "/gpt/"),
+    ("POST", "/gpt/fan-out"),
+    ("DELETE", "/questions/{question_id}"),
+    ("DELETE", "/prompts/{prompt_id}"),
+    ("DELETE", "/auth/{user_id}"),
+]
+
+
+def test_every_budgeted_route_is_called():
+    assert _budgeted_routes() == set(CALLS)
+
+
+def test_route_budgets(client, auth):
+    headers, user = auth
+    ids = {"user_id": None, "prompt_id": None, "question_id": None}
+    bodies = {
+        ("POST", "/auth/register"): {"username": "budget2", "password": "pw"},
+        ("POST", "/auth/login"): {"username": "budget", "password": "pw"},
+        ("POST", "/auth/"): {"username": "budget3", "password": "pw"},
+        ("PUT", "/auth/{user_id}"): {"username": "budget3", "user_type": "basic", "status": "active", "model_quota": 10},
+        ("POST", "/prompts/"): {"content": "prompt", "user_id": user["user_id"]},
+        ("PUT", "/prompts/{prompt_id}"): {"content": "prompt v2"},
+        ("POST", "/questions/"): {"question_content": "first question", "user_id": user["user_id"], "prompt_id": user["prompt_ids"][0]},
+        ("PUT", "/questions/update-by-original-content"): {"original_content": "first question", "answer_content": "a"},
+        ("PUT", "/questions/{question_id}"): {"question_content": "first question", "answer_content": "b", "prompt_id": user["prompt_ids"][0]},
+        ("POST", "/gpt/"): {"question_content": "gpt question", "prompt_id": user["prompt_ids"][0], "user_id": user["user_id"]},
+        ("POST", "/gpt/fan-out"): {"question_content": "gpt question", "prompt_ids": user["prompt_ids"][:1]},
+    }
+    params = {("GET", "/questions/search"): {"q": "question"}}
+
+    for method, path in CALLS:
+        url = path.format(**ids)
+        # 严格模式下超出预算会在这里抛出 QueryBudgetExceeded
+        response = client.request(method, url, headers=headers, json=bodies.get((method, path)), params=params.get((method, path)))
+        assert response.status_code == 200, f"{method} {url}: {response.status_code} {response.text}"
+        if (method, path) == ("POST", "/auth/"):
+            ids["user_id"] = response.json()["id"]
+        elif (method, path) == ("POST", "/prompts/"):
+            ids["prompt_id"] = response.json()["id"]
+        elif (method, path) == ("POST", "/questions/"):
+            ids["question_id"] = response.json()["id"]
+
+
+def test_route_over_budget_fails(client, auth, monkeypatch):
+    headers, _ = auth
+    route = next(route for route in user_routes.router.routes if isinstance(route, APIRoute) and route.path == "/me")
+    monkeypatch.setattr(route.endpoint, "__query_budget__", 0)
+    with pytest.raises(QueryBudgetExceeded):
+        client.get("/auth/me", headers=headers)
+
+
+async def _select_users(times: int):
+    async with async_session_maker() as db:
+        for _ in range(times):
+            (await db.execute(select(User))).scalars().all()
+
+
+def test_assert_max_queries_within_budget(client):
+    async def run():
+        with assert_max_queries(2) as profile:
+            await _select_users(2)
+        return profile.sql_count
+
+    assert asyncio.run(run()) == 2
+
+
+def test_assert_max_queries_over_budget(client):
+    async def run():
+        with assert_max_queries(1, "select users"):
+            await _select_users(2)
+
+    with pytest.raises(QueryBudgetExceeded, match="select users"):
+        asyncio.run(run())